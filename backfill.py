@@ -0,0 +1,206 @@
+"""
+Импорт истории канала из JSON-экспорта Telegram Desktop (result.json).
+
+Экспорт читается потоково: в памяти находится только текущий фрагмент файла
+и очередная пачка товаров. Посты разбираются той же логикой, что и новые
+посты канала (ingest.parse_post_text), и записываются пачками через
+executemany в одной транзакции на пачку.
+
+Как и обработчик новых постов канала, импорт только добавляет товары: товары,
+уже существующие в БД (добавленные из канала позже или измененные
+администратором), не изменяются. Из нескольких постов с одним названием берется
+первый. В экспорте нет file_id Telegram, поэтому медиа импортированных товаров
+не заполняются.
+
+Экспорт другого канала (id в заголовке не совпадает с SOURCE_CHANNEL_ID)
+не импортируется без --force.
+
+Запуск: python -m backfill path/to/result.json [--batch-size 5000] [--force]
+После импорта из работающего бота кэш каталога перечитывается один раз (см. /sync).
+"""
+import argparse
+import json
+import logging
+import re
+import sqlite3
+import time
+from typing import NamedTuple
+
+from db import DB_NAME, DB_BUSY_TIMEOUT_MS
+from ingest import CategoryMatcher, parse_post_text
+
+logger = logging.getLogger(__name__)
+
+BACKFILL_BATCH_SIZE = 5000
+READ_CHUNK_SIZE = 1 << 20
+
+_MESSAGES_KEY_RE = re.compile(r'"messages"\s*:\s*\[')
+_EXPORT_ID_RE = re.compile(r'"id"\s*:\s*(-?\d+)')
+
+INSERT_PRODUCT_SQL = """
+    INSERT INTO products (name, description, price, price_numeric, price_amount, price_currency, year, category_name)
+    VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+    ON CONFLICT(name) DO NOTHING
+"""
+
+
+class BackfillResult(NamedTuple):
+    messages: int
+    products: int
+    seconds: float
+
+
+def _read_header(f, chunk_size: int) -> tuple[str, re.Match]:
+    """Читает файл до начала массива "messages": (прочитанный текст, совпадение ключа)."""
+    buffer = ""
+    while True:
+        match = _MESSAGES_KEY_RE.search(buffer)
+        if match:
+            return buffer, match
+        chunk = f.read(chunk_size)
+        if not chunk:
+            raise ValueError("В файле не найден массив \"messages\": это не экспорт Telegram Desktop?")
+        buffer += chunk
+
+
+def export_chat_id(path: str, chunk_size: int = READ_CHUNK_SIZE) -> int | None:
+    """id чата из заголовка экспорта (до массива "messages") или None, если его там нет."""
+    with open(path, "r", encoding="utf-8") as f:
+        buffer, match = _read_header(f, chunk_size)
+    header_id = _EXPORT_ID_RE.search(buffer, 0, match.start())
+    return int(header_id.group(1)) if header_id else None
+
+
+def iter_export_messages(path: str, chunk_size: int = READ_CHUNK_SIZE):
+    """Потоково выдает объекты массива "messages" из экспорта Telegram Desktop."""
+    decoder = json.JSONDecoder()
+    with open(path, "r", encoding="utf-8") as f:
+        buffer, match = _read_header(f, chunk_size)
+        buffer = buffer[match.end():]
+        pos = 0
+        eof = False
+        while True:
+            # Пропускаем разделители между элементами массива
+            while True:
+                while pos < len(buffer) and buffer[pos] in " \t\r\n,":
+                    pos += 1
+                if pos < len(buffer) or eof:
+                    break
+                chunk = f.read(chunk_size)
+                eof = not chunk
+                buffer, pos = buffer[pos:] + chunk, 0
+            if pos >= len(buffer):
+                raise ValueError("Экспорт обрывается внутри массива \"messages\".")
+            if buffer[pos] == "]":
+                return
+            try:
+                message, end = decoder.raw_decode(buffer, pos)
+            except json.JSONDecodeError:
+                if eof:
+                    raise
+                # Объект не поместился в буфер целиком: дочитываем следующий фрагмент
+                chunk = f.read(chunk_size)
+                eof = not chunk
+                buffer, pos = buffer[pos:] + chunk, 0
+                continue
+            yield message
+            pos = end
+            if pos > chunk_size:
+                buffer, pos = buffer[pos:], 0
+
+
+def message_text(message: dict) -> str:
+    """Плоский текст сообщения экспорта: text бывает строкой или списком фрагментов с разметкой."""
+    text = message.get("text", "")
+    if isinstance(text, str):
+        return text
+    return "".join(part if isinstance(part, str) else part.get("text", "") for part in text)
+
+
+def channel_matches(export_chat_id: int | None, source_channel_id) -> bool:
+    """В экспорте id канала хранится без префикса -100, в конфиге - с ним."""
+    if export_chat_id is None or source_channel_id is None:
+        return True
+    source = str(source_channel_id)
+    return source in (str(export_chat_id), f"-100{export_chat_id}")
+
+
+def run(path: str, usd_rate: float | None, db_path: str = DB_NAME, batch_size: int = BACKFILL_BATCH_SIZE,
+        source_channel_id=None, force: bool = False) -> BackfillResult:
+    """
+    Добавляет в таблицу products товары из постов экспорта, которых еще нет в БД.
+    Выполняется синхронно в вызывающем потоке со своим соединением SQLite.
+    ValueError, если экспорт относится к другому каналу и force не задан.
+    """
+    started = time.perf_counter()
+    chat_id = export_chat_id(path)
+    if not channel_matches(chat_id, source_channel_id):
+        if not force:
+            raise ValueError(f"Экспорт относится к чату {chat_id}, а не к SOURCE_CHANNEL_ID {source_channel_id}.")
+        logger.warning(f"Импорт экспорта чата {chat_id} вместо SOURCE_CHANNEL_ID {source_channel_id} (--force).")
+    conn = sqlite3.connect(db_path, timeout=DB_BUSY_TIMEOUT_MS / 1000)
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute("PRAGMA synchronous=NORMAL")
+    try:
+        categories = [row[0] for row in conn.execute("SELECT name FROM categories ORDER BY id")]
+        matcher = CategoryMatcher(categories)
+        messages = products = 0
+        batch = {}
+
+        def flush():
+            nonlocal products
+            if batch:
+                with conn:
+                    products += conn.executemany(INSERT_PRODUCT_SQL, list(batch.values())).rowcount
+                batch.clear()
+
+        for message in iter_export_messages(path):
+            if message.get("type") != "message":
+                continue
+            messages += 1
+            parsed = parse_post_text(message_text(message), matcher, usd_rate)
+            if not parsed:
+                continue
+            category, product_name, details = parsed
+            # Как и в БД, более поздний пост с тем же названием не заменяет ранний
+            if product_name in batch:
+                continue
+            batch[product_name] = (product_name, details["description"], details["price"], details["price_numeric"],
+                                   details["price_amount"], details["price_currency"], details["year"], category)
+            if len(batch) >= batch_size:
+                flush()
+        flush()
+    finally:
+        conn.close()
+    result = BackfillResult(messages, products, time.perf_counter() - started)
+    logger.info(f"Импорт истории канала завершен: сообщений {result.messages}, новых товаров {result.products}, "
+                f"{result.seconds:.1f} с.")
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("path", help="Путь к result.json из экспорта Telegram Desktop")
+    parser.add_argument("--batch-size", type=int, default=BACKFILL_BATCH_SIZE)
+    parser.add_argument("--usd-rate", type=float, default=None,
+                        help="Курс USD/UAH для цен в долларах (по умолчанию последний сохраненный в БД)")
+    parser.add_argument("--force", action="store_true",
+                        help="Импортировать, даже если экспорт относится не к SOURCE_CHANNEL_ID")
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s - %(name)s - %(levelname)s - %(message)s")
+
+    from config import SOURCE_CHANNEL_ID
+    from currency_converter import CACHE_KEY
+    from db import init_db
+    init_db()
+    usd_rate = args.usd_rate
+    if usd_rate is None:
+        with sqlite3.connect(DB_NAME) as conn:
+            row = conn.execute("SELECT rate FROM currency_rates WHERE pair = ?", (CACHE_KEY,)).fetchone()
+        usd_rate = row[0] if row else None
+    run(args.path, usd_rate, batch_size=args.batch_size, source_channel_id=SOURCE_CHANNEL_ID,
+        force=args.force)
+
+
+if __name__ == "__main__":
+    main()
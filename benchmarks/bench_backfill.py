@@ -0,0 +1,58 @@
+"""
+Бенчмарк импорта истории канала из экспорта Telegram Desktop.
+
+Генерирует result.json с заданным числом постов и импортирует его во временную БД
+(сначала в пустую, затем повторно - все товары уже есть в БД и пропускаются).
+
+Запуск: python -m benchmarks.bench_backfill [--posts 100000] [--batch-size 5000]
+"""
+import argparse
+import os
+import sqlite3
+import tempfile
+import time
+
+import db
+import backfill
+from benchmarks.datagen import MODELS, write_channel_export
+
+USD_RATE = 41.5
+
+
+def run(posts: int, batch_size: int, seed: int = 42) -> dict:
+    with tempfile.TemporaryDirectory() as tmp:
+        export_path = os.path.join(tmp, "result.json")
+        db.DB_NAME = os.path.join(tmp, "bench.db")
+        started = time.perf_counter()
+        write_channel_export(export_path, posts, seed=seed)
+        generate_seconds = time.perf_counter() - started
+        db.init_db()
+        with sqlite3.connect(db.DB_NAME) as conn:
+            conn.executemany("INSERT OR IGNORE INTO categories (name) VALUES (?)", [(name,) for name in MODELS])
+
+        first = backfill.run(export_path, USD_RATE, db_path=db.DB_NAME, batch_size=batch_size)
+        second = backfill.run(export_path, USD_RATE, db_path=db.DB_NAME, batch_size=batch_size)
+        with sqlite3.connect(db.DB_NAME) as conn:
+            stored = conn.execute("SELECT COUNT(*) FROM products").fetchone()[0]
+        return {
+            "posts": posts,
+            "export_mb": round(os.path.getsize(export_path) / 2 ** 20, 1),
+            "generate_seconds": round(generate_seconds, 2),
+            "import_seconds": round(first.seconds, 2),
+            "import_posts_per_sec": round(first.messages / first.seconds),
+            "reimport_seconds": round(second.seconds, 2),
+            "products": stored,
+        }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--posts", type=int, default=100_000)
+    parser.add_argument("--batch-size", type=int, default=backfill.BACKFILL_BATCH_SIZE)
+    args = parser.parse_args()
+    for key, value in run(args.posts, args.batch_size).items():
+        print(f"{key}: {value}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,126 @@
+"""
+Бенчмарк разбора постов канала: скорость в постах в секунду.
+
+Сравнивает прежний разбор (запрос категорий и компиляция регулярных выражений
+на каждый пост) со скомпилированным CategoryMatcher и шаблонами уровня модуля.
+
+Запуск: python -m benchmarks.bench_ingest [--posts 20000] [--categories 40]
+"""
+import argparse
+import re
+import time
+
+from benchmarks.datagen import MODELS, post_texts
+from ingest import CategoryMatcher, parse_post_text
+
+USD_RATE = 41.5
+
+
+def legacy_process_price_string(text_with_price, usd_rate):
+    """Копия прежней реализации: шаблон цены компилируется при каждом вызове."""
+    price_pattern = re.compile(
+        r'Цена\s*[:\-]*\s*([\d\s.,]+)\s*?(\$|usd|eur|€|грн|uah|руб|rub)|'
+        r'([\d\s.,]+)\s*?(\$|usd|eur|€|грн|uah|руб|rub)',
+        re.IGNORECASE | re.UNICODE
+    )
+    price_display = "По запросу"
+    price_numeric = None
+    cleaned_text = text_with_price
+    match = price_pattern.search(text_with_price)
+    if match:
+        if match.group(1):
+            price_str = match.group(1)
+            currency = match.group(2).lower() if match.group(2) else ''
+        else:
+            price_str = match.group(3)
+            currency = match.group(4).lower() if match.group(4) else ''
+        price_value = float(re.sub(r'[^\d.]', '', price_str.replace(',', '.')))
+        currency_symbol = currency.replace('usd','$').replace('eur', '€').replace('грн', 'UAH').replace('uah', 'UAH').upper()
+        price_display = f"{int(price_value) if price_value.is_integer() else price_value} {currency_symbol}"
+        if currency in ['$', 'usd']:
+            if usd_rate:
+                price_numeric = int(price_value * usd_rate * 100)
+        elif currency in ['грн', 'uah']:
+            price_numeric = int(price_value * 100)
+        lines = text_with_price.splitlines()
+        cleaned_lines = [line for line in lines if not price_pattern.search(line)]
+        cleaned_text = "\n".join(cleaned_lines).strip()
+    return price_display, price_numeric, cleaned_text
+
+
+def legacy_parse(text, categories, usd_rate):
+    """Копия прежнего parse_message_for_product без медиа."""
+    text_lower = text.lower()
+    category = None
+    for cat_name in categories:
+        if re.search(r'\b' + re.escape(cat_name.lower()) + r'\b', text_lower, re.UNICODE):
+            category = cat_name
+            break
+    if not category: return None
+    lines = [line for line in text.splitlines() if line.strip()]
+    if not lines: return None
+    product_name = None
+    if category.lower() in lines[0].lower():
+        product_name = lines[0].strip()
+    else:
+        for line in lines:
+            if category.lower() in line.lower():
+                product_name = line.strip()
+                break
+    if not product_name: product_name = lines[0].strip()
+    if len(product_name) > 100: product_name = product_name[:97] + "..."
+    price_display, price_numeric, cleaned_description = legacy_process_price_string(text, usd_rate)
+    year_match = re.search(r'\b(20\d{2})\b', text)
+    year = int(year_match.group(1)) if year_match else None
+    return category, product_name, {"description": cleaned_description, "price": price_display,
+                                    "price_numeric": price_numeric, "year": year}
+
+
+def make_categories(count: int) -> list[str]:
+    """Реальные категории в конце списка и синтетические перед ними (худший случай для перебора)."""
+    synthetic = [f"Accessory {i}" for i in range(max(0, count - len(MODELS)))]
+    return synthetic + list(MODELS)
+
+
+def run(posts: int, categories: int, seed: int = 42) -> dict:
+    texts = post_texts(posts, seed)
+    names = make_categories(categories)
+    matcher = CategoryMatcher(names)
+
+    started = time.perf_counter()
+    legacy = [legacy_parse(text, names, USD_RATE) for text in texts]
+    legacy_seconds = time.perf_counter() - started
+
+    started = time.perf_counter()
+    current = [parse_post_text(text, matcher, USD_RATE) for text in texts]
+    current_seconds = time.perf_counter() - started
+
+    def comparable(parsed):
+        # Исходная сумма и валюта появились позже прежней реализации и в сравнении не участвуют
+        if parsed is None:
+            return None
+        category, name, details = parsed
+        return category, name, {key: details[key] for key in ("description", "price", "price_numeric", "year")}
+
+    mismatches = sum(a != comparable(b) for a, b in zip(legacy, current))
+    return {
+        "posts": posts,
+        "categories": len(names),
+        "legacy_posts_per_sec": round(posts / legacy_seconds),
+        "compiled_posts_per_sec": round(posts / current_seconds),
+        "speedup": round(legacy_seconds / current_seconds, 2),
+        "mismatches": mismatches,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--posts", type=int, default=20_000)
+    parser.add_argument("--categories", type=int, default=40)
+    args = parser.parse_args()
+    for key, value in run(args.posts, args.categories).items():
+        print(f"{key}: {value}")
+
+
+if __name__ == "__main__":
+    main()
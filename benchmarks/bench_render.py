@@ -0,0 +1,79 @@
+"""
+Микробенчмарк отрисовки клавиатур и карточек товаров.
+
+Сравнивает построение разметки на каждый апдейт (до кэширования) с
+кэшем отрисовки (после): время CPU и объем памяти, выделяемой на один вызов.
+
+Запуск: python -m benchmarks.bench_render [--iterations 20000] [--products 1000]
+"""
+import argparse
+import time
+import tracemalloc
+
+import main
+from benchmarks.datagen import product_names
+from catalog import Product
+
+USER_ID = 1
+
+
+def measure(fn, iterations: int) -> dict:
+    """Среднее время (мкс) и удерживаемая память (байт) на один вызов fn(i)."""
+    started = time.process_time()
+    for i in range(iterations):
+        fn(i)
+    cpu_us = (time.process_time() - started) / iterations * 1e6
+
+    # Результаты удерживаются, чтобы учесть память, выделенную под каждую новую разметку
+    results = []
+    tracemalloc.start()
+    before, _ = tracemalloc.get_traced_memory()
+    for i in range(min(iterations, 2000)):
+        results.append(fn(i))
+    after, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return {"cpu_us": round(cpu_us, 2), "bytes": (after - before) // len(results)}
+
+
+def run(iterations: int, products: int, seed: int = 42) -> dict:
+    items = [
+        Product(i, name, "Состояние отличное", f"{1000 + i} $", (1000 + i) * 4000, 2023, None, None, category)
+        for i, (category, name) in enumerate(product_names(products, seed), 1)
+    ]
+    main.catalog_cache.replace_all(sorted({p.category for p in items}), items)
+    lang = main.language_store.get(USER_ID)
+    build_main = main.build_main_keyboard.__wrapped__
+    build_admin = main.build_admin_keyboard.__wrapped__
+    build_filter = main.build_filter_keyboard.__wrapped__
+
+    def card_before(i):
+        return main.build_product_card(items[i % len(items)], lang)
+
+    def card_after(i):
+        return main.render_product_card(items[i % len(items)].id, USER_ID)
+
+    cases = {
+        "main_keyboard": (lambda i: build_main(lang), lambda i: main.get_main_keyboard(USER_ID)),
+        "admin_keyboard": (lambda i: build_admin(lang), lambda i: main.get_admin_keyboard(USER_ID)),
+        "filter_keyboard": (lambda i: build_filter(lang, 100, 500, "USD"),
+                            lambda i: main.build_filter_keyboard(lang, 100, 500, "USD")),
+        "product_card": (card_before, card_after),
+    }
+    result = {}
+    for name, (before, after) in cases.items():
+        result[f"{name}_before"] = measure(before, iterations)
+        result[f"{name}_after"] = measure(after, iterations)
+    return result
+
+
+def main_cli():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--iterations", type=int, default=20_000)
+    parser.add_argument("--products", type=int, default=1000)
+    args = parser.parse_args()
+    for key, value in run(args.iterations, args.products).items():
+        print(f"{key}: {value['cpu_us']} us/call, {value['bytes']} B/call")
+
+
+if __name__ == "__main__":
+    main_cli()
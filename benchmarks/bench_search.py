@@ -0,0 +1,57 @@
+"""
+Бенчмарк поискового индекса моделей.
+
+Запуск: python -m benchmarks.bench_search [--products 100000] [--queries 2000]
+"""
+import argparse
+import random
+import statistics
+import time
+
+from benchmarks.datagen import product_names
+from search_index import SearchIndex
+
+QUERIES = [
+    "iphone 15 pro", "iphon 15 pro", "macbook air", "macbok pro 16", "airpods pro",
+    "apple watch ultra", "watch se", "iphone 13 mini 128gb", "iphone 14 pro max midnight", "airpds max",
+]
+
+
+def run(products: int, queries: int, seed: int = 42) -> dict:
+    names = product_names(products, seed)
+    index = SearchIndex()
+
+    started = time.perf_counter()
+    index.rebuild((i, name) for i, (_, name) in enumerate(names, 1))
+    build_seconds = time.perf_counter() - started
+
+    rng = random.Random(seed)
+    latencies = []
+    for _ in range(queries):
+        query = rng.choice(QUERIES)
+        started = time.perf_counter()
+        index.search(query)
+        latencies.append((time.perf_counter() - started) * 1000)
+
+    latencies.sort()
+    return {
+        "products": products,
+        "build_seconds": round(build_seconds, 3),
+        "p50_ms": round(statistics.median(latencies), 4),
+        "p95_ms": round(latencies[int(len(latencies) * 0.95) - 1], 4),
+        "p99_ms": round(latencies[int(len(latencies) * 0.99) - 1], 4),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--products", type=int, default=100_000)
+    parser.add_argument("--queries", type=int, default=2000)
+    args = parser.parse_args()
+    result = run(args.products, args.queries)
+    for key, value in result.items():
+        print(f"{key}: {value}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,177 @@
+"""
+Генераторы синтетических данных для бенчмарков.
+Все генераторы детерминированы при одинаковом seed.
+"""
+import datetime
+import json
+import random
+import sqlite3
+import uuid
+
+MODELS = {
+    "Iphone": ["iPhone {gen}", "iPhone {gen} Pro", "iPhone {gen} Pro Max", "iPhone {gen} Plus", "iPhone {gen} mini"],
+    "MacBook": ["MacBook Air M{chip}", "MacBook Pro 14 M{chip}", "MacBook Pro 16 M{chip}"],
+    "AirPods": ["AirPods {gen}", "AirPods Pro {gen}", "AirPods Max"],
+    "Apple Watch": ["Apple Watch Series {gen}", "Apple Watch Ultra {gen}", "Apple Watch SE"],
+}
+STORAGE = ["64GB", "128GB", "256GB", "512GB", "1TB"]
+COLORS = ["Black", "White", "Blue", "Midnight", "Starlight", "Silver", "Gold", "Purple", "Natural Titanium"]
+CONDITIONS = ["New", "Used", "Refurbished", "Open box"]
+
+
+def product_names(count: int, seed: int = 42) -> list[tuple[str, str]]:
+    """Возвращает count уникальных пар (категория, название товара)."""
+    rng = random.Random(seed)
+    categories = list(MODELS)
+    names = []
+    seen = set()
+    while len(names) < count:
+        category = rng.choice(categories)
+        template = rng.choice(MODELS[category])
+        base = template.format(gen=rng.randint(8, 16), chip=rng.randint(1, 4))
+        name = f"{base} {rng.choice(STORAGE)} {rng.choice(COLORS)} {rng.choice(CONDITIONS)} SN{len(names):07d}"
+        if name not in seen:
+            seen.add(name)
+            names.append((category, name))
+    return names
+
+
+POST_TEMPLATES = [
+    "{name}\n\nСостояние: {condition}\nАккумулятор: {battery}%\nКомплект: коробка, кабель\n\nЦена: {price}",
+    "🔥 {name} 🔥\nГод выпуска: {year}\nГарантия 3 месяца\n{price}\n\nПишите в личные сообщения",
+    "В наличии!\n{name}\nСостояние {condition}, {year} г.\nЦіна - {price}\nДоставка Новой Почтой",
+    "{name}\n{price}",
+    "Новое поступление 📦\n\nМодель: {name}\nЦвет и память как в названии\nЦена: {price}\n\n#apple #{tag}",
+    "Розыгрыш среди подписчиков! Подробности в закрепе.",
+]
+
+
+def post_texts(count: int, seed: int = 42) -> list[str]:
+    """Возвращает count текстов постов канала в формате, близком к реальным объявлениям."""
+    rng = random.Random(seed)
+    names = product_names(count, seed)
+    posts = []
+    for category, name in names:
+        if rng.random() < 0.5:
+            price = f"{rng.randint(150, 3500)} $"
+        else:
+            price = f"{rng.randint(5, 140)} {rng.randint(0, 999):03d} грн"
+        posts.append(rng.choice(POST_TEMPLATES).format(
+            name=name, condition=rng.choice(CONDITIONS), battery=rng.randint(75, 100),
+            price=price, year=rng.randint(2017, 2024), tag=category.lower().replace(" ", ""),
+        ))
+    return posts
+
+
+def write_channel_export(path: str, count: int, chat_id: int = 1234567890, seed: int = 42) -> None:
+    """
+    Пишет result.json в формате экспорта Telegram Desktop с count постами канала.
+    Часть постов с разметкой (text - список фрагментов), встречаются служебные сообщения.
+    """
+    rng = random.Random(seed)
+    with open(path, "w", encoding="utf-8") as f:
+        f.write(json.dumps({"name": "Apple Store", "type": "public_channel", "id": chat_id}, ensure_ascii=False)[:-1])
+        f.write(',\n "messages": [\n')
+        for index, text in enumerate(post_texts(count, seed)):
+            message = {"id": index + 1, "type": "message", "date": "2024-01-01T12:00:00",
+                       "from": "Apple Store", "from_id": f"channel{chat_id}", "text": text}
+            if rng.random() < 0.3:
+                first, _, rest = text.partition("\n")
+                message["text"] = [{"type": "bold", "text": first}, "\n" + rest] if rest else [{"type": "bold", "text": first}]
+            if rng.random() < 0.2:
+                message["photo"] = "(File not included. Change data exporting settings to download.)"
+            if index:
+                f.write(",\n")
+            f.write(json.dumps(message, ensure_ascii=False))
+            if rng.random() < 0.01:
+                f.write(",\n" + json.dumps({"id": -index, "type": "service", "action": "pin_message", "text": ""}))
+        f.write("\n ]\n}\n")
+
+
+FIRST_NAMES = ["Олександр", "Марія", "Іван", "Анна", "Дмитро", "Олена", "Андрій", "Ірина", "Сергій", "Наталія"]
+ORDER_STATUSES = ["paid", "paid", "pending", "processing", "failed", "canceled"]
+PAYMENT_METHODS = ["liqpay", "mono_card", "mono_parts", None]
+
+
+def category_names(count: int) -> list[str]:
+    """Базовые категории бота и синтетические дополнительные до count штук."""
+    return list(MODELS) + [f"Accessory {i}" for i in range(max(0, count - len(MODELS)))]
+
+
+def product_rows(count: int, seed: int = 42, usd_rate: float = 41.5) -> list[tuple]:
+    """Строки (name, description, price, price_numeric, price_amount, price_currency, year, category_name)."""
+    rng = random.Random(seed)
+    rows = []
+    for category, name in product_names(count, seed):
+        if rng.random() < 0.5:
+            amount, currency = rng.randint(150, 3500) * 100, "USD"
+            price = f"{amount // 100} $"
+            numeric = int(amount * usd_rate)
+        else:
+            amount, currency = rng.randint(5_000, 140_000) * 100, "UAH"
+            price = f"{amount // 100} UAH"
+            numeric = amount
+        rows.append((name, f"{name}\nСостояние: {rng.choice(CONDITIONS)}", price, numeric, amount, currency,
+                     rng.randint(2017, 2024), category))
+    return rows
+
+
+def user_rows(count: int, seed: int = 42, days: int = 365) -> list[tuple]:
+    """Строки (user_id, username, first_name, join_date, language), даты регистрации за последние days дней."""
+    rng = random.Random(seed)
+    now = datetime.datetime.now()
+    return [
+        (100_000_000 + i, f"user{i}" if rng.random() < 0.7 else None, rng.choice(FIRST_NAMES),
+         (now - datetime.timedelta(seconds=rng.randint(0, days * 86400))).isoformat(),
+         rng.choice(["ua", "ua", "ru"]))
+        for i in range(count)
+    ]
+
+
+def order_rows(count: int, user_count: int, product_count: int, seed: int = 42, days: int = 90) -> list[tuple]:
+    """Строки (id, user_id, product_id, amount, payment_method, status, created_at)."""
+    rng = random.Random(seed)
+    now = datetime.datetime.now()
+    return [
+        (str(uuid.UUID(int=rng.getrandbits(128), version=4)), 100_000_000 + rng.randrange(user_count),
+         rng.randrange(1, product_count + 1), rng.randint(5_000, 140_000) * 100, rng.choice(PAYMENT_METHODS),
+         rng.choice(ORDER_STATUSES), (now - datetime.timedelta(seconds=rng.randint(0, days * 86400))).isoformat())
+        for _ in range(count)
+    ]
+
+
+def populate_database(path: str, products: int, users: int, orders: int, categories: int = 40,
+                      seed: int = 42) -> None:
+    """
+    Создает БД бота по пути path и заполняет ее синтетическими данными.
+    Дневные сводки строятся одним проходом после вставки, как при миграции существующей БД.
+    """
+    import db
+    previous, db.DB_NAME = db.DB_NAME, path
+    try:
+        db.init_db()
+    finally:
+        db.DB_NAME = previous
+    conn = sqlite3.connect(path)
+    try:
+        conn.execute("PRAGMA synchronous=OFF")
+        with conn:
+            conn.execute("DROP TABLE daily_stats")
+            for trigger in ("trg_daily_stats_signup", "trg_daily_stats_order", "trg_daily_stats_paid"):
+                conn.execute(f"DROP TRIGGER {trigger}")
+            conn.executemany("INSERT OR IGNORE INTO categories (name) VALUES (?)",
+                             [(name,) for name in category_names(categories)])
+            conn.executemany(
+                """INSERT INTO products (name, description, price, price_numeric, price_amount, price_currency,
+                                         year, category_name) VALUES (?, ?, ?, ?, ?, ?, ?, ?)""",
+                product_rows(products, seed))
+            conn.executemany("INSERT INTO users (user_id, username, first_name, join_date, language) VALUES (?, ?, ?, ?, ?)",
+                             user_rows(users, seed))
+            conn.executemany(
+                """INSERT INTO orders (id, user_id, product_id, amount, payment_method, status, created_at)
+                   VALUES (?, ?, ?, ?, ?, ?, ?)""",
+                order_rows(orders, max(1, users), max(1, products), seed))
+        db.sync_daily_stats(conn)
+        conn.execute("ANALYZE")
+    finally:
+        conn.close()
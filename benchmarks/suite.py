@@ -0,0 +1,264 @@
+"""
+Набор бенчмарков горячих путей бота на синтетических данных.
+
+Для каждого масштаба (1k, 100k, 1M товаров, пользователей и заказов) создается
+БД с синтетическими данными (кешируется в --data-dir между запусками), после чего
+замеряются db.db_query, load_data_from_db, search_model_result, apply_filters,
+parse_message_for_product, process_price_string, admin_stats и get_text.
+
+Работает полностью офлайн: обработчики получают заглушки Update/Message,
+ответы в Telegram только записываются, курс валют задан статически.
+
+Результаты сохраняются в JSON (--output) и могут сравниваться с прошлым запуском
+(--baseline): случаи, у которых медиана выросла больше чем на --threshold,
+помечаются как регрессии, и команда завершается с кодом 1.
+
+Запуск: python -m benchmarks.suite [--scales 1k 100k] [--output results.json] [--baseline old.json]
+"""
+import argparse
+import asyncio
+import datetime
+import json
+import logging
+import os
+import platform
+import random
+import statistics
+import sys
+import tempfile
+import time
+from types import SimpleNamespace
+
+from benchmarks.datagen import populate_database, post_texts
+
+SCALES = {"1k": 1_000, "100k": 100_000, "1M": 1_000_000}
+USD_RATE = 41.5
+DEFAULT_ITERATIONS = 200
+DEFAULT_THRESHOLD = 0.25
+SEARCH_QUERIES = [
+    "iphone 15 pro", "iphon 15 pro", "macbook air", "macbok pro 16", "airpods pro",
+    "apple watch ultra", "watch se", "iphone 13 mini 128gb", "iphone 14 pro max midnight", "airpds max",
+]
+TEXT_KEYS = ["welcome", "catalog", "find_model", "filters", "model_found", "buy", "stats_title", "no_access"]
+
+
+# --- Заглушки Telegram ---
+
+class StubMessage:
+    """Сообщение Telegram: ответы записываются вместо отправки."""
+
+    def __init__(self, text=None, caption=None, photo=None, video=None):
+        self.text = text
+        self.caption = caption
+        self.photo = photo or []
+        self.video = video
+        self.replies = []
+
+    async def reply_text(self, text, **kwargs):
+        self.replies.append((text, kwargs))
+        return self
+
+
+def stub_update(user_id: int, message: StubMessage) -> SimpleNamespace:
+    return SimpleNamespace(effective_user=SimpleNamespace(id=user_id), message=message, effective_message=message)
+
+
+def stub_context(user_data: dict | None = None) -> SimpleNamespace:
+    return SimpleNamespace(user_data=user_data if user_data is not None else {}, bot=None, args=[])
+
+
+# --- Окружение ---
+
+def prepare_offline():
+    """Задает статический курс, чтобы ни один случай не обращался к сети."""
+    import currency_converter
+    currency_converter.rate_service.providers = [currency_converter.StaticProvider(USD_RATE)]
+    # Метка времени в будущем: курс никогда не считается устаревшим и фоновое обновление не запускается
+    currency_converter.CURRENCY_CACHE[currency_converter.CACHE_KEY] = {
+        'rate': USD_RATE, 'timestamp': time.time() + 10 ** 9, 'provider': 'static',
+    }
+
+
+def database_for(scale: str, data_dir: str, seed: int) -> str:
+    """Путь к БД масштаба scale; создает ее при первом запуске."""
+    count = SCALES[scale]
+    path = os.path.join(data_dir, f"bench-{scale}-{seed}.db")
+    if not os.path.exists(path):
+        os.makedirs(data_dir, exist_ok=True)
+        started = time.perf_counter()
+        tmp_path = path + ".tmp"
+        for suffix in ("", "-wal", "-shm"):
+            if os.path.exists(tmp_path + suffix):
+                os.remove(tmp_path + suffix)
+        populate_database(tmp_path, products=count, users=count, orders=count, seed=seed)
+        os.replace(tmp_path, path)
+        print(f"[{scale}] данные сгенерированы за {time.perf_counter() - started:.1f} с: {path}", file=sys.stderr)
+    return path
+
+
+# --- Случаи ---
+
+def build_cases(main, db, scale_count: int, seed: int) -> dict:
+    """Возвращает {имя: (функция без аргументов, асинхронная ли, число итераций или None)}."""
+    rng = random.Random(seed)
+    product_count = max(1, scale_count)
+    user_ids = [100_000_000 + rng.randrange(scale_count) for _ in range(256)]
+    posts = post_texts(256, seed)
+    admin_id = user_ids[0]
+
+    def db_query_product():
+        db.db_query("SELECT * FROM products WHERE id = ?", (rng.randint(1, product_count),), fetchone=True)
+
+    def db_query_user_orders():
+        db.db_query("SELECT id, amount, status FROM orders WHERE user_id = ?", (rng.choice(user_ids),), fetchall=True)
+
+    async def load_data():
+        await main.load_data_from_db()
+
+    async def search():
+        message = StubMessage(text=rng.choice(SEARCH_QUERIES))
+        await main.search_model_result(stub_update(rng.choice(user_ids), message), stub_context())
+
+    async def filters_uah():
+        low = rng.randint(5_000, 60_000)
+        filters = {"min_price": low, "max_price": low + rng.randint(500, 5_000), "currency": "uah"}
+        await main.apply_filters(stub_update(rng.choice(user_ids), StubMessage()), stub_context({"filters": filters}))
+
+    async def filters_usd():
+        low = rng.randint(150, 2_000)
+        filters = {"min_price": low, "max_price": low + rng.randint(10, 100), "currency": "usd"}
+        await main.apply_filters(stub_update(rng.choice(user_ids), StubMessage()), stub_context({"filters": filters}))
+
+    def parse_message():
+        main.parse_message_for_product(StubMessage(caption=rng.choice(posts)))
+
+    def price_string():
+        main.process_price_string(rng.choice(posts))
+
+    async def stats():
+        await main.admin_stats(stub_update(admin_id, StubMessage(text="stats")), stub_context())
+
+    def get_text():
+        main.get_text(rng.choice(TEXT_KEYS), rng.choice(user_ids))
+
+    return {
+        "db_query.product_by_id": (db_query_product, False, None),
+        "db_query.orders_by_user": (db_query_user_orders, False, None),
+        "load_data_from_db": (load_data, True, 5),
+        "search_model_result": (search, True, None),
+        "apply_filters.uah": (filters_uah, True, None),
+        "apply_filters.usd": (filters_usd, True, None),
+        "parse_message_for_product": (parse_message, False, None),
+        "process_price_string": (price_string, False, None),
+        "admin_stats": (stats, True, None),
+        "get_text": (get_text, False, None),
+    }
+
+
+async def measure(fn, is_async: bool, iterations: int, warmup: int = 3) -> dict:
+    for _ in range(warmup):
+        await fn() if is_async else fn()
+    latencies = []
+    for _ in range(iterations):
+        started = time.perf_counter()
+        if is_async:
+            await fn()
+        else:
+            fn()
+        latencies.append((time.perf_counter() - started) * 1_000_000)
+    latencies.sort()
+    return {
+        "iterations": iterations,
+        "p50_us": round(statistics.median(latencies), 2),
+        "p95_us": round(latencies[max(0, int(len(latencies) * 0.95) - 1)], 2),
+        "mean_us": round(statistics.fmean(latencies), 2),
+        "ops_per_sec": round(1_000_000 / statistics.fmean(latencies), 1),
+    }
+
+
+async def run_scale(scale: str, data_dir: str, iterations: int, seed: int, only=None) -> dict:
+    import db
+    import main
+    path = database_for(scale, data_dir, seed)
+    db.pool.close()
+    db.pool.db_path = path
+    await main.load_data_from_db()
+    for user_id in range(100_000_000, 100_000_000 + min(SCALES[scale], 1000)):
+        await main.language_store.load(user_id)
+
+    results = {}
+    for name, (fn, is_async, case_iterations) in build_cases(main, db, SCALES[scale], seed).items():
+        if only and not any(name.startswith(prefix) for prefix in only):
+            continue
+        results[name] = await measure(fn, is_async, min(iterations, case_iterations or iterations))
+        print(f"[{scale}] {name}: p50 {results[name]['p50_us']} мкс, p95 {results[name]['p95_us']} мкс",
+              file=sys.stderr)
+    db.pool.close()
+    return results
+
+
+def compare(current: dict, baseline: dict, threshold: float) -> list[str]:
+    """Список регрессий: случаи, у которых p50 вырос больше чем в (1 + threshold) раз."""
+    regressions = []
+    for scale, cases in current["results"].items():
+        for name, result in cases.items():
+            previous = baseline.get("results", {}).get(scale, {}).get(name)
+            if not previous or not previous["p50_us"]:
+                continue
+            ratio = result["p50_us"] / previous["p50_us"]
+            result["baseline_p50_us"] = previous["p50_us"]
+            result["change"] = round(ratio - 1, 3)
+            if ratio > 1 + threshold:
+                regressions.append(f"{scale} {name}: p50 {previous['p50_us']} -> {result['p50_us']} мкс (+{ratio - 1:.0%})")
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--scales", nargs="+", choices=list(SCALES), default=["1k", "100k"])
+    parser.add_argument("--iterations", type=int, default=DEFAULT_ITERATIONS)
+    parser.add_argument("--cases", nargs="+", help="Запускать только случаи с этими префиксами имен")
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--data-dir", default=os.path.join(tempfile.gettempdir(), "bot-benchmarks"),
+                        help="Каталог для сгенерированных БД (переиспользуются между запусками)")
+    parser.add_argument("--output", help="Куда сохранить результаты в JSON")
+    parser.add_argument("--baseline", help="JSON прошлого запуска для сравнения")
+    parser.add_argument("--threshold", type=float, default=DEFAULT_THRESHOLD,
+                        help="Допустимый относительный рост p50 (0.25 = +25%%)")
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.WARNING)
+    prepare_offline()
+
+    report = {
+        "meta": {
+            "started_at": datetime.datetime.now().isoformat(timespec="seconds"),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "seed": args.seed,
+            "iterations": args.iterations,
+        },
+        "results": {},
+    }
+    for scale in args.scales:
+        report["results"][scale] = asyncio.run(run_scale(scale, args.data_dir, args.iterations, args.seed, args.cases))
+
+    regressions = []
+    if args.baseline:
+        with open(args.baseline, encoding="utf-8") as f:
+            regressions = compare(report, json.load(f), args.threshold)
+        report["regressions"] = regressions
+
+    for scale, cases in report["results"].items():
+        for name, result in cases.items():
+            change = f" ({result['change']:+.0%})" if "change" in result else ""
+            print(f"{scale:>5} {name:<28} p50 {result['p50_us']:>12} мкс  p95 {result['p95_us']:>12} мкс{change}")
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+    for line in regressions:
+        print(f"РЕГРЕССИЯ: {line}")
+    sys.exit(1 if regressions else 0)
+
+
+if __name__ == "__main__":
+    main()
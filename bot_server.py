@@ -0,0 +1,228 @@
+import asyncio
+import hmac
+import json
+import logging
+import os
+import secrets
+import signal
+
+import tornado.httpserver
+import tornado.netutil
+import tornado.web
+from telegram import Update
+
+import metrics
+import webhook_server
+from config import WEBHOOK_DOMAIN
+
+logger = logging.getLogger(__name__)
+
+WEBHOOK_LISTEN = os.getenv("WEBHOOK_LISTEN", "0.0.0.0")
+WEBHOOK_PORT = int(os.getenv("WEBHOOK_PORT", "8000"))
+TELEGRAM_WEBHOOK_PATH = "/webhook/telegram"
+# Секрет задается заранее или генерируется при каждом запуске (вебхук переустанавливается при старте)
+TELEGRAM_WEBHOOK_SECRET = os.getenv("TELEGRAM_WEBHOOK_SECRET") or secrets.token_urlsafe(32)
+# Сколько принятых, но еще не обработанных апдейтов допускается до ответов 503
+UPDATE_QUEUE_SIZE = int(os.getenv("UPDATE_QUEUE_SIZE", "1000"))
+# Сколько апдейтов Telegram отправляет одновременно (1-100)
+TELEGRAM_MAX_CONNECTIONS = int(os.getenv("TELEGRAM_MAX_CONNECTIONS", "40"))
+UPDATE_DRAIN_TIMEOUT_SECONDS = 30
+MAX_BODY_SIZE = 1024 * 1024
+
+
+class UpdateIntake:
+    """
+    Ограниченная очередь между HTTP-обработчиком и Application.
+    Апдейты обрабатываются application.process_update() в стольких задачах,
+    сколько разрешает update_processor (по умолчанию одна, как при polling).
+    """
+
+    def __init__(self, application, maxsize: int = UPDATE_QUEUE_SIZE):
+        self.application = application
+        self.maxsize = maxsize
+        self._queue = None
+        self._workers = []
+
+    def qsize(self) -> int:
+        return self._queue.qsize() if self._queue is not None else 0
+
+    def start(self):
+        self._queue = asyncio.Queue(maxsize=self.maxsize)
+        concurrency = self.application.update_processor.max_concurrent_updates
+        self._workers = [asyncio.create_task(self._worker()) for _ in range(concurrency)]
+
+    def offer(self, payload: dict) -> bool:
+        """Ставит апдейт в очередь без ожидания; False, если очередь заполнена."""
+        try:
+            self._queue.put_nowait(payload)
+        except asyncio.QueueFull:
+            return False
+        return True
+
+    async def _worker(self):
+        while True:
+            payload = await self._queue.get()
+            try:
+                update = Update.de_json(payload, self.application.bot)
+                await self.application.process_update(update)
+            except Exception as e:
+                logger.error(f"Ошибка обработки апдейта {payload.get('update_id')}: {e!r}")
+            finally:
+                self._queue.task_done()
+
+    async def stop(self, timeout: float = UPDATE_DRAIN_TIMEOUT_SECONDS):
+        """Дожидается обработки принятых апдейтов и останавливает задачи."""
+        try:
+            await asyncio.wait_for(self._queue.join(), timeout)
+        except asyncio.TimeoutError:
+            logger.error(f"Не обработано апдейтов при остановке: {self._queue.qsize()}")
+        for task in self._workers:
+            task.cancel()
+        await asyncio.gather(*self._workers, return_exceptions=True)
+        self._workers = []
+
+
+# --- HTTP-обработчики ---
+
+class _WebhookHandler(tornado.web.RequestHandler):
+    endpoint = None
+
+    def respond(self, body: str, status: int, headers: dict | None = None):
+        self.set_status(status)
+        for name, value in (headers or {}).items():
+            self.set_header(name, value)
+        self.finish(body)
+
+    def on_finish(self):
+        if self.endpoint:
+            metrics.WEBHOOK_LATENCY.observe(self.request.request_time(), self.endpoint, str(self.get_status()))
+
+    def log_exception(self, typ, value, tb):
+        logger.error(f"Ошибка обработчика {self.request.path}: {value!r}")
+
+
+class TelegramUpdateHandler(_WebhookHandler):
+    endpoint = "telegram_webhook"
+
+    def initialize(self, intake: UpdateIntake, secret_token: str):
+        self.intake = intake
+        self.secret_token = secret_token
+
+    def post(self):
+        token = self.request.headers.get("X-Telegram-Bot-Api-Secret-Token", "")
+        if not hmac.compare_digest(token.encode(), self.secret_token.encode()):
+            logger.warning(f"Апдейт с неверным секретом от {self.request.remote_ip}")
+            return self.respond("Forbidden", 403)
+        try:
+            payload = json.loads(self.request.body)
+        except ValueError:
+            return self.respond("Bad Request", 400)
+        if not isinstance(payload, dict):
+            return self.respond("Bad Request", 400)
+        if not self.intake.offer(payload):
+            logger.warning(f"Очередь апдейтов заполнена ({self.intake.maxsize}), апдейт {payload.get('update_id')} отклонен.")
+            return self.respond("Busy", 503, {"Retry-After": str(webhook_server.RETRY_AFTER_SECONDS)})
+        self.respond("OK", 200)
+
+
+class LiqPayHandler(_WebhookHandler):
+    endpoint = "liqpay_webhook"
+
+    async def post(self):
+        data = self.get_body_argument("data", None)
+        signature = self.get_body_argument("signature", None)
+        # engine.record ждет записи события на диск, поэтому выполняется вне event loop
+        self.respond(*await asyncio.to_thread(webhook_server.accept_liqpay, data, signature))
+
+
+class MonobankHandler(_WebhookHandler):
+    endpoint = "monobank_webhook"
+
+    async def post(self):
+        try:
+            payload = json.loads(self.request.body)
+        except ValueError:
+            payload = None
+        self.respond(*await asyncio.to_thread(webhook_server.accept_monobank, payload))
+
+
+class MetricsHandler(tornado.web.RequestHandler):
+    def get(self):
+        self.set_header("Content-Type", metrics.CONTENT_TYPE)
+        self.finish(metrics.registry.render())
+
+
+def make_app(intake: UpdateIntake, secret_token: str) -> tornado.web.Application:
+    """
+    Маршруты сервера: апдейты Telegram (проверка секрета, при заполненной очереди - 503),
+    вебхуки LiqPay/Monobank через webhook_server.accept_* и метрики Prometheus.
+    """
+    return tornado.web.Application([
+        (TELEGRAM_WEBHOOK_PATH, TelegramUpdateHandler, {"intake": intake, "secret_token": secret_token}),
+        (r"/webhook/liqpay", LiqPayHandler),
+        (r"/webhook/monobank", MonobankHandler),
+        (r"/metrics", MetricsHandler),
+    ], log_function=lambda handler: None)
+
+
+# --- Запуск ---
+
+async def serve(application, notifier, profiles, host: str = WEBHOOK_LISTEN, port: int = WEBHOOK_PORT,
+                public_url: str | None = WEBHOOK_DOMAIN, secret_token: str = TELEGRAM_WEBHOOK_SECRET,
+                stop_event: asyncio.Event | None = None, ready=None):
+    """
+    Запускает Application, движок платежей и HTTP-сервер в текущем event loop и
+    работает до stop_event (по умолчанию - до SIGINT/SIGTERM). Отдельный процесс
+    webhook_server в этом режиме не нужен.
+    notifier и profiles - AdminNotifier и UserProfileCache бота, общие с платежами.
+    public_url=None не устанавливает вебхук в Telegram (локальные тесты).
+    ready(port) вызывается, когда сервер начал принимать соединения.
+    """
+    if stop_event is None:
+        stop_event = asyncio.Event()
+        loop = asyncio.get_running_loop()
+        for sig in (signal.SIGINT, signal.SIGTERM):
+            loop.add_signal_handler(sig, stop_event.set)
+
+    intake = UpdateIntake(application)
+    await application.initialize()
+    if application.post_init:
+        await application.post_init(application)
+    await application.start()
+    webhook_server.share_bot(application.bot, notifier, profiles)
+    await webhook_server.engine.start_in_loop()
+    intake.start()
+    metrics.gauge("bot_update_queue_size", "Апдейты Telegram, ожидающие обработки", intake.qsize)
+
+    server = tornado.httpserver.HTTPServer(make_app(intake, secret_token), xheaders=True, max_body_size=MAX_BODY_SIZE)
+    sockets = tornado.netutil.bind_sockets(port, host)
+    server.add_sockets(sockets)
+    port = sockets[0].getsockname()[1]
+    logger.info(f"Сервер вебхуков бота и платежей слушает {host}:{port}")
+    try:
+        if public_url:
+            await application.bot.set_webhook(
+                url=f"{public_url.rstrip('/')}{TELEGRAM_WEBHOOK_PATH}", secret_token=secret_token,
+                allowed_updates=Update.ALL_TYPES, max_connections=TELEGRAM_MAX_CONNECTIONS,
+            )
+            logger.info(f"Вебхук Telegram установлен: {public_url.rstrip('/')}{TELEGRAM_WEBHOOK_PATH}")
+        if ready is not None:
+            ready(port)
+        await stop_event.wait()
+    finally:
+        logger.info("Остановка сервера вебхуков...")
+        # Новые запросы не принимаются; вебхук в Telegram остается, недоставленные апдейты ждут следующего запуска
+        server.stop()
+        await intake.stop()
+        await webhook_server.engine.stop_in_loop()
+        # Уведомления об оплатах уходят через Bot приложения, пока он еще не закрыт
+        await notifier.drain()
+        await server.close_all_connections()
+        await application.stop()
+        await application.shutdown()
+        if application.post_shutdown:
+            await application.post_shutdown(application)
+
+
+def run(application, notifier, profiles):
+    asyncio.run(serve(application, notifier, profiles))
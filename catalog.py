@@ -0,0 +1,577 @@
+import asyncio
+import bisect
+import itertools
+import logging
+import operator
+import threading
+from collections import OrderedDict
+from typing import NamedTuple
+
+logger = logging.getLogger(__name__)
+
+PRODUCT_COLUMNS = ("id, name, description, price, price_numeric, year, photo_id, video_id, category_name, "
+                   "price_amount, price_currency")
+# Размер страницы inline-клавиатур со списками товаров
+PAGE_SIZE = 10
+# Если пересчет затронул меньше 1/PRICE_ROW_UPDATE_FRACTION индекса цен, ключи меняются построчно
+PRICE_ROW_UPDATE_FRACTION = 64
+# Как часто пересчитанные цены записываются в products.price_numeric
+PRICE_FLUSH_INTERVAL_SECONDS = 5.0
+
+
+class Product(NamedTuple):
+    """Неизменяемая запись о товаре в кэше каталога."""
+    id: int
+    name: str
+    description: str | None
+    price: str | None
+    price_numeric: int | None
+    year: int | None
+    photo: str | None
+    video: str | None
+    category: str
+    # Исходная цена в сотых долях валюты и код валюты (USD, UAH, ...); price_numeric вычисляется из них
+    price_amount: int | None = None
+    price_currency: str | None = None
+
+    @classmethod
+    def from_row(cls, row) -> "Product":
+        """Строит запись из строки `SELECT {PRODUCT_COLUMNS} FROM products`."""
+        return cls(*row)
+
+
+# Позиция price_numeric в кортеже Product (CatalogCache.reprice собирает записи срезами, это быстрее _replace)
+_PRICE_FIELD = Product._fields.index("price_numeric")
+
+
+class CatalogSnapshot(NamedTuple):
+    """Согласованный срез каталога на момент определенной версии."""
+    version: int
+    categories: tuple
+    listings: dict
+
+    def products_in(self, category: str) -> tuple:
+        return self.listings.get(category, ())
+
+
+class Page(NamedTuple):
+    """
+    Страница списка товаров для keyset-пагинации.
+    prev_anchor/next_anchor - id первого/последнего товара страницы,
+    если до/после нее есть товары (иначе None).
+    """
+    items: tuple
+    prev_anchor: int | None
+    next_anchor: int | None
+
+
+class CatalogCache:
+    """
+    Единый кэш категорий и товаров с счетчиком версий.
+
+    Изменения применяются построчными дельтами (insert/update/delete) за O(1),
+    поэтому добавление товара не требует перечитывать всю таблицу.
+    Записи Product неизменяемы; списки товаров категории материализуются
+    в кортежи лениво и переиспользуются до следующего изменения категории.
+    """
+
+    def __init__(self):
+        self._lock = threading.RLock()
+        self._version = 0
+        self._categories = ()
+        self._products = {}
+        self._by_name = {}
+        self._by_category = {}
+        self._listings = {}
+        self._views = {}
+        self._listeners = []
+
+    # --- Чтение ---
+
+    @property
+    def version(self) -> int:
+        return self._version
+
+    @property
+    def categories(self) -> tuple:
+        return self._categories
+
+    def __len__(self) -> int:
+        return len(self._products)
+
+    def get(self, product_id: int) -> Product | None:
+        return self._products.get(product_id)
+
+    def get_by_name(self, name: str) -> Product | None:
+        product_id = self._by_name.get(name)
+        return self._products.get(product_id) if product_id is not None else None
+
+    def products(self) -> list:
+        """Все товары каталога (копия списка, безопасна для итерации)."""
+        with self._lock:
+            return list(self._products.values())
+
+    def products_in(self, category: str) -> tuple:
+        """Товары категории в порядке добавления."""
+        listing = self._listings.get(category)
+        if listing is None:
+            with self._lock:
+                listing = tuple(self._by_category.get(category, {}).values())
+                self._listings[category] = listing
+        return listing
+
+    def _sorted_view(self, category: str | None) -> tuple:
+        """
+        Товары категории по id (или весь каталог по названию при category=None)
+        вместе с ключами сортировки. Строится лениво и живет до следующего изменения каталога.
+        """
+        view = self._views.get(category)
+        if view is not None and view[0] == self._version:
+            return view
+        with self._lock:
+            if category is None:
+                items = tuple(sorted(self._products.values(), key=lambda p: (p.name, p.id)))
+                keys = [(p.name, p.id) for p in items]
+            else:
+                # Порядок добавления совпадает с порядком id, пока товар не перенесен
+                # в другую категорию (он попадает в конец); на почти упорядоченном
+                # списке sorted() работает за линейное время
+                items = tuple(sorted(self.products_in(category), key=lambda p: p.id))
+                keys = [p.id for p in items]
+            view = (self._version, items, keys)
+            self._views[category] = view
+        return view
+
+    def page(self, category: str | None = None, after_id: int | None = None, before_id: int | None = None,
+             size: int = PAGE_SIZE) -> Page:
+        """
+        Keyset-пагинация: до size товаров после товара after_id или перед товаром before_id.
+        category=None - весь каталог в порядке названий (для админки).
+        Якорь, уже удаленный из каталога: в категории страница продолжается с его
+        места по id; во всем каталоге название якоря неизвестно, и возвращается
+        первая страница.
+        """
+        _, items, keys = self._sorted_view(category)
+
+        def key_of(product_id):
+            if category is not None:
+                return product_id
+            product = self._products.get(product_id)
+            return (product.name, product.id) if product is not None else None
+
+        after = key_of(after_id) if after_id is not None else None
+        before = key_of(before_id) if before_id is not None else None
+        if before is not None:
+            end = bisect.bisect_left(keys, before)
+            start = max(0, end - size)
+        else:
+            start = bisect.bisect_right(keys, after) if after is not None else 0
+            end = min(len(items), start + size)
+        chunk = items[start:end]
+        prev_anchor = chunk[0].id if chunk and start > 0 else None
+        next_anchor = chunk[-1].id if chunk and end < len(items) else None
+        return Page(chunk, prev_anchor, next_anchor)
+
+    def neighbors(self, product_id: int) -> tuple[int | None, int | None]:
+        """id предыдущего и следующего товара той же категории (None на краях списка)."""
+        product = self._products.get(product_id)
+        if product is None:
+            return None, None
+        _, items, keys = self._sorted_view(product.category)
+        index = bisect.bisect_left(keys, product_id)
+        if index >= len(keys) or keys[index] != product_id:
+            return None, None
+        prev_id = items[index - 1].id if index > 0 else None
+        next_id = items[index + 1].id if index + 1 < len(items) else None
+        return prev_id, next_id
+
+    def snapshot(self) -> CatalogSnapshot:
+        """Возвращает срез каталога, который не меняется при последующих обновлениях."""
+        with self._lock:
+            listings = {cat: self.products_in(cat) for cat in self._by_category}
+            return CatalogSnapshot(self._version, self._categories, listings)
+
+    # --- Подписка на изменения ---
+
+    def subscribe(self, listener):
+        """
+        Регистрирует listener(event, old, new), вызываемый после каждого изменения.
+        event: 'reload', 'insert', 'update', 'delete', 'category_add', 'category_delete', 'reprice'
+        (для 'reprice' new - {id: (старая цена, новая цена)}).
+        """
+        self._listeners.append(listener)
+
+    def _notify(self, event, old=None, new=None):
+        for listener in self._listeners:
+            try:
+                listener(event, old, new)
+            except Exception as e:
+                logger.error(f"Ошибка в подписчике кэша каталога ({event}): {e}")
+
+    # --- Изменение ---
+
+    def replace_all(self, categories, products):
+        """Полностью заменяет содержимое кэша (используется при старте)."""
+        by_category = {cat: {} for cat in categories}
+        products_by_id = {}
+        by_name = {}
+        for product in products:
+            products_by_id[product.id] = product
+            by_name[product.name] = product.id
+            by_category.setdefault(product.category, {})[product.id] = product
+        with self._lock:
+            self._categories = tuple(categories)
+            self._products = products_by_id
+            self._by_name = by_name
+            self._by_category = by_category
+            self._listings = {}
+            self._version += 1
+        self._notify("reload")
+        logger.info(f"Кэш каталога перестроен (v{self._version}). Товаров: {len(products_by_id)}, Категорий: {len(self._categories)}")
+
+    async def load(self, pool):
+        """Загружает категории и товары из БД через пул соединений."""
+        categories = await pool.fetchall("SELECT name FROM categories ORDER BY id")
+        rows = await pool.fetchall(f"SELECT {PRODUCT_COLUMNS} FROM products ORDER BY id")
+        self.replace_all([row["name"] for row in categories], [Product.from_row(row) for row in rows])
+
+    def upsert(self, product: Product):
+        """Добавляет новый товар или заменяет существующий с тем же id."""
+        with self._lock:
+            old = self._products.get(product.id)
+            if old is not None:
+                if old.name != product.name:
+                    self._by_name.pop(old.name, None)
+                if old.category != product.category:
+                    self._by_category.get(old.category, {}).pop(old.id, None)
+                    self._listings.pop(old.category, None)
+            self._products[product.id] = product
+            self._by_name[product.name] = product.id
+            self._by_category.setdefault(product.category, {})[product.id] = product
+            self._listings.pop(product.category, None)
+            self._version += 1
+        self._notify("update" if old is not None else "insert", old, product)
+
+    def delete(self, product_id: int) -> Product | None:
+        """Удаляет товар из кэша. Возвращает удаленную запись или None."""
+        with self._lock:
+            old = self._products.pop(product_id, None)
+            if old is None:
+                return None
+            self._by_name.pop(old.name, None)
+            self._by_category.get(old.category, {}).pop(product_id, None)
+            self._listings.pop(old.category, None)
+            self._version += 1
+        self._notify("delete", old, None)
+        return old
+
+    def reprice(self, prices: dict) -> int:
+        """
+        Массово заменяет price_numeric товаров {id: цена в копейках} одной версией кэша.
+        Подписчики получают одно событие 'reprice' со списком изменений. Возвращает число измененных товаров.
+        """
+        make = Product._make
+        with self._lock:
+            products, by_category = self._products, self._by_category
+            changes = {}
+            categories = set()
+            for product_id, price_numeric in prices.items():
+                product = products.get(product_id)
+                if product is None or product[_PRICE_FIELD] == price_numeric:
+                    continue
+                changes[product_id] = (product[_PRICE_FIELD], price_numeric)
+                product = make((*product[:_PRICE_FIELD], price_numeric, *product[_PRICE_FIELD + 1:]))
+                products[product_id] = product
+                by_category[product.category][product_id] = product
+                categories.add(product.category)
+            if not changes:
+                return 0
+            for category in categories:
+                self._listings.pop(category, None)
+            self._version += 1
+        self._notify("reprice", None, changes)
+        return len(changes)
+
+    def add_category(self, name: str):
+        with self._lock:
+            if name in self._categories:
+                return
+            self._categories = self._categories + (name,)
+            self._by_category.setdefault(name, {})
+            self._version += 1
+        self._notify("category_add", None, name)
+
+    def remove_category(self, name: str) -> int:
+        """Удаляет категорию вместе с ее товарами. Возвращает число удаленных товаров."""
+        with self._lock:
+            removed = list(self._by_category.pop(name, {}).values())
+            self._listings.pop(name, None)
+            self._views.pop(name, None)
+            self._categories = tuple(cat for cat in self._categories if cat != name)
+            for product in removed:
+                self._products.pop(product.id, None)
+                self._by_name.pop(product.name, None)
+            self._version += 1
+        for product in removed:
+            self._notify("delete", product, None)
+        self._notify("category_delete", name, None)
+        return len(removed)
+
+
+class VersionedCache:
+    """
+    LRU-кэш значений, построенных из кэша каталога (например, отрисованных клавиатур).
+    Полностью сбрасывается при смене версии каталога.
+    """
+
+    def __init__(self, catalog_cache: CatalogCache, capacity: int = 1024):
+        self.catalog_cache = catalog_cache
+        self.capacity = capacity
+        self._version = None
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def get(self, key, build):
+        """Возвращает значение для key, вызывая build() только при промахе."""
+        version = self.catalog_cache.version
+        with self._lock:
+            if version != self._version:
+                self._entries.clear()
+                self._version = version
+            elif key in self._entries:
+                self._entries.move_to_end(key)
+                return self._entries[key]
+        value = build()
+        with self._lock:
+            if version == self._version:
+                self._entries[key] = value
+                while len(self._entries) > self.capacity:
+                    self._entries.popitem(last=False)
+        return value
+
+
+class PriceIndex:
+    """
+    Отсортированный индекс товаров по price_numeric (копейки UAH).
+    Диапазонные запросы выполняются бинарным поиском без обращения к SQLite.
+    Товары без цены в индекс не попадают.
+    """
+
+    def __init__(self):
+        self._lock = threading.RLock()
+        self._keys = []
+
+    def __len__(self) -> int:
+        return len(self._keys)
+
+    def add(self, product: Product):
+        if product.price_numeric is None:
+            return
+        with self._lock:
+            bisect.insort(self._keys, (product.price_numeric, product.id))
+
+    def remove(self, product: Product):
+        if product.price_numeric is None:
+            return
+        key = (product.price_numeric, product.id)
+        with self._lock:
+            index = bisect.bisect_left(self._keys, key)
+            if index < len(self._keys) and self._keys[index] == key:
+                del self._keys[index]
+
+    def rebuild(self, products):
+        keys = sorted((p.price_numeric, p.id) for p in products if p.price_numeric is not None)
+        with self._lock:
+            self._keys = keys
+
+    def reprice(self, changes: dict):
+        """
+        Применяет изменения цен {id: (старая цена, новая цена)}. Небольшая пачка
+        обновляется построчно бинарным поиском; крупная - одним проходом по ключам
+        и сортировкой, которая сливает два упорядоченных участка за линейное время.
+        """
+        with self._lock:
+            keys = self._keys
+            if len(changes) * PRICE_ROW_UPDATE_FRACTION < len(keys):
+                for product_id, (old, new) in changes.items():
+                    if old is not None:
+                        index = bisect.bisect_left(keys, (old, product_id))
+                        if index < len(keys) and keys[index] == (old, product_id):
+                            del keys[index]
+                    if new is not None:
+                        bisect.insort(keys, (new, product_id))
+                return
+            keys = [key for key in keys if key[1] not in changes]
+            keys.extend(sorted((new, product_id) for product_id, (_, new) in changes.items() if new is not None))
+            keys.sort()
+            self._keys = keys
+
+    def range(self, min_price: int | None = None, max_price: int | None = None) -> list[int]:
+        """id товаров с min_price <= price_numeric <= max_price в порядке возрастания цены."""
+        with self._lock:
+            start = 0 if min_price is None else bisect.bisect_left(self._keys, (min_price,))
+            # (max_price + 1,) больше любого ключа (max_price, id)
+            end = len(self._keys) if max_price is None else bisect.bisect_left(self._keys, (max_price + 1,))
+            return [product_id for _, product_id in self._keys[start:end]]
+
+    def attach(self, catalog_cache: CatalogCache):
+        """Подписывает индекс на дельты кэша каталога."""
+        def on_change(event, old, new):
+            if event == "reload":
+                self.rebuild(catalog_cache.products())
+            elif event == "reprice":
+                self.reprice(new)
+            elif event in ("insert", "update", "delete"):
+                if old is not None:
+                    self.remove(old)
+                if new is not None:
+                    self.add(new)
+        catalog_cache.subscribe(on_change)
+        self.rebuild(catalog_cache.products())
+
+
+class CurrencyRepricer:
+    """
+    Пересчет цен товаров в валюте при изменении курса.
+
+    Исходные суммы USD-товаров хранятся столбцами (id и сумма в центах),
+    поэтому при новом курсе все цены вычисляются одним проходом map() в C,
+    а в кэш каталога изменения попадают одной пачкой (CatalogCache.reprice).
+    Измененные цены с пулом соединений (pool) записываются в products.price_numeric
+    фоновой задачей раз в flush_interval одним executemany, поэтому фильтры по
+    индексу цены в БД совпадают с кэшем с задержкой не больше flush_interval.
+    """
+
+    def __init__(self, currency: str = "USD", pool=None, flush_interval: float = PRICE_FLUSH_INTERVAL_SECONDS):
+        self.currency = currency
+        self.pool = pool
+        self.flush_interval = flush_interval
+        self.rate = None
+        self._catalog_cache = None
+        self._lock = threading.Lock()
+        self._ids = []
+        self._amounts = []
+        self._positions = {}
+        self._dirty = {}
+        self._flush_task = None
+
+    def __len__(self) -> int:
+        return len(self._ids)
+
+    def _rebuild(self, products):
+        tracked = [(p.id, p.price_amount) for p in products
+                   if p.price_currency == self.currency and p.price_amount is not None]
+        with self._lock:
+            self._ids = [product_id for product_id, _ in tracked]
+            self._amounts = [amount for _, amount in tracked]
+            self._positions = {product_id: index for index, product_id in enumerate(self._ids)}
+
+    def _track(self, product: Product):
+        with self._lock:
+            index = self._positions.get(product.id)
+            if product.price_currency == self.currency and product.price_amount is not None:
+                if index is None:
+                    self._positions[product.id] = len(self._ids)
+                    self._ids.append(product.id)
+                    self._amounts.append(product.price_amount)
+                else:
+                    self._amounts[index] = product.price_amount
+            elif index is not None:
+                self._untrack(product.id)
+
+    def _untrack(self, product_id: int):
+        """Удаляет товар из столбцов, перенося последний элемент на его место (O(1))."""
+        index = self._positions.pop(product_id, None)
+        if index is None:
+            return
+        last_id, last_amount = self._ids.pop(), self._amounts.pop()
+        if index < len(self._ids):
+            self._ids[index] = last_id
+            self._amounts[index] = last_amount
+            self._positions[last_id] = index
+
+    def prices(self, rate: float) -> dict:
+        """Цены в копейках UAH для всех отслеживаемых товаров по курсу rate."""
+        with self._lock:
+            return dict(zip(self._ids, map(int, map(operator.mul, self._amounts, itertools.repeat(rate)))))
+
+    def apply(self, rate: float | None) -> int:
+        """Запоминает курс и пересчитывает цены в кэше каталога. Возвращает число измененных товаров."""
+        if not rate:
+            return 0
+        self.rate = rate
+        if self._catalog_cache is None:
+            return 0
+        changed = self._catalog_cache.reprice(self.prices(rate))
+        if changed:
+            logger.info(f"Цены пересчитаны по курсу {self.currency} {rate}: {changed} товаров")
+        return changed
+
+    def attach(self, catalog_cache: CatalogCache):
+        """Подписывает пересчет на дельты кэша каталога; после полной перезагрузки цены пересчитываются."""
+        def on_change(event, old, new):
+            if event == "reload":
+                self._rebuild(catalog_cache.products())
+                if self.rate:
+                    self.apply(self.rate)
+            elif event == "reprice":
+                if self.pool is not None:
+                    with self._lock:
+                        self._dirty.update(zip(new, map(operator.itemgetter(1), new.values())))
+            elif event in ("insert", "update"):
+                self._track(new)
+                # Цену такой строки в БД уже записал автор изменения
+                with self._lock:
+                    self._dirty.pop(new.id, None)
+            elif event == "delete":
+                with self._lock:
+                    self._untrack(old.id)
+                    self._dirty.pop(old.id, None)
+        self._catalog_cache = catalog_cache
+        catalog_cache.subscribe(on_change)
+        self._rebuild(catalog_cache.products())
+
+    async def flush(self) -> int:
+        """Записывает пересчитанные цены в products.price_numeric. Возвращает число строк."""
+        with self._lock:
+            batch, self._dirty = self._dirty, {}
+        if not batch:
+            return 0
+        try:
+            await self.pool.executemany(
+                "UPDATE products SET price_numeric = ? WHERE id = ?",
+                [(price, product_id) for product_id, price in batch.items()]
+            )
+        except Exception:
+            with self._lock:
+                # Более новые цены, пересчитанные во время записи, не перезаписываем
+                for product_id, price in batch.items():
+                    self._dirty.setdefault(product_id, price)
+            raise
+        return len(batch)
+
+    async def _run(self):
+        while True:
+            await asyncio.sleep(self.flush_interval)
+            try:
+                await self.flush()
+            except Exception as e:
+                logger.error(f"Не удалось сохранить пересчитанные цены товаров: {e}")
+
+    def start(self):
+        if self.pool is not None and self._flush_task is None:
+            self._flush_task = asyncio.get_running_loop().create_task(self._run())
+
+    async def stop(self):
+        if self._flush_task is not None:
+            self._flush_task.cancel()
+            try:
+                await self._flush_task
+            except asyncio.CancelledError:
+                pass
+            self._flush_task = None
+        if self.pool is not None:
+            await self.flush()
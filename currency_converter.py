@@ -1,60 +1,232 @@
-
-
+import asyncio
 import logging
 import time
-import requests
+import httpx
+from db import pool as db_pool
+from metrics import EXTERNAL_LATENCY, RATE_CACHE_LOOKUPS
 
 logger = logging.getLogger(__name__)
 
 # Кеш для хранения курса валют
-# Структура: {'usd_uah': {'rate': 39.5, 'timestamp': 1678886400}}
+# Структура: {'usd_uah': {'rate': 39.5, 'timestamp': 1678886400, 'provider': 'privatbank'}}
 CURRENCY_CACHE = {}
 CACHE_LIFETIME_SECONDS = 3600  # 1 час
+# Курс обновляется в фоне заранее, за это время до истечения кеша
+REFRESH_AHEAD_SECONDS = 600
+# Пауза перед повторной попыткой, если все провайдеры недоступны
+RETRY_DELAY_SECONDS = 60
+REQUEST_TIMEOUT_SECONDS = 10
 
-def get_usd_to_uah_rate() -> float | None:
-    """
-    Получает и кеширует курс продажи USD к UAH из API ПриватБанка.
-    Возвращает курс или None в случае ошибки.
-    """
-    cache_key = 'usd_uah'
-    
-    # Проверяем, есть ли свежие данные в кеше
-    if cache_key in CURRENCY_CACHE:
-        cache_entry = CURRENCY_CACHE[cache_key]
-        if time.time() - cache_entry['timestamp'] < CACHE_LIFETIME_SECONDS:
-            logger.info(f"Используем курс USD из кеша: {cache_entry['rate']}")
-            return cache_entry['rate']
-
-    # Если в кеше нет или данные устарели, делаем запрос
-    try:
-        logger.info("Обновляем курс USD из API ПриватБанка...")
-        # API ПриватБанка для получения наличного курса
-        response = requests.get('https://api.privatbank.ua/p24api/pubinfo?json&exchange&coursid=5')
+CACHE_KEY = 'usd_uah'
+
+
+# --- ПРОВАЙДЕРЫ КУРСОВ ---
+
+class PrivatBankProvider:
+    """Наличный курс продажи USD из API ПриватБанка."""
+    name = "privatbank"
+    url = 'https://api.privatbank.ua/p24api/pubinfo?json&exchange&coursid=5'
+
+    async def fetch(self, client: httpx.AsyncClient) -> float | None:
+        response = await client.get(self.url)
         response.raise_for_status()
-        data = response.json()
-        
-        usd_rate = None
-        for currency in data:
+        for currency in response.json():
             if currency['ccy'] == 'USD':
                 # Используем курс продажи (sale)
-                usd_rate = float(currency['sale'])
-                break
-        
-        if usd_rate:
-            # Сохраняем в кеш
-            CURRENCY_CACHE[cache_key] = {
-                'rate': usd_rate,
-                'timestamp': time.time()
-            }
-            logger.info(f"Новый курс USD получен и закеширован: {usd_rate}")
-            return usd_rate
+                return float(currency['sale'])
+        return None
+
+
+class MonobankRatesProvider:
+    """Курс продажи USD из публичного API Monobank."""
+    name = "monobank"
+    url = 'https://api.monobank.ua/bank/currency'
+
+    async def fetch(self, client: httpx.AsyncClient) -> float | None:
+        response = await client.get(self.url)
+        response.raise_for_status()
+        for pair in response.json():
+            # 840 - USD, 980 - UAH (ISO 4217)
+            if pair.get('currencyCodeA') == 840 and pair.get('currencyCodeB') == 980:
+                return float(pair['rateSell'])
+        return None
+
+
+class NbuProvider:
+    """Официальный курс НБУ (резервный источник)."""
+    name = "nbu"
+    url = 'https://bank.gov.ua/NBUStatService/v1/statdirectory/exchange?valcode=USD&json'
+
+    async def fetch(self, client: httpx.AsyncClient) -> float | None:
+        response = await client.get(self.url)
+        response.raise_for_status()
+        data = response.json()
+        return float(data[0]['rate']) if data else None
+
+
+class StaticProvider:
+    """Локальная замена провайдера с фиксированным курсом (для тестов и офлайн-запуска)."""
+    name = "static"
+
+    def __init__(self, rate: float | None):
+        self.rate = rate
+
+    async def fetch(self, client: httpx.AsyncClient) -> float | None:
+        return self.rate
+
+
+# --- СЕРВИС КУРСОВ ---
+
+class RateService:
+    """
+    Фоновый сервис курса USD/UAH.
+
+    - Читатели получают курс из кеша мгновенно и никогда не ждут HTTP-запроса.
+    - Курс обновляется в фоне за REFRESH_AHEAD_SECONDS до истечения кеша;
+      если кеш устарел, отдается последнее значение, а обновление запускается в фоне.
+    - Провайдеры опрашиваются по очереди до первого успешного ответа.
+    - Последний курс сохраняется в БД, поэтому холодный старт не блокируется сетью.
+    """
+
+    def __init__(self, providers=None, pool=None, lifetime=CACHE_LIFETIME_SECONDS,
+                 refresh_ahead=REFRESH_AHEAD_SECONDS, timeout=REQUEST_TIMEOUT_SECONDS):
+        self.providers = providers if providers is not None else [PrivatBankProvider(), MonobankRatesProvider(), NbuProvider()]
+        self.pool = pool
+        self.lifetime = lifetime
+        self.refresh_ahead = refresh_ahead
+        self.timeout = timeout
+        self._client = None
+        self._loop_task = None
+        self._refresh_task = None
+        self._listeners = []
+
+    def subscribe(self, listener):
+        """Регистрирует listener(rate), вызываемый после каждого изменения курса."""
+        self._listeners.append(listener)
+
+    def get_rate(self) -> float | None:
+        """
+        Возвращает последний известный курс без ожидания сети.
+        Если курс устарел, запускает фоновое обновление (stale-while-revalidate).
+        """
+        cache_entry = CURRENCY_CACHE.get(CACHE_KEY)
+        if cache_entry is None:
+            RATE_CACHE_LOOKUPS.inc("miss")
+            self._schedule_refresh()
+            return None
+        if time.time() - cache_entry['timestamp'] >= self.lifetime:
+            RATE_CACHE_LOOKUPS.inc("stale")
+            self._schedule_refresh()
         else:
-            logger.error("Не удалось найти курс USD в ответе API.")
+            RATE_CACHE_LOOKUPS.inc("hit")
+        return cache_entry['rate']
+
+    def _schedule_refresh(self) -> asyncio.Task | None:
+        """Запускает обновление в фоне; одновременно выполняется не больше одного."""
+        try:
+            loop = asyncio.get_running_loop()
+        except RuntimeError:
             return None
-            
-    except requests.exceptions.RequestException as e:
-        logger.error(f"Ошибка при запросе курса валют: {e}")
+        if self._refresh_task is None or self._refresh_task.done():
+            self._refresh_task = loop.create_task(self.refresh())
+        return self._refresh_task
+
+    async def refresh(self) -> float | None:
+        """Запрашивает курс у провайдеров по очереди. Возвращает новый курс или None."""
+        if self._client is None:
+            self._client = httpx.AsyncClient(timeout=self.timeout)
+        for provider in self.providers:
+            started = time.perf_counter()
+            try:
+                rate = await provider.fetch(self._client)
+            except (httpx.HTTPError, ValueError, KeyError, IndexError, TypeError) as e:
+                EXTERNAL_LATENCY.observe(time.perf_counter() - started, provider.name, "rate", "error")
+                logger.error(f"Ошибка при запросе курса валют у {provider.name}: {e}")
+                continue
+            EXTERNAL_LATENCY.observe(time.perf_counter() - started, provider.name, "rate", "ok" if rate else "empty")
+            if rate:
+                await self._store(rate, provider.name, time.time())
+                logger.info(f"Новый курс USD получен от {provider.name} и закеширован: {rate}")
+                return rate
+            logger.error(f"Не удалось найти курс USD в ответе {provider.name}.")
         return None
-    except (ValueError, KeyError, IndexError) as e:
-        logger.error(f"Ошибка при парсинге ответа API курсов валют: {e}")
-        return None
\ No newline at end of file
+
+    async def _store(self, rate: float, provider: str, timestamp: float):
+        previous = CURRENCY_CACHE.get(CACHE_KEY)
+        CURRENCY_CACHE[CACHE_KEY] = {'rate': rate, 'timestamp': timestamp, 'provider': provider}
+        if previous is None or previous['rate'] != rate:
+            self._notify(rate)
+        if self.pool is not None:
+            try:
+                await self.pool.execute(
+                    """INSERT INTO currency_rates (pair, rate, provider, updated_at) VALUES (?, ?, ?, ?)
+                       ON CONFLICT(pair) DO UPDATE SET rate = excluded.rate, provider = excluded.provider,
+                                                       updated_at = excluded.updated_at""",
+                    (CACHE_KEY, rate, provider, timestamp)
+                )
+            except Exception as e:
+                logger.error(f"Не удалось сохранить курс валют в БД: {e}")
+
+    def _notify(self, rate: float):
+        for listener in self._listeners:
+            try:
+                listener(rate)
+            except Exception as e:
+                logger.error(f"Ошибка в подписчике курса валют: {e}")
+
+    async def _load_persisted(self):
+        if self.pool is None:
+            return
+        row = await self.pool.fetchone(
+            "SELECT rate, provider, updated_at FROM currency_rates WHERE pair = ?", (CACHE_KEY,)
+        )
+        if row:
+            CURRENCY_CACHE[CACHE_KEY] = {'rate': row['rate'], 'timestamp': row['updated_at'], 'provider': row['provider']}
+            logger.info(f"Курс USD загружен из БД: {row['rate']} ({row['provider']})")
+            self._notify(row['rate'])
+
+    async def _run(self):
+        while True:
+            cache_entry = CURRENCY_CACHE.get(CACHE_KEY)
+            if cache_entry:
+                delay = cache_entry['timestamp'] + self.lifetime - self.refresh_ahead - time.time()
+            else:
+                delay = 0
+            if delay > 0:
+                await asyncio.sleep(delay)
+            rate = await asyncio.shield(self._schedule_refresh())
+            if rate is None:
+                await asyncio.sleep(RETRY_DELAY_SECONDS)
+
+    async def start(self):
+        """Загружает сохраненный курс и запускает фоновое обновление."""
+        try:
+            await self._load_persisted()
+        except Exception as e:
+            logger.error(f"Не удалось загрузить курс валют из БД: {e}")
+        if self._loop_task is None:
+            self._loop_task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        for task in (self._loop_task, self._refresh_task):
+            if task is not None and not task.done():
+                task.cancel()
+                try:
+                    await task
+                except asyncio.CancelledError:
+                    pass
+        self._loop_task = self._refresh_task = None
+        if self._client is not None:
+            await self._client.aclose()
+            self._client = None
+
+
+rate_service = RateService(pool=db_pool)
+
+
+def get_usd_to_uah_rate() -> float | None:
+    """
+    Возвращает кешированный курс продажи USD к UAH или None, если курс еще неизвестен.
+    Никогда не выполняет сетевой запрос в вызывающем потоке: обновление идет в фоне (см. RateService).
+    """
+    return rate_service.get_rate()
@@ -1,9 +1,42 @@
+import os
 import sqlite3
 import logging
 import datetime
+import asyncio
+import threading
+import time
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor
+
+from ingest import parse_price
+from metrics import DB_QUERY_LATENCY, statement_label
+from query_profiler import QueryProfiler
 
 logger = logging.getLogger(__name__)
-DB_NAME = "bot_database.db"
+DB_NAME = os.path.join(os.path.dirname(os.path.abspath(__file__)), "bot_database.db")
+
+# Размер пула и таймаут ожидания блокировки (мс) для долгоживущих соединений
+DB_POOL_SIZE = 4
+DB_BUSY_TIMEOUT_MS = 5000
+
+# Управляемый набор вторичных индексов: имя -> (таблица, столбцы).
+# init_db создает недостающие и удаляет устаревшие индексы с префиксом "idx_".
+INDEXES = {
+    "idx_products_price_numeric": ("products", "price_numeric"),
+    "idx_products_category_name": ("products", "category_name"),
+    "idx_orders_user_id": ("orders", "user_id"),
+    "idx_orders_status": ("orders", "status"),
+    "idx_orders_payment_invoice_id": ("orders", "payment_invoice_id"),
+    "idx_users_join_date": ("users", "join_date"),
+    "idx_payment_events_state_next_attempt": ("payment_events", "state, next_attempt_at"),
+}
+
+# День daily_stats для пользователей и заказов без даты, заполненных из старых данных:
+# они входят в итоги за все время, но не в сводки за период
+UNDATED_DAY = "0001-01-01"
+
+# Результат execute(): количество затронутых строк и id последней вставленной строки
+ExecuteResult = namedtuple("ExecuteResult", ["rowcount", "lastrowid"])
 
 def init_db():
     """
@@ -12,6 +45,8 @@ def init_db():
     """
     with sqlite3.connect(DB_NAME) as conn:
         cursor = conn.cursor()
+        # WAL сохраняется в файле БД: читатели больше не блокируют писателя и наоборот
+        cursor.execute("PRAGMA journal_mode=WAL")
         
         # ... (остальные таблицы без изменений)
         
@@ -45,6 +80,8 @@ def init_db():
             photo_id TEXT,
             video_id TEXT,
             category_name TEXT,
+            price_amount INTEGER,
+            price_currency TEXT,
             FOREIGN KEY (category_name) REFERENCES categories (name) ON DELETE CASCADE
         )
         """)
@@ -67,6 +104,49 @@ def init_db():
         )
         """)
 
+        # Последние известные курсы валют (см. currency_converter.RateService)
+        cursor.execute("""
+        CREATE TABLE IF NOT EXISTS currency_rates (
+            pair TEXT PRIMARY KEY,
+            rate REAL NOT NULL,
+            provider TEXT,
+            updated_at REAL NOT NULL
+        )
+        """)
+
+        # Счета Monobank по заказам (см. payment_gateways.MonobankClient).
+        # state: sending -> created | unknown (запрос мог дойти до банка без ответа)
+        cursor.execute("""
+        CREATE TABLE IF NOT EXISTS monobank_invoices (
+            reference TEXT NOT NULL,
+            payment_type TEXT NOT NULL,
+            state TEXT NOT NULL,
+            invoice_id TEXT,
+            page_url TEXT,
+            updated_at REAL NOT NULL,
+            PRIMARY KEY (reference, payment_type)
+        )
+        """)
+
+        # Журнал платежных событий (см. outbox.PaymentOutbox).
+        # state: pending -> processing -> done | dead; у захваченного события
+        # claimed_by - процесс-владелец, next_attempt_at - конец аренды
+        cursor.execute("""
+        CREATE TABLE IF NOT EXISTS payment_events (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            provider TEXT NOT NULL,
+            order_id TEXT NOT NULL,
+            status TEXT NOT NULL,
+            payload TEXT,
+            received_at REAL NOT NULL,
+            state TEXT NOT NULL DEFAULT 'pending',
+            attempts INTEGER NOT NULL DEFAULT 0,
+            next_attempt_at REAL NOT NULL,
+            last_error TEXT,
+            claimed_by TEXT
+        )
+        """)
+
         base_categories = [("Iphone",), ("MacBook",), ("AirPods",), ("Apple Watch",)]
         cursor.executemany("INSERT OR IGNORE INTO categories (name) VALUES (?)", base_categories)
         
@@ -88,30 +168,333 @@ def init_db():
             cursor.execute("ALTER TABLE orders ADD COLUMN customer_city TEXT")
             cursor.execute("ALTER TABLE orders ADD COLUMN customer_address TEXT")
 
+        # Миграция: исходная цена и валюта товара (см. catalog.CurrencyRepricer)
+        try:
+            cursor.execute("SELECT price_amount, price_currency FROM products LIMIT 1")
+        except sqlite3.OperationalError:
+            logger.info("Обновление схемы 'products': добавление 'price_amount' и 'price_currency'.")
+            cursor.execute("ALTER TABLE products ADD COLUMN price_amount INTEGER")
+            cursor.execute("ALTER TABLE products ADD COLUMN price_currency TEXT")
+            backfill_product_prices(cursor)
+
+        # Миграция: язык интерфейса пользователя (см. users.LanguageStore)
+        try:
+            cursor.execute("SELECT language FROM users LIMIT 1")
+        except sqlite3.OperationalError:
+            logger.info("Обновление схемы 'users': добавление 'language'.")
+            cursor.execute("ALTER TABLE users ADD COLUMN language TEXT")
+
+        # Миграция: владелец захваченного платежного события (см. outbox.PaymentOutbox.claim)
+        try:
+            cursor.execute("SELECT claimed_by FROM payment_events LIMIT 1")
+        except sqlite3.OperationalError:
+            logger.info("Обновление схемы 'payment_events': добавление 'claimed_by'.")
+            cursor.execute("ALTER TABLE payment_events ADD COLUMN claimed_by TEXT")
+
+        sync_indexes(cursor)
+
         conn.commit()
+        sync_daily_stats(conn)
         logger.info("База данных успешно инициализирована.")
 
 
-def db_query(query, params=(), fetchone=False, fetchall=False, commit=False):
+def backfill_product_prices(cursor):
+    """Заполняет исходную сумму и валюту существующих товаров из отображаемой цены ("1200 $")."""
+    updates = []
+    for product_id, price in cursor.execute("SELECT id, price FROM products WHERE price IS NOT NULL").fetchall():
+        parsed = parse_price(price)
+        if parsed:
+            updates.append((*parsed, product_id))
+    cursor.executemany("UPDATE products SET price_amount = ?, price_currency = ? WHERE id = ?", updates)
+    logger.info(f"Исходные цены восстановлены для {len(updates)} товаров.")
+
+
+def sync_indexes(cursor):
+    """Приводит вторичные индексы БД в соответствие с INDEXES."""
+    existing = {row[0] for row in cursor.execute(
+        "SELECT name FROM sqlite_master WHERE type = 'index' AND name LIKE 'idx\\_%' ESCAPE '\\'"
+    )}
+    for name in existing - INDEXES.keys():
+        logger.info(f"Удаление устаревшего индекса {name}")
+        cursor.execute(f"DROP INDEX IF EXISTS {name}")
+    for name, (table, columns) in INDEXES.items():
+        if name not in existing:
+            logger.info(f"Создание индекса {name} ON {table}({columns})")
+        cursor.execute(f"CREATE INDEX IF NOT EXISTS {name} ON {table} ({columns})")
+
+
+def sync_daily_stats(conn):
     """
-    Универсальная функция для выполнения запросов к БД.
+    Создает таблицу дневных сводок daily_stats и триггеры, которые поддерживают ее
+    при регистрации пользователей, создании и оплате заказов (в любом процессе,
+    пишущем в БД). При первом создании таблица заполняется из существующих данных;
+    строки без join_date/created_at попадают в день UNDATED_DAY.
+    Даты локальные: join_date и created_at пишутся как datetime.now().isoformat(),
+    а время оплаты в orders не хранится, поэтому триггер оплаты берет текущую
+    локальную дату. Выручка учитывается в копейках; для заказов, оплаченных до
+    появления таблицы, днем оплаты считается день создания заказа.
     """
-    with sqlite3.connect(DB_NAME) as conn:
+    cursor = conn.cursor()
+    # Заполнение и создание триггеров в одной транзакции, чтобы не потерять и не задвоить строки
+    cursor.execute("BEGIN IMMEDIATE")
+    try:
+        exists = cursor.execute(
+            "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'daily_stats'"
+        ).fetchone()
+        cursor.execute("""
+        CREATE TABLE IF NOT EXISTS daily_stats (
+            day TEXT PRIMARY KEY, -- YYYY-MM-DD, локальная дата
+            signups INTEGER NOT NULL DEFAULT 0,
+            orders INTEGER NOT NULL DEFAULT 0,
+            paid_orders INTEGER NOT NULL DEFAULT 0,
+            revenue INTEGER NOT NULL DEFAULT 0
+        )
+        """)
+        if not exists:
+            logger.info("Заполнение daily_stats из существующих пользователей и заказов.")
+            cursor.execute("""
+            INSERT INTO daily_stats (day, signups)
+            SELECT COALESCE(date(join_date), :undated) AS day, COUNT(*) FROM users GROUP BY day
+            """, {"undated": UNDATED_DAY})
+            cursor.execute("""
+            INSERT INTO daily_stats (day, orders, paid_orders, revenue)
+            SELECT COALESCE(date(created_at), :undated) AS day, COUNT(*),
+                   SUM(status = 'paid'), SUM(CASE WHEN status = 'paid' THEN amount ELSE 0 END)
+            FROM orders GROUP BY day
+            ON CONFLICT(day) DO UPDATE SET orders = excluded.orders, paid_orders = excluded.paid_orders,
+                                           revenue = excluded.revenue
+            """, {"undated": UNDATED_DAY})
+        cursor.execute("""
+        CREATE TRIGGER IF NOT EXISTS trg_daily_stats_signup AFTER INSERT ON users
+        BEGIN
+            INSERT INTO daily_stats (day, signups)
+            VALUES (COALESCE(date(NEW.join_date), date('now', 'localtime')), 1)
+            ON CONFLICT(day) DO UPDATE SET signups = signups + 1;
+        END
+        """)
+        cursor.execute("""
+        CREATE TRIGGER IF NOT EXISTS trg_daily_stats_order AFTER INSERT ON orders
+        BEGIN
+            INSERT INTO daily_stats (day, orders)
+            VALUES (COALESCE(date(NEW.created_at), date('now', 'localtime')), 1)
+            ON CONFLICT(day) DO UPDATE SET orders = orders + 1;
+        END
+        """)
+        cursor.execute("""
+        CREATE TRIGGER IF NOT EXISTS trg_daily_stats_paid AFTER UPDATE OF status ON orders
+        WHEN NEW.status = 'paid' AND OLD.status IS NOT 'paid'
+        BEGIN
+            INSERT INTO daily_stats (day, paid_orders, revenue)
+            VALUES (date('now', 'localtime'), 1, NEW.amount)
+            ON CONFLICT(day) DO UPDATE SET paid_orders = paid_orders + 1, revenue = revenue + NEW.amount;
+        END
+        """)
+    except BaseException:
+        conn.rollback()
+        raise
+    conn.commit()
+
+
+def explain_query_plan(query, params=(), db_path=DB_NAME) -> list[str]:
+    """Возвращает строки EXPLAIN QUERY PLAN для запроса (например, 'SEARCH orders USING INDEX ...')."""
+    with sqlite3.connect(db_path) as conn:
+        return [row[3] for row in conn.execute(f"EXPLAIN QUERY PLAN {query}", params)]
+
+
+class DatabasePool:
+    """
+    Пул долгоживущих соединений SQLite.
+    Каждое соединение принадлежит своему потоку выделенного executor'а,
+    поэтому async-обработчики не блокируют event loop на операциях с диском.
+    """
+
+    def __init__(self, db_path: str = DB_NAME, size: int = DB_POOL_SIZE, busy_timeout_ms: int = DB_BUSY_TIMEOUT_MS):
+        self.db_path = db_path
+        self.size = size
+        self.busy_timeout_ms = busy_timeout_ms
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self._executor = None
+        self._connections = []
+        # Статистика по формам запросов и журнал медленных запросов (выключен по умолчанию, см. DB_PROFILE)
+        self.profiler = QueryProfiler()
+
+    def _connect(self) -> sqlite3.Connection:
+        conn = sqlite3.connect(self.db_path, timeout=self.busy_timeout_ms / 1000, check_same_thread=False)
         conn.row_factory = sqlite3.Row
-        cursor = conn.cursor()
-        cursor.execute(query, params)
-        
-        result = None
-        if fetchone:
-            result = cursor.fetchone()
-        elif fetchall:
-            result = cursor.fetchall()
-            
-        if commit:
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute(f"PRAGMA busy_timeout={int(self.busy_timeout_ms)}")
+        # В режиме WAL NORMAL безопасен: fsync выполняется на checkpoint, а не на каждый commit
+        conn.execute("PRAGMA synchronous=NORMAL")
+        return conn
+
+    def _init_worker(self):
+        conn = self._connect()
+        self._local.conn = conn
+        with self._lock:
+            self._connections.append(conn)
+
+    def _get_executor(self) -> ThreadPoolExecutor:
+        if self._executor is None:
+            with self._lock:
+                if self._executor is None:
+                    self._executor = ThreadPoolExecutor(
+                        max_workers=self.size,
+                        thread_name_prefix="db-pool",
+                        initializer=self._init_worker,
+                    )
+        return self._executor
+
+    # --- Синхронные операции (выполняются в потоках пула) ---
+
+    def _observe(self, started: float, query, params=(), label: str | None = None):
+        """
+        Учитывает операцию в DB_QUERY_LATENCY и профилировщике: метка - нормализованный
+        текст запроса (транзакции и with_connection - имя функции). Ожидание потока пула не учитывается.
+        """
+        seconds = time.perf_counter() - started
+        label = label or statement_label(query)
+        DB_QUERY_LATENCY.observe(seconds, label)
+        if self.profiler.enabled:
+            self.profiler.record(self._local.conn, label, query, params, seconds)
+
+    def _fetchone(self, query, params):
+        started = time.perf_counter()
+        try:
+            return self._local.conn.execute(query, params).fetchone()
+        finally:
+            self._observe(started, query, params)
+
+    def _fetchall(self, query, params):
+        started = time.perf_counter()
+        try:
+            return self._local.conn.execute(query, params).fetchall()
+        finally:
+            self._observe(started, query, params)
+
+    def _execute(self, query, params):
+        conn = self._local.conn
+        started = time.perf_counter()
+        try:
+            with conn:
+                cursor = conn.execute(query, params)
+        finally:
+            self._observe(started, query, params)
+        return ExecuteResult(cursor.rowcount, cursor.lastrowid)
+
+    def _executemany(self, query, seq_of_params):
+        conn = self._local.conn
+        started = time.perf_counter()
+        try:
+            with conn:
+                cursor = conn.executemany(query, seq_of_params)
+        finally:
+            self._observe(started, query, seq_of_params[0] if seq_of_params else ())
+        return cursor.rowcount
+
+    def _transaction(self, fn, args):
+        conn = self._local.conn
+        started = time.perf_counter()
+        try:
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                result = fn(conn, *args)
+            except BaseException:
+                conn.rollback()
+                raise
             conn.commit()
-            
+        finally:
+            self._observe(started, None, label=f"transaction {fn.__name__}")
+        return result
+
+    def _with_connection(self, fn, args):
+        started = time.perf_counter()
+        try:
+            return fn(self._local.conn, *args)
+        finally:
+            self._observe(started, None, label=f"connection {fn.__name__}")
+
+    # --- Публичный API ---
+
+    async def run(self, fn, *args):
+        """Выполняет fn(*args) в потоке пула, не блокируя event loop."""
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self._get_executor(), fn, *args)
+
+    def run_sync(self, fn, *args):
+        """Синхронный вариант run() для кода вне event loop (CLI, Flask-обработчики)."""
+        return self._get_executor().submit(fn, *args).result()
+
+    async def fetchone(self, query, params=()):
+        return await self.run(self._fetchone, query, params)
+
+    async def fetchall(self, query, params=()):
+        return await self.run(self._fetchall, query, params)
+
+    async def execute(self, query, params=()) -> ExecuteResult:
+        """Выполняет изменяющий запрос в отдельной транзакции."""
+        return await self.run(self._execute, query, params)
+
+    async def executemany(self, query, seq_of_params) -> int:
+        """Выполняет запрос для каждого набора параметров одной транзакцией."""
+        return await self.run(self._executemany, query, list(seq_of_params))
+
+    async def transaction(self, fn, *args):
+        """
+        Выполняет fn(conn, *args) внутри BEGIN IMMEDIATE ... COMMIT.
+        При исключении транзакция откатывается.
+        """
+        return await self.run(self._transaction, fn, args)
+
+    async def with_connection(self, fn, *args):
+        """Выполняет fn(conn, *args) без явной транзакции (например, потоковое чтение курсора)."""
+        return await self.run(self._with_connection, fn, args)
+
+    def close(self):
+        """Дожидается завершения запросов и закрывает все соединения пула."""
+        with self._lock:
+            executor, self._executor = self._executor, None
+        if executor is not None:
+            executor.shutdown(wait=True)
+        with self._lock:
+            connections, self._connections = self._connections, []
+        for conn in connections:
+            conn.close()
+
+
+# Общий пул для бота и веб-сервера
+pool = DatabasePool()
+
+
+def db_query(query, params=(), fetchone=False, fetchall=False, commit=False):
+    """
+    Универсальная синхронная функция для выполнения запросов к БД.
+    Использует соединения общего пула; в async-коде используйте методы `pool`.
+    """
+    def _run():
+        conn = pool._local.conn
+        started = time.perf_counter()
+        try:
+            # Как и раньше, транзакция фиксируется при успехе и откатывается при ошибке
+            with conn:
+                cursor = conn.execute(query, params)
+
+                result = None
+                if fetchone:
+                    result = cursor.fetchone()
+                elif fetchall:
+                    result = cursor.fetchall()
+
+                if commit:
+                    conn.commit()
+        finally:
+            pool._observe(started, query, params)
+
         return result
 
+    return pool.run_sync(_run)
+
+
 def register_user(user_id: int, username: str, first_name: str):
     """
     Добавляет нового пользователя в БД, если он еще не зарегистрирован.
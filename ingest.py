@@ -0,0 +1,184 @@
+import logging
+import re
+import threading
+
+logger = logging.getLogger(__name__)
+
+# Шаблоны компилируются один раз при импорте модуля
+PRICE_PATTERN = re.compile(
+    r'Цена\s*[:\-]*\s*([\d\s.,]+)\s*?(\$|usd|eur|€|грн|uah|руб|rub)|'
+    r'([\d\s.,]+)\s*?(\$|usd|eur|€|грн|uah|руб|rub)',
+    re.IGNORECASE | re.UNICODE
+)
+YEAR_PATTERN = re.compile(r'\b(20\d{2})\b')
+NON_NUMERIC_PATTERN = re.compile(r'[^\d.]')
+
+MAX_PRODUCT_NAME_LENGTH = 100
+
+
+class CategoryMatcher:
+    """
+    Поиск категории в тексте поста одним проходом скомпилированного регулярного выражения.
+
+    Названия объединяются в альтернацию в порядке приоритета (порядок категорий в БД)
+    внутри опережающей проверки, поэтому в каждой позиции текста находится самая
+    приоритетная подходящая категория, а среди всех позиций выбирается лучшая -
+    результат совпадает с последовательной проверкой категорий по одной.
+    Шаблон перестраивается только при изменении списка категорий.
+    """
+
+    def __init__(self, categories=()):
+        self._lock = threading.Lock()
+        self._pattern = None
+        self._names = ()
+        self._priority = {}
+        self.rebuild(categories)
+
+    def rebuild(self, categories):
+        names = tuple(categories)
+        lowered = {}
+        for cat_name in names:
+            lowered.setdefault(cat_name.lower(), cat_name)
+        priority = {key: index for index, key in enumerate(lowered)}
+        pattern = None
+        if lowered:
+            alternation = "|".join(re.escape(key) for key in lowered)
+            pattern = re.compile(r'(?=\b(' + alternation + r')\b)', re.UNICODE)
+        with self._lock:
+            self._names = names
+            self._lowered = lowered
+            self._priority = priority
+            self._pattern = pattern
+
+    def match(self, text_lower: str) -> str | None:
+        """Возвращает самую приоритетную категорию, встречающуюся в тексте (в нижнем регистре)."""
+        pattern, priority, lowered = self._pattern, self._priority, self._lowered
+        if pattern is None:
+            return None
+        best = None
+        for found in pattern.finditer(text_lower):
+            key = found.group(1)
+            if best is None or priority[key] < priority[best]:
+                best = key
+                if priority[key] == 0:
+                    break
+        return lowered[best] if best is not None else None
+
+    def attach(self, catalog_cache):
+        """Подписывает матчер на изменения списка категорий в кэше каталога."""
+        def on_change(event, old, new):
+            if event in ("reload", "category_add", "category_delete"):
+                self.rebuild(catalog_cache.categories)
+        catalog_cache.subscribe(on_change)
+        self.rebuild(catalog_cache.categories)
+
+
+# Валюта из текста поста -> код валюты, в которой хранится исходная цена товара
+CURRENCY_CODES = {'$': 'USD', 'usd': 'USD', 'eur': 'EUR', '€': 'EUR', 'грн': 'UAH', 'uah': 'UAH',
+                  'руб': 'RUB', 'rub': 'RUB'}
+
+
+def to_kopecks(price_amount: int | None, price_currency: str | None, usd_rate: float | None) -> int | None:
+    """
+    Цена в копейках UAH по исходной сумме (в сотых долях валюты) и текущему курсу.
+    None, если цена не задана, валюта не поддерживается или курс USD еще неизвестен.
+    """
+    if price_amount is None:
+        return None
+    if price_currency == 'UAH':
+        return price_amount
+    if price_currency == 'USD' and usd_rate:
+        return int(price_amount * usd_rate)
+    return None
+
+
+def _find_price(text: str):
+    """Первая цена в тексте: (match, сумма в сотых долях валюты, валюта как в тексте) или None."""
+    match = PRICE_PATTERN.search(text)
+    if not match:
+        return None
+    if match.group(1):
+        price_str = match.group(1)
+        currency = match.group(2).lower() if match.group(2) else ''
+    else:
+        price_str = match.group(3)
+        currency = match.group(4).lower() if match.group(4) else ''
+    price_value = float(NON_NUMERIC_PATTERN.sub('', price_str.replace(',', '.')))
+    return match, price_value, currency
+
+
+def parse_price(text: str) -> tuple[int, str] | None:
+    """Исходная цена из текста: (сумма в сотых долях валюты, код валюты) или None."""
+    found = _find_price(text)
+    if found is None:
+        return None
+    _, price_value, currency = found
+    return round(price_value * 100), CURRENCY_CODES[currency]
+
+
+def extract_price(text_with_price: str, usd_rate: float | None) -> dict:
+    """
+    Находит цену в тексте. Возвращает словарь с ценой для показа (price),
+    исходной суммой и валютой (price_amount, price_currency), ценой в копейках UAH
+    по курсу usd_rate (price_numeric) и текстом без строк с ценой (description).
+    """
+    found = _find_price(text_with_price)
+    if found is None:
+        return {"price": "По запросу", "price_amount": None, "price_currency": None,
+                "price_numeric": None, "description": text_with_price}
+    match, price_value, currency = found
+
+    currency_symbol = currency.replace('usd','$').replace('eur', '€').replace('грн', 'UAH').replace('uah', 'UAH').upper()
+    price_display = f"{int(price_value) if price_value.is_integer() else price_value} {currency_symbol}"
+
+    price_amount = round(price_value * 100)
+    price_currency = CURRENCY_CODES[currency]
+    price_numeric = to_kopecks(price_amount, price_currency, usd_rate)
+    if price_currency == 'USD' and not usd_rate:
+        logger.warning("Не удалось получить курс USD, цена будет пересчитана после получения курса.")
+
+    # Строки до первой найденной цены заведомо ее не содержат, проверяются только остальные
+    head_end = text_with_price.rfind("\n", 0, match.start()) + 1
+    head = text_with_price[:head_end].splitlines()
+    tail = [line for line in text_with_price[head_end:].splitlines() if not PRICE_PATTERN.search(line)]
+    return {"price": price_display, "price_amount": price_amount, "price_currency": price_currency,
+            "price_numeric": price_numeric, "description": "\n".join(head + tail).strip()}
+
+
+def process_price_string(text_with_price: str, usd_rate: float | None) -> tuple[str, int | None, str]:
+    """
+    Находит цену в тексте. Возвращает (цена для показа, цена в копейках UAH или None,
+    текст без строк с ценой). Цена в USD пересчитывается по курсу usd_rate.
+    """
+    price = extract_price(text_with_price, usd_rate)
+    return price["price"], price["price_numeric"], price["description"]
+
+
+def parse_post_text(text: str, matcher: CategoryMatcher, usd_rate: float | None) -> tuple[str, str, dict] | None:
+    """
+    Разбирает текст поста канала: (категория, название, детали) или None,
+    если в тексте нет известной категории. Медиа в детали не входят.
+    """
+    category = matcher.match(text.lower())
+    if not category: return None
+
+    product_name = None
+    lines = [line for line in text.splitlines() if line.strip()]
+    if not lines: return None
+
+    category_lower = category.lower()
+    if category_lower in lines[0].lower():
+        product_name = lines[0].strip()
+    else:
+        for line in lines:
+            if category_lower in line.lower():
+                product_name = line.strip()
+                break
+    if not product_name: product_name = lines[0].strip()
+    if len(product_name) > MAX_PRODUCT_NAME_LENGTH: product_name = product_name[:MAX_PRODUCT_NAME_LENGTH - 3] + "..."
+
+    details = extract_price(text, usd_rate)
+
+    year_match = YEAR_PATTERN.search(text)
+    details["year"] = int(year_match.group(1)) if year_match else None
+    return category, product_name, details
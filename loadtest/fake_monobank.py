@@ -0,0 +1,69 @@
+"""
+Локальная заглушка API эквайринга Monobank.
+
+Использование:
+    server = FakeMonobank(fail_first=2, latency=0.05)
+    await server.start()
+    client = MonobankClient(token="test", base_url=server.base_url)
+
+Запуск отдельно: python -m loadtest.fake_monobank --port 8081
+"""
+import argparse
+import asyncio
+import uuid
+
+from loadtest.http import JsonHttpServer
+
+
+class FakeMonobank(JsonHttpServer):
+    """
+    Реализует POST /api/merchant/invoice/create.
+    fail_first — сколько первых запросов завершить ответом fail_status (проверка повторов);
+    latency — искусственная задержка ответа в секундах.
+    """
+
+    def __init__(self, host: str = "127.0.0.1", port: int = 0, fail_first: int = 0, latency: float = 0.0,
+                 fail_status: int = 503):
+        super().__init__(host, port)
+        self.fail_first = fail_first
+        self.fail_status = fail_status
+        self.latency = latency
+        self.requests = []
+        self.invoices = {}
+        self.route("POST", "/api/merchant/invoice/create", self.create_invoice)
+
+    async def create_invoice(self, request):
+        self.requests.append(request)
+        if self.latency:
+            await asyncio.sleep(self.latency)
+        if not request.headers.get("x-token"):
+            return 403, {"errCode": "FORBIDDEN", "errText": "forbidden"}
+        if len(self.requests) <= self.fail_first:
+            return self.fail_status, {"errCode": "INTERNAL", "errText": "temporary failure"}
+
+        data = request.json()
+        if not data or not isinstance(data.get("amount"), int) or data["amount"] <= 0:
+            return 400, {"errCode": "BAD_REQUEST", "errText": "invalid amount"}
+        invoice_id = uuid.uuid4().hex
+        self.invoices[invoice_id] = data
+        return 200, {"invoiceId": invoice_id, "pageUrl": f"{self.base_url}/pay/{invoice_id}"}
+
+
+async def _serve_forever(port: int, fail_first: int, latency: float):
+    server = FakeMonobank(port=port, fail_first=fail_first, latency=latency)
+    await server.start()
+    print(f"Fake Monobank: {server.base_url}")
+    await asyncio.Event().wait()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--port", type=int, default=8081)
+    parser.add_argument("--fail-first", type=int, default=0)
+    parser.add_argument("--latency", type=float, default=0.0)
+    args = parser.parse_args()
+    asyncio.run(_serve_forever(args.port, args.fail_first, args.latency))
+
+
+if __name__ == "__main__":
+    main()
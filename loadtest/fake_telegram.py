@@ -0,0 +1,544 @@
+"""
+Локальная заглушка Telegram Bot API и виртуальные пользователи для сквозного
+нагрузочного теста диалогов бота.
+
+FakeTelegram реализует методы Bot API, которые использует бот (getMe, getUpdates,
+sendMessage, editMessage*, answerCallbackQuery, ...), хранит отправленные ботом
+сообщения и выдает боту апдейты от виртуальных пользователей через getUpdates.
+Application направляется на заглушку через main.build_application(base_url=...).
+
+Виртуальный пользователь проходит сценарий покупки: /start -> каталог -> cat_ ->
+prod_ -> buy_ -> pay_ -> телефон -> имя -> город -> отделение НП. Для каждого
+шага замеряется время от отправки апдейта до ответа бота. Заглушка и пользователи
+работают в отдельном потоке, бот - в основном, поэтому блокировка event loop бота
+видна и в задержках шагов, и в отдельном замере задержки его event loop.
+
+Запуск: python -m loadtest.fake_telegram [--users 200] [--ramp 5] [--products 1000]
+Только сервер: python -m loadtest.fake_telegram --serve --port 8082
+"""
+import argparse
+import asyncio
+import itertools
+import json
+import logging
+import os
+import random
+import statistics
+import tempfile
+import threading
+import time
+from collections import Counter, defaultdict, deque
+from typing import NamedTuple
+
+from loadtest.http import JsonHttpServer
+
+logger = logging.getLogger(__name__)
+
+FAKE_BOT_TOKEN = "123456789:LOADTEST-fake-telegram-token"
+# Первый user_id виртуальных пользователей (не пересекается с datagen.user_rows)
+FIRST_VIRTUAL_USER_ID = 900_000_000
+OFFLINE_PAYMENT_METHODS = ("cod", "cash", "cashless")
+# Параметры JSON-типов, которые PTB передает в форме строками
+JSON_PARAMETERS = {"reply_markup", "media", "entities", "caption_entities", "allowed_updates", "link_preview_options"}
+
+
+class BotCall(NamedTuple):
+    """Вызов Bot API ботом: метод, чат, параметры, итоговое сообщение и время вызова."""
+    method: str
+    chat_id: int | None
+    params: dict
+    message: dict | None
+    at: float
+
+    def buttons(self) -> list[str]:
+        """callback_data всех inline-кнопок сообщения."""
+        markup = self.params.get("reply_markup") or {}
+        return [button["callback_data"] for row in markup.get("inline_keyboard", ())
+                for button in row if "callback_data" in button]
+
+
+class FakeTelegram(JsonHttpServer):
+    """
+    Bot API по адресу {base_url}/bot<token>/<method>.
+    latency - искусственная задержка ответа на каждый вызов в секундах.
+    """
+
+    def __init__(self, host: str = "127.0.0.1", port: int = 0, latency: float = 0.0):
+        super().__init__(host, port)
+        self.latency = latency
+        self.bot_user = {"id": int(FAKE_BOT_TOKEN.split(":")[0]), "is_bot": True, "first_name": "Fake Bot",
+                         "username": "fake_loadtest_bot", "can_join_groups": False,
+                         "can_read_all_group_messages": False, "supports_inline_queries": False}
+        self.calls = Counter()
+        self._updates = deque()
+        self._update_ids = itertools.count(1)
+        self._updates_ready = None
+        self._message_ids = {}
+        self._messages = {}
+        self._inboxes = defaultdict(asyncio.Queue)
+        self._callback_ids = itertools.count(1)
+        self._callback_chats = {}
+        self.route("*", "/bot*", self.dispatch)
+
+    async def start(self):
+        self._updates_ready = asyncio.Event()
+        self._closing = False
+        await super().start()
+
+    async def stop(self):
+        # Отпускаем ожидающие getUpdates, чтобы не обрывать их отменой задач
+        self._closing = True
+        self._updates_ready.set()
+        await asyncio.sleep(0.05)
+        await super().stop()
+
+    # --- Апдейты от пользователей ---
+
+    def push_update(self, update: dict) -> int:
+        update_id = next(self._update_ids)
+        self._updates.append({"update_id": update_id, **update})
+        self._updates_ready.set()
+        return update_id
+
+    def inbox(self, chat_id: int) -> asyncio.Queue:
+        """Очередь вызовов Bot API, адресованных чату chat_id."""
+        return self._inboxes[chat_id]
+
+    def callback_id(self, chat_id: int) -> str:
+        callback_id = str(next(self._callback_ids))
+        self._callback_chats[callback_id] = chat_id
+        return callback_id
+
+    def message(self, chat_id: int, message_id: int) -> dict | None:
+        return self._messages.get((chat_id, message_id))
+
+    # --- Диспетчер Bot API ---
+
+    async def dispatch(self, request):
+        method = request.path.rsplit("/", 1)[-1]
+        handler = getattr(self, f"api_{method}", None)
+        if handler is None:
+            return 404, {"ok": False, "error_code": 404, "description": f"Not Found: method {method} not found"}
+        params = {}
+        for key, value in request.form().items():
+            params[key] = json.loads(value) if key in JSON_PARAMETERS and isinstance(value, str) else value
+        self.calls[method] += 1
+        if self.latency:
+            await asyncio.sleep(self.latency)
+        result = await handler(params)
+        if isinstance(result, tuple):
+            return result
+        return 200, {"ok": True, "result": result}
+
+    def _record(self, method: str, chat_id, params: dict, message: dict | None = None):
+        chat_id = int(chat_id) if chat_id is not None else None
+        if chat_id is not None:
+            self._inboxes[chat_id].put_nowait(BotCall(method, chat_id, params, message, time.perf_counter()))
+
+    def _new_message(self, chat_id, **fields) -> dict:
+        # Как и Telegram, в сообщении возвращается только inline-клавиатура
+        chat_id = int(chat_id)
+        message_id = self._next_message_id(chat_id)
+        message = {"message_id": message_id, "date": int(time.time()), "from": self.bot_user,
+                   "chat": {"id": chat_id, "type": "private"}, **fields}
+        self._messages[(chat_id, message_id)] = message
+        return message
+
+    def _next_message_id(self, chat_id: int) -> int:
+        counter = self._message_ids.get(chat_id)
+        if counter is None:
+            counter = self._message_ids[chat_id] = itertools.count(1_000)
+        return next(counter)
+
+    def _edit(self, method: str, params: dict, **fields):
+        chat_id, message_id = int(params.get("chat_id", 0)), int(params.get("message_id", 0))
+        message = self._messages.get((chat_id, message_id))
+        if message is None:
+            return 400, {"ok": False, "error_code": 400, "description": "Bad Request: message to edit not found"}
+        message.update({key: value for key, value in fields.items() if value is not None})
+        if "inline_keyboard" in (params.get("reply_markup") or {}):
+            message["reply_markup"] = params["reply_markup"]
+        else:
+            message.pop("reply_markup", None)
+        message["edit_date"] = int(time.time())
+        self._record(method, chat_id, params, message)
+        return message
+
+    # --- Методы ---
+
+    async def api_getMe(self, params):
+        return self.bot_user
+
+    async def api_deleteWebhook(self, params):
+        return True
+
+    async def api_setMyCommands(self, params):
+        return True
+
+    async def api_close(self, params):
+        return True
+
+    async def api_logOut(self, params):
+        return True
+
+    async def api_getUpdates(self, params):
+        offset = int(params.get("offset") or 0)
+        limit = int(params.get("limit") or 100)
+        timeout = float(params.get("timeout") or 0)
+        while self._updates and self._updates[0]["update_id"] < offset:
+            self._updates.popleft()
+        if not self._updates and timeout and not self._closing:
+            self._updates_ready.clear()
+            try:
+                await asyncio.wait_for(self._updates_ready.wait(), timeout)
+            except asyncio.TimeoutError:
+                pass
+        return list(itertools.islice(self._updates, limit))
+
+    async def api_sendMessage(self, params):
+        message = self._new_message(params["chat_id"], text=params.get("text", ""))
+        if "inline_keyboard" in (params.get("reply_markup") or {}):
+            message["reply_markup"] = params["reply_markup"]
+        self._record("sendMessage", params["chat_id"], params, message)
+        return message
+
+    async def _send_media(self, method: str, kind: str, params):
+        file_id = params.get(kind)
+        media = {"file_id": file_id, "file_unique_id": f"u{file_id}"}
+        payload = [dict(media, width=800, height=800)] if kind == "photo" else dict(media, width=800, height=800, duration=10)
+        message = self._new_message(params["chat_id"], caption=params.get("caption"), **{kind: payload})
+        if "inline_keyboard" in (params.get("reply_markup") or {}):
+            message["reply_markup"] = params["reply_markup"]
+        self._record(method, params["chat_id"], params, message)
+        return message
+
+    async def api_sendPhoto(self, params):
+        return await self._send_media("sendPhoto", "photo", params)
+
+    async def api_sendVideo(self, params):
+        return await self._send_media("sendVideo", "video", params)
+
+    async def api_editMessageText(self, params):
+        return self._edit("editMessageText", params, text=params.get("text"))
+
+    async def api_editMessageCaption(self, params):
+        return self._edit("editMessageCaption", params, caption=params.get("caption"))
+
+    async def api_editMessageReplyMarkup(self, params):
+        return self._edit("editMessageReplyMarkup", params)
+
+    async def api_editMessageMedia(self, params):
+        media = params.get("media") or {}
+        kind = media.get("type", "photo")
+        file = {"file_id": media.get("media"), "file_unique_id": f"u{media.get('media')}", "width": 800, "height": 800}
+        return self._edit("editMessageMedia", params, caption=media.get("caption"),
+                          **{kind: [file] if kind == "photo" else dict(file, duration=10)})
+
+    async def api_deleteMessage(self, params):
+        chat_id, message_id = int(params["chat_id"]), int(params["message_id"])
+        self._messages.pop((chat_id, message_id), None)
+        self._record("deleteMessage", chat_id, params)
+        return True
+
+    async def api_answerCallbackQuery(self, params):
+        self._record("answerCallbackQuery", self._callback_chats.pop(params.get("callback_query_id"), None), params)
+        return True
+
+    async def api_getChat(self, params):
+        chat_id = int(params["chat_id"])
+        return {"id": chat_id, "type": "private", "first_name": f"User {chat_id}"}
+
+
+class StepTimeout(Exception):
+    """Бот не ответил на шаг сценария за отведенное время."""
+
+
+class VirtualUser:
+    """Пользователь Telegram, отправляющий боту апдейты через FakeTelegram."""
+
+    def __init__(self, server: FakeTelegram, user_id: int, first_name: str, step_timeout: float = 30):
+        self.server = server
+        self.user = {"id": user_id, "is_bot": False, "first_name": first_name, "username": f"vu{user_id}",
+                     "language_code": "uk"}
+        self.chat = {"id": user_id, "type": "private", "first_name": first_name}
+        self.step_timeout = step_timeout
+        self._message_ids = itertools.count(1)
+
+    @property
+    def id(self) -> int:
+        return self.user["id"]
+
+    def send_text(self, text: str):
+        message = {"message_id": next(self._message_ids), "date": int(time.time()), "chat": self.chat,
+                   "from": self.user, "text": text}
+        if text.startswith("/"):
+            message["entities"] = [{"type": "bot_command", "offset": 0, "length": len(text.split()[0])}]
+        self.server.push_update({"message": message})
+
+    def press(self, message: dict, data: str):
+        current = self.server.message(self.id, message["message_id"]) or message
+        self.server.push_update({"callback_query": {
+            "id": self.server.callback_id(self.id), "from": self.user, "message": current,
+            "chat_instance": str(self.id), "data": data,
+        }})
+
+    async def expect(self, predicate) -> BotCall:
+        """Ждет вызова Bot API в этот чат, удовлетворяющего predicate; остальные пропускает."""
+        inbox = self.server.inbox(self.id)
+        deadline = time.perf_counter() + self.step_timeout
+        while True:
+            remaining = deadline - time.perf_counter()
+            if remaining <= 0:
+                raise StepTimeout()
+            try:
+                call = await asyncio.wait_for(inbox.get(), remaining)
+            except asyncio.TimeoutError:
+                raise StepTimeout() from None
+            if predicate(call):
+                return call
+
+
+# --- Сценарий покупки ---
+
+def sent_message(call: BotCall) -> bool:
+    return call.method in ("sendMessage", "sendPhoto", "sendVideo")
+
+
+def with_buttons(prefix: str, methods=None):
+    def predicate(call: BotCall) -> bool:
+        return (methods is None or call.method in methods) and any(data.startswith(prefix) for data in call.buttons())
+    return predicate
+
+
+def with_reply_keyboard(call: BotCall) -> bool:
+    return call.method == "sendMessage" and "keyboard" in (call.params.get("reply_markup") or {})
+
+
+async def purchase_flow(user: VirtualUser, texts: dict, categories: set, rng: random.Random,
+                        think_time: float, record):
+    """
+    Проходит сценарий покупки с офлайн-оплатой. record(step, seconds) вызывается
+    для каждого шага; StepTimeout прерывает сценарий.
+    """
+    async def step(name, action, predicate) -> BotCall:
+        if think_time:
+            await asyncio.sleep(rng.uniform(0, 2 * think_time))
+        started = time.perf_counter()
+        action()
+        call = await user.expect(predicate)
+        record(name, call.at - started)
+        return call
+
+    await step("start", lambda: user.send_text("/start"), with_reply_keyboard)
+    listing = await step("catalog", lambda: user.send_text(texts["catalog"]), with_buttons("cat_", ("sendMessage",)))
+    category = rng.choice([data for data in listing.buttons() if data[4:] in categories] or listing.buttons())
+    page = await step("category", lambda: user.press(listing.message, category), with_buttons("prod_"))
+    product = rng.choice([data for data in page.buttons() if data.startswith("prod_")])
+    card = await step("product", lambda: user.press(page.message, product), with_buttons("buy_"))
+    buy = next(data for data in card.buttons() if data.startswith("buy_"))
+    payment = await step("buy", lambda: user.press(card.message, buy), with_buttons("pay_", ("sendMessage",)))
+    method = rng.choice([data for data in payment.buttons() if data.split("_")[1] in OFFLINE_PAYMENT_METHODS])
+    await step("pay", lambda: user.press(payment.message, method), sent_message)
+    phone = f"+38050{rng.randrange(10 ** 7):07d}"
+    await step("phone", lambda: user.send_text(phone), sent_message)
+    await step("name", lambda: user.send_text(f"Тест Користувач {user.id}"), sent_message)
+    await step("city", lambda: user.send_text(rng.choice(["Київ", "Львів", "Одеса", "Дніпро", "Харків"])), sent_message)
+    await step("finalize", lambda: user.send_text(f"Відділення №{rng.randint(1, 300)}"), with_reply_keyboard)
+
+
+async def run_users(server: FakeTelegram, users: int, ramp: float, think_time: float, step_timeout: float,
+                    texts: dict, categories: set, seed: int) -> dict:
+    rng = random.Random(seed)
+    latencies = defaultdict(list)
+    timeouts = Counter()
+    errors = Counter()
+    completed = 0
+
+    def record(step, seconds):
+        latencies[step].append(seconds)
+
+    async def one(index: int):
+        nonlocal completed
+        user_rng = random.Random(rng.random())
+        await asyncio.sleep(ramp * index / max(1, users))
+        user = VirtualUser(server, FIRST_VIRTUAL_USER_ID + index, f"VU{index}", step_timeout)
+        steps_before = {step: len(values) for step, values in latencies.items()}
+        try:
+            await purchase_flow(user, texts, categories, user_rng, think_time, record)
+            completed += 1
+        except StepTimeout:
+            done = {step for step, values in latencies.items() if len(values) > steps_before.get(step, 0)}
+            timeouts[next((step for step in FLOW_STEPS if step not in done), "unknown")] += 1
+        except Exception as e:
+            errors[type(e).__name__] += 1
+            logger.error(f"Ошибка сценария пользователя {user.id}: {e!r}")
+
+    started = time.perf_counter()
+    await asyncio.gather(*(one(index) for index in range(users)))
+    return {"seconds": time.perf_counter() - started, "completed": completed, "latencies": latencies,
+            "timeouts": timeouts, "errors": errors}
+
+
+FLOW_STEPS = ("start", "catalog", "category", "product", "buy", "pay", "phone", "name", "city", "finalize")
+
+
+# --- Прогон с настоящим Application ---
+
+class LoopLagProbe:
+    """Замеряет, на сколько просыпание event loop опаздывает относительно interval."""
+
+    def __init__(self, interval: float = 0.01):
+        self.interval = interval
+        self.lags = []
+        self._task = None
+
+    async def _run(self):
+        while True:
+            started = time.perf_counter()
+            await asyncio.sleep(self.interval)
+            self.lags.append(max(0.0, time.perf_counter() - started - self.interval))
+
+    def start(self):
+        self._task = asyncio.get_running_loop().create_task(self._run())
+
+    async def stop(self):
+        self._task.cancel()
+        try:
+            await self._task
+        except asyncio.CancelledError:
+            pass
+
+
+def summarize(values: list) -> dict:
+    values = sorted(values)
+    if not values:
+        return {"count": 0}
+
+    def pick(fraction):
+        return round(values[min(len(values) - 1, max(0, int(len(values) * fraction) - 1))] * 1000, 2)
+    return {"count": len(values), "p50_ms": pick(0.5), "p95_ms": pick(0.95), "p99_ms": pick(0.99),
+            "max_ms": round(values[-1] * 1000, 2), "mean_ms": round(statistics.fmean(values) * 1000, 2)}
+
+
+def start_server_thread(latency: float) -> tuple[FakeTelegram, asyncio.AbstractEventLoop, threading.Thread]:
+    """Запускает FakeTelegram в отдельном потоке со своим event loop."""
+    ready = threading.Event()
+    holder = {}
+
+    def target():
+        loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(loop)
+        server = FakeTelegram(latency=latency)
+        loop.run_until_complete(server.start())
+        holder.update(server=server, loop=loop)
+        ready.set()
+        loop.run_forever()
+        loop.run_until_complete(server.stop())
+        pending = asyncio.all_tasks(loop)
+        for task in pending:
+            task.cancel()
+        loop.run_until_complete(asyncio.gather(*pending, return_exceptions=True))
+        loop.close()
+
+    thread = threading.Thread(target=target, name="fake-telegram", daemon=True)
+    thread.start()
+    ready.wait()
+    return holder["server"], holder["loop"], thread
+
+
+async def run_bot(server: FakeTelegram, server_loop, users: int, ramp: float, think_time: float,
+                  step_timeout: float, seed: int) -> dict:
+    import main
+    from benchmarks.datagen import MODELS
+    application = main.build_application(token=FAKE_BOT_TOKEN, base_url=f"{server.base_url}/bot")
+    probe = LoopLagProbe()
+    async with application:
+        await main.on_startup(application)
+        await application.start()
+        await application.updater.start_polling(poll_interval=0.0, timeout=10)
+        probe.start()
+        texts = {"catalog": main.text_for("catalog", main.language_store.default)}
+        future = asyncio.run_coroutine_threadsafe(
+            run_users(server, users, ramp, think_time, step_timeout, texts, set(MODELS), seed), server_loop)
+        result = await asyncio.wrap_future(future)
+        await probe.stop()
+        await application.updater.stop()
+        await application.stop()
+        await main.on_shutdown(application)
+    result["loop_lag"] = probe.lags
+    return result
+
+
+def run(users: int = 200, ramp: float = 5.0, think_time: float = 0.0, step_timeout: float = 30.0,
+        products: int = 1000, api_latency: float = 0.0, seed: int = 42) -> dict:
+    import db
+    from benchmarks.datagen import populate_database
+    from benchmarks.suite import prepare_offline
+
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, "loadtest.db")
+        populate_database(path, products=products, users=0, orders=0, seed=seed)
+        db.pool.close()
+        db.pool.db_path = path
+        prepare_offline()
+        server, server_loop, thread = start_server_thread(api_latency)
+        try:
+            result = asyncio.run(run_bot(server, server_loop, users, ramp, think_time, step_timeout, seed))
+        finally:
+            server_loop.call_soon_threadsafe(server_loop.stop)
+            thread.join(5)
+
+    all_steps = [value for values in result["latencies"].values() for value in values]
+    return {
+        "users": users,
+        "completed_flows": result["completed"],
+        "seconds": round(result["seconds"], 2),
+        "flows_per_sec": round(result["completed"] / result["seconds"], 2),
+        "steps_per_sec": round(len(all_steps) / result["seconds"], 1),
+        "steps": {step: summarize(result["latencies"].get(step, [])) for step in FLOW_STEPS},
+        "timeouts": dict(result["timeouts"]),
+        "errors": dict(result["errors"]),
+        "bot_loop_lag": summarize(result["loop_lag"]),
+        "api_calls": dict(server.calls.most_common()),
+    }
+
+
+async def _serve_forever(port: int, latency: float):
+    server = FakeTelegram(port=port, latency=latency)
+    await server.start()
+    print(f"Fake Telegram Bot API: {server.base_url}/bot<token>/<method>")
+    await asyncio.Event().wait()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--users", type=int, default=200, help="Число виртуальных пользователей")
+    parser.add_argument("--ramp", type=float, default=5.0, help="За сколько секунд подключаются все пользователи")
+    parser.add_argument("--think-time", type=float, default=0.0, help="Средняя пауза пользователя между шагами, с")
+    parser.add_argument("--step-timeout", type=float, default=30.0)
+    parser.add_argument("--products", type=int, default=1000)
+    parser.add_argument("--api-latency", type=float, default=0.0, help="Задержка ответа заглушки Bot API, с")
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--json", help="Сохранить отчет в JSON")
+    parser.add_argument("--serve", action="store_true", help="Только запустить заглушку Bot API")
+    parser.add_argument("--port", type=int, default=8082)
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.WARNING)
+
+    if args.serve:
+        asyncio.run(_serve_forever(args.port, args.api_latency))
+        return
+    report = run(args.users, args.ramp, args.think_time, args.step_timeout, args.products, args.api_latency, args.seed)
+    for key, value in report.items():
+        if key == "steps":
+            for step, stats in value.items():
+                print(f"step {step}: {stats}")
+        else:
+            print(f"{key}: {value}")
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,122 @@
+"""
+Минимальный асинхронный HTTP/1.1 сервер на asyncio для локальных заглушек
+внешних API (Monobank, Telegram Bot API). Поддерживает keep-alive и JSON/form тела.
+Не предназначен для продакшена.
+"""
+import asyncio
+import json
+import logging
+from typing import NamedTuple
+from urllib.parse import parse_qs, urlsplit
+
+logger = logging.getLogger(__name__)
+
+REASONS = {200: "OK", 400: "Bad Request", 401: "Unauthorized", 403: "Forbidden", 404: "Not Found",
+           429: "Too Many Requests", 500: "Internal Server Error", 503: "Service Unavailable"}
+
+
+class Request(NamedTuple):
+    method: str
+    path: str
+    query: dict
+    headers: dict
+    body: bytes
+
+    def json(self):
+        return json.loads(self.body or b"null")
+
+    def form(self) -> dict:
+        """Тело application/x-www-form-urlencoded или JSON как словарь."""
+        if self.headers.get("content-type", "").startswith("application/json"):
+            return self.json() or {}
+        return {k: v[0] for k, v in parse_qs(self.body.decode()).items()}
+
+
+class JsonHttpServer:
+    """
+    Маршрутизатор (METHOD, path) -> async handler(request) -> (status, payload).
+    Обработчик префикса регистрируется путем, заканчивающимся на '*'.
+    """
+
+    def __init__(self, host: str = "127.0.0.1", port: int = 0):
+        self.host = host
+        self.port = port
+        self._routes = {}
+        self._prefix_routes = []
+        self._server = None
+        # Число принятых TCP-соединений (проверка keep-alive у клиентов)
+        self.connections = 0
+
+    def route(self, method: str, path: str, handler):
+        if path.endswith("*"):
+            self._prefix_routes.append((method, path[:-1], handler))
+        else:
+            self._routes[(method, path)] = handler
+
+    @property
+    def base_url(self) -> str:
+        return f"http://{self.host}:{self.port}"
+
+    async def start(self):
+        self._server = await asyncio.start_server(self._serve, self.host, self.port)
+        self.port = self._server.sockets[0].getsockname()[1]
+        logger.info(f"Локальный сервер запущен на {self.base_url}")
+
+    async def stop(self):
+        if self._server is not None:
+            self._server.close()
+            await self._server.wait_closed()
+            self._server = None
+
+    def _resolve(self, method: str, path: str):
+        handler = self._routes.get((method, path))
+        if handler is None:
+            for route_method, prefix, prefix_handler in self._prefix_routes:
+                if route_method in (method, "*") and path.startswith(prefix):
+                    return prefix_handler
+        return handler
+
+    async def _serve(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        self.connections += 1
+        try:
+            while True:
+                request_line = await reader.readline()
+                if not request_line:
+                    break
+                method, target, _ = request_line.decode("latin-1").split(" ", 2)
+                headers = {}
+                while True:
+                    line = await reader.readline()
+                    if line in (b"\r\n", b"\n", b""):
+                        break
+                    name, _, value = line.decode("latin-1").partition(":")
+                    headers[name.strip().lower()] = value.strip()
+                length = int(headers.get("content-length") or 0)
+                body = await reader.readexactly(length) if length else b""
+
+                url = urlsplit(target)
+                request = Request(method, url.path, {k: v[0] for k, v in parse_qs(url.query).items()}, headers, body)
+                handler = self._resolve(method, url.path)
+                if handler is None:
+                    status, payload = 404, {"error": "not found"}
+                else:
+                    try:
+                        status, payload = await handler(request)
+                    except Exception as e:
+                        logger.exception(f"Ошибка обработчика {method} {url.path}: {e}")
+                        status, payload = 500, {"error": str(e)}
+
+                data = json.dumps(payload).encode()
+                keep_alive = headers.get("connection", "").lower() != "close"
+                writer.write(
+                    f"HTTP/1.1 {status} {REASONS.get(status, 'Unknown')}\r\n"
+                    f"Content-Type: application/json\r\nContent-Length: {len(data)}\r\n"
+                    f"Connection: {'keep-alive' if keep_alive else 'close'}\r\n\r\n".encode() + data
+                )
+                await writer.drain()
+                if not keep_alive:
+                    break
+        except (asyncio.IncompleteReadError, ConnectionError):
+            pass
+        finally:
+            writer.close()
@@ -0,0 +1,280 @@
+"""
+Нагрузочный тест вебхуков платежей (webhook_server).
+
+Создает БД с синтетическими товарами, пользователями и заказами в статусе
+pending, генерирует для заказов вебхуки:
+- LiqPay: form-данные data/signature с подписью SHA1, как проверяет liqpay_webhook;
+- Monobank: последовательность статусов created -> processing -> success/failure;
+с заданной долей неуспешных оплат и повторных доставок. Вебхуки отправляются
+в Flask-приложение (через test client) с заданной частотой из нескольких потоков,
+вместо Telegram используется заглушка Bot.
+
+В отчете: пропускная способность приема, задержки p50/p95/p99, коды ответов,
+время обработки журнала и сверка итоговых статусов заказов с ожидаемыми.
+
+Запуск: python -m loadtest.webhooks [--orders 2000] [--rate 500] [--concurrency 16]
+"""
+import argparse
+import asyncio
+import base64
+import hashlib
+import json
+import logging
+import os
+import random
+import sqlite3
+import tempfile
+import threading
+import time
+import zlib
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+from types import SimpleNamespace
+from urllib.parse import urlencode
+
+from benchmarks.datagen import populate_database
+
+LIQPAY_PUBLIC_KEY = "sandbox_public_key"
+# Первый синтетический user_id в datagen.user_rows
+FIRST_USER_ID = 100_000_000
+
+
+class StubBot:
+    """Заглушка telegram.Bot: запросы записываются, сеть не используется."""
+
+    def __init__(self, latency: float = 0.0):
+        self.latency = latency
+        self.calls = Counter()
+
+    async def initialize(self):
+        self.calls["initialize"] += 1
+
+    async def shutdown(self):
+        self.calls["shutdown"] += 1
+
+    async def send_message(self, chat_id, text, **kwargs):
+        self.calls["send_message"] += 1
+        if self.latency:
+            await asyncio.sleep(self.latency)
+        return SimpleNamespace(chat_id=chat_id, text=text)
+
+    async def get_chat(self, chat_id):
+        self.calls["get_chat"] += 1
+        if self.latency:
+            await asyncio.sleep(self.latency)
+        return SimpleNamespace(id=chat_id, username=None, first_name=f"User {chat_id}")
+
+
+# --- Генерация вебхуков ---
+
+def liqpay_request(private_key: str, order_id: str, status: str, amount: int) -> tuple[str, str, dict]:
+    """Вебхук LiqPay: (путь, тип содержимого, тело формы) с подписью base64(sha1(key + data + key))."""
+    payload = {
+        "version": 3, "public_key": LIQPAY_PUBLIC_KEY, "action": "pay", "order_id": order_id,
+        "status": status, "amount": amount / 100, "currency": "UAH", "payment_id": zlib.crc32(order_id.encode("utf-8")),
+    }
+    data = base64.b64encode(json.dumps(payload).encode("utf-8")).decode("utf-8")
+    signature = base64.b64encode(hashlib.sha1((private_key + data + private_key).encode("utf-8")).digest()).decode("utf-8")
+    return "/webhook/liqpay", "application/x-www-form-urlencoded", {"data": data, "signature": signature}
+
+
+def monobank_request(order_id: str, invoice_id: str, status: str, amount: int) -> tuple[str, str, dict]:
+    """Вебхук Monobank о смене статуса счета."""
+    payload = {"invoiceId": invoice_id, "status": status, "reference": order_id, "amount": amount, "ccy": 980,
+               "modifiedDate": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime())}
+    return "/webhook/monobank", "application/json", payload
+
+
+def generate_events(orders: list[tuple[str, int]], private_key: str, seed: int = 42, monobank_share: float = 0.5,
+                    failure_rate: float = 0.1, duplicate_rate: float = 0.05) -> tuple[list, dict]:
+    """
+    Вебхуки для заказов [(order_id, amount)] в порядке отправки и ожидаемые итоговые статусы.
+    События разных заказов перемешаны, события одного заказа идут в порядке статусов.
+    """
+    rng = random.Random(seed)
+    scheduled = []
+    expected = {}
+    for order_id, amount in orders:
+        final = "failure" if rng.random() < failure_rate else "success"
+        if rng.random() < monobank_share:
+            invoice_id = f"inv{rng.getrandbits(64):016x}"
+            sequence = [monobank_request(order_id, invoice_id, status, amount)
+                        for status in ("created", "processing", final)]
+        else:
+            sequence = [liqpay_request(private_key, order_id, final, amount)]
+        if rng.random() < duplicate_rate:
+            # Провайдер повторно доставляет финальный вебхук
+            sequence.append(sequence[-1])
+        expected[order_id] = "paid" if final == "success" else final
+        key = rng.random()
+        for request in sequence:
+            scheduled.append((key, request))
+            key += rng.expovariate(1000)
+    scheduled.sort(key=lambda item: item[0])
+    return [request for _, request in scheduled], expected
+
+
+def seed_database(path: str, orders: int, seed: int = 42) -> list[tuple[str, int]]:
+    """Создает БД с товарами, пользователями и orders заказами в статусе pending."""
+    products = max(100, orders // 10)
+    users = max(100, orders // 2)
+    populate_database(path, products=products, users=users, orders=0, seed=seed)
+    rng = random.Random(seed)
+    rows = [(f"load-{i:07d}", FIRST_USER_ID + rng.randrange(users), rng.randint(1, products),
+             rng.randint(5_000, 140_000) * 100) for i in range(orders)]
+    with sqlite3.connect(path) as conn:
+        conn.executemany(
+            "INSERT INTO orders (id, user_id, product_id, amount, status, created_at) VALUES (?, ?, ?, ?, 'pending', datetime('now'))",
+            rows)
+    return [(order_id, amount) for order_id, _, _, amount in rows]
+
+
+# --- Прогон ---
+
+def percentile(sorted_values: list, fraction: float) -> float:
+    if not sorted_values:
+        return 0.0
+    return sorted_values[min(len(sorted_values) - 1, max(0, int(len(sorted_values) * fraction) - 1))]
+
+
+def run(orders: int = 2000, rate: float = 500, concurrency: int = 16, workers: int = 4, queue_size: int = 1000,
+        monobank_share: float = 0.5, failure_rate: float = 0.1, duplicate_rate: float = 0.05,
+        retry_busy: bool = True, retry_delay: float = 0.1, bot_latency: float = 0.0,
+        drain_timeout: float = 120, seed: int = 42, db_path: str | None = None) -> dict:
+    tmp_dir = None
+    if db_path is None:
+        tmp_dir = tempfile.TemporaryDirectory()
+        db_path = os.path.join(tmp_dir.name, "loadtest.db")
+    order_amounts = seed_database(db_path, orders, seed)
+
+    import db
+    import webhook_server
+    from outbox import PaymentOutbox
+    db.pool.close()
+    db.pool.db_path = db_path
+    stub_bot = StubBot(bot_latency)
+    webhook_server.bot = stub_bot
+    engine = webhook_server.PaymentEngine(PaymentOutbox(db.pool, db_path=db_path), webhook_server.handle_payment_event,
+                                          workers=workers, queue_size=queue_size)
+    webhook_server.engine = engine
+    engine.start()
+
+    events, expected = generate_events(order_amounts, webhook_server.LIQPAY_PRIVATE_KEY, seed,
+                                       monobank_share, failure_rate, duplicate_rate)
+    local = threading.local()
+    latencies = []
+    codes = Counter()
+    retries = Counter()
+    lock = threading.Lock()
+
+    def send(request, attempt: int = 0):
+        client = getattr(local, "client", None)
+        if client is None:
+            client = local.client = webhook_server.app.test_client()
+        path, content_type, body = request
+        started = time.perf_counter()
+        if content_type == "application/json":
+            response = client.post(path, json=body)
+        else:
+            response = client.post(path, data=urlencode(body), content_type=content_type)
+        elapsed = time.perf_counter() - started
+        with lock:
+            latencies.append(elapsed)
+            codes[response.status_code] += 1
+        if response.status_code == 503 and retry_busy:
+            # Провайдеры повторяют вебхук после Retry-After; здесь задержка сокращена
+            with lock:
+                retries[path] += 1
+            time.sleep(retry_delay * (attempt + 1))
+            send(request, attempt + 1)
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency, thread_name_prefix="loadtest") as executor:
+        futures = []
+        for index, request in enumerate(events):
+            if rate:
+                delay = started + index / rate - time.perf_counter()
+                if delay > 0:
+                    time.sleep(delay)
+            futures.append(executor.submit(send, request))
+        for future in futures:
+            future.result()
+    send_seconds = time.perf_counter() - started
+
+    drain_started = time.perf_counter()
+    while engine.pending and time.perf_counter() - drain_started < drain_timeout:
+        time.sleep(0.01)
+    processed_seconds = time.perf_counter() - started
+    backlog_left = engine.pending
+    engine.shutdown()
+
+    with sqlite3.connect(db_path) as conn:
+        actual = dict(conn.execute("SELECT id, status FROM orders WHERE id LIKE 'load-%'"))
+        outbox_states = dict(conn.execute("SELECT state, COUNT(*) FROM payment_events GROUP BY state"))
+    mismatched = sorted(order_id for order_id, status in expected.items() if actual.get(order_id) != status)
+    db.pool.close()
+    if tmp_dir is not None:
+        tmp_dir.cleanup()
+
+    latencies.sort()
+    requests_total = sum(codes.values())
+    errors = requests_total - codes.get(200, 0)
+    return {
+        "orders": orders,
+        "webhooks": len(events),
+        "requests": requests_total,
+        "send_seconds": round(send_seconds, 2),
+        "accepted_per_sec": round(codes.get(200, 0) / send_seconds, 1),
+        "p50_ms": round(percentile(latencies, 0.50) * 1000, 2),
+        "p95_ms": round(percentile(latencies, 0.95) * 1000, 2),
+        "p99_ms": round(percentile(latencies, 0.99) * 1000, 2),
+        "status_codes": dict(sorted(codes.items())),
+        "error_rate": round(errors / requests_total, 4) if requests_total else 0.0,
+        "busy_retries": sum(retries.values()),
+        "processed_seconds": round(processed_seconds, 2),
+        "processed_per_sec": round(len(events) / processed_seconds, 1),
+        "backlog_left": backlog_left,
+        "outbox_states": outbox_states,
+        "bot_calls": dict(stub_bot.calls),
+        "consistent": not mismatched,
+        "mismatched_orders": len(mismatched),
+        "mismatched_sample": mismatched[:10],
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--orders", type=int, default=2000)
+    parser.add_argument("--rate", type=float, default=500, help="Вебхуков в секунду (0 - без ограничения)")
+    parser.add_argument("--concurrency", type=int, default=16, help="Одновременных запросов")
+    parser.add_argument("--workers", type=int, default=4, help="Воркеров движка платежей")
+    parser.add_argument("--queue-size", type=int, default=1000, help="Лимит журнала платежей до ответов 503")
+    parser.add_argument("--monobank-share", type=float, default=0.5)
+    parser.add_argument("--failure-rate", type=float, default=0.1)
+    parser.add_argument("--duplicate-rate", type=float, default=0.05)
+    parser.add_argument("--no-retry-busy", action="store_true", help="Не повторять вебхуки после ответа 503")
+    parser.add_argument("--retry-delay", type=float, default=0.1)
+    parser.add_argument("--bot-latency", type=float, default=0.0, help="Задержка заглушки Bot на запрос, с")
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--db", help="Путь к создаваемой БД (по умолчанию временная)")
+    parser.add_argument("--json", help="Сохранить отчет в JSON")
+    parser.add_argument("--verbose", action="store_true", help="Не скрывать INFO- и WARNING-логи сервера")
+    args = parser.parse_args()
+    if args.db and os.path.exists(args.db):
+        parser.error(f"{args.db} уже существует: нагрузочный тест создает БД заново")
+
+    import webhook_server  # noqa: F401 - настраивает логирование при импорте
+    if not args.verbose:
+        logging.getLogger().setLevel(logging.ERROR)
+    report = run(args.orders, args.rate, args.concurrency, args.workers, args.queue_size, args.monobank_share,
+                 args.failure_rate, args.duplicate_rate, not args.no_retry_busy, args.retry_delay,
+                 args.bot_latency, seed=args.seed, db_path=args.db)
+    for key, value in report.items():
+        print(f"{key}: {value}")
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,14 +1,20 @@
+import asyncio
 import logging
+import os
 import re
 import sqlite3
 import datetime
 import uuid
+import functools
+import html
 from telegram import (
     Update,
     InlineKeyboardButton,
     InlineKeyboardMarkup,
     ReplyKeyboardMarkup,
     KeyboardButton,
+    InputMediaPhoto,
+    InputMediaVideo,
 )
 from telegram.ext import (
     Application,
@@ -18,14 +24,23 @@ from telegram.ext import (
     ContextTypes,
     CallbackQueryHandler,
     ConversationHandler,
+    TypeHandler,
 )
 from telegram.error import TelegramError
 
 # --- ИМПОРТ ИЗ ДРУГИХ ФАЙЛОВ ПРОЕКТА ---
 from config import BOT_TOKEN, ADMIN_IDS, SOURCE_CHANNEL_ID
-from payment_gateways import generate_mono_card_invoice, generate_mono_parts_invoice
-from currency_converter import get_usd_to_uah_rate
-from db import init_db, db_query # Используем функции из db.py
+from payment_gateways import generate_mono_card_invoice, generate_mono_parts_invoice, mono_client
+from currency_converter import get_usd_to_uah_rate, rate_service
+from db import init_db, pool # Используем функции из db.py
+from catalog import CatalogCache, CurrencyRepricer, PriceIndex, Product, VersionedCache
+from search_index import SearchIndex
+from notifications import AdminNotifier
+import stats
+import ingest
+import backfill
+import metrics
+from users import LanguageStore, RegistrationBuffer, UserProfileCache
 
 # --- ЛОГИРОВАНИЕ ---
 logging.basicConfig(
@@ -34,6 +49,9 @@ logging.basicConfig(
 logger = logging.getLogger(__name__)
 
 
+# polling - getUpdates; webhook - общий HTTP-сервер для апдейтов и платежей (см. bot_server)
+BOT_MODE = os.getenv("BOT_MODE", "polling")
+
 # --- ГЛОБАЛЬНЫЕ ПЕРЕМЕННЫЕ И СОСТОЯНИЯ ДИАЛОГА ---
 (
     MAIN_MENU, LANGUAGE_SELECTION, MODEL_SEARCH,
@@ -47,9 +65,35 @@ logger = logging.getLogger(__name__)
     GET_PHONE, GET_NAME, GET_CITY, GET_NOVAPOSHTA
 ) = range(26)
 
-products_cache = {}
-product_details_cache = {}
-user_languages = {}
+# Единый версионируемый кэш категорий и товаров
+catalog_cache = CatalogCache()
+# Поисковый индекс по названиям, обновляется вместе с кэшем каталога
+search_index = SearchIndex()
+search_index.attach(catalog_cache)
+# Отсортированный индекс цен для фильтров, обновляется вместе с кэшем каталога
+price_index = PriceIndex()
+price_index.attach(catalog_cache)
+# Цены товаров в USD пересчитываются в кэше при каждом изменении курса и пачками пишутся в БД
+currency_repricer = CurrencyRepricer(pool=pool)
+currency_repricer.attach(catalog_cache)
+rate_service.subscribe(currency_repricer.apply)
+# Скомпилированный поиск категорий в постах канала, перестраивается при изменении категорий
+category_matcher = ingest.CategoryMatcher()
+category_matcher.attach(catalog_cache)
+# Отрисованные страницы списков товаров, сбрасываются при изменении каталога
+page_markups = VersionedCache(catalog_cache)
+# Отрисованные карточки товаров (подпись и клавиатура) по (товар, язык)
+card_renders = VersionedCache(catalog_cache, capacity=4096)
+# Параллельная рассылка администраторам с лимитами Telegram и сводками при всплесках
+admin_notifier = AdminNotifier(ADMIN_IDS)
+# Профили пользователей для уведомлений (вместо bot.get_chat на каждый заказ)
+user_profiles = UserProfileCache(pool)
+# Язык интерфейса: users.language с ограниченным LRU в памяти
+language_store = LanguageStore(pool)
+# Регистрация новых пользователей пакетами; повторный /start не обращается к БД
+registrations = RegistrationBuffer(pool, language_store)
+# Endpoint /metrics в фоновом потоке (порт METRICS_PORT, 0 - выключен)
+metrics_server = metrics.MetricsServer()
 
 # --- МУЛЬТИЯЗЫЧНОСТЬ (с новыми строками) ---
 translations = {
@@ -67,6 +111,9 @@ translations = {
         "model_not_found": "К сожалению, такая модель не найдена.",
         "model_found": "Найдены следующие модели:",
         "buy": "Купить 🛒",
+        "page_prev": "⬅️ Назад",
+        "page_next": "Далее ➡️",
+        "card_back": "🔙 К списку",
         "price": "Цена",
         "no_access": "У вас нет доступа к этой команде.",
         "no_products_in_category": "В этой категории пока нет товаров.",
@@ -121,6 +168,8 @@ translations = {
         "stats_today": "За сегодня:",
         "stats_week": "За неделю:",
         "stats_month": "За месяц:",
+        "stats_orders": "Заказов за месяц (оплачено):",
+        "stats_revenue": "Выручка за месяц:",
         "cat_manage": "Управление категориями:",
         "cat_add": "Добавить категорию",
         "cat_del": "Удалить категорию",
@@ -149,7 +198,21 @@ translations = {
         "post_success": "✅ Пост успешно опубликован в канале!",
         "post_fail": "❌ Не удалось опубликовать пост.",
         "post_fail_chat_not_found": "\n\n<b>Причина:</b> Чат не найден.\n<b>Решение:</b>\n1. Убедитесь, что `SOURCE_CHANNEL_ID` в `config.py` указан верно (должен начинаться с `-100...`).\n2. Убедитесь, что бот добавлен в канал как администратор с правом публикации постов.",
-        "sync_command_info": """⚙️ <b>Импорт существующих товаров из канала</b> (инфо для админа)""",
+        "sync_command_info": """⚙️ <b>Импорт существующих товаров из канала</b> (инфо для админа)
+
+1. В Telegram Desktop экспортируйте историю канала в формате JSON.
+2. Положите result.json на сервер бота.
+3. Выполните <code>/sync путь/к/result.json</code> или <code>python -m backfill путь/к/result.json</code>.
+
+Добавляются только новые товары: товары с уже существующими названиями не изменяются.
+Экспорт другого канала импортируется только с флагом: <code>/sync --force путь/к/result.json</code>.""",
+        "sync_started": "⏳ Импорт истории канала запущен...",
+        "sync_done": "✅ Импорт завершен: сообщений {messages}, товаров {products} за {seconds:.1f} с.",
+        "sync_fail": "❌ Не удалось импортировать историю канала: {error}",
+        "dbprofile_title": "🐢 <b>Запросы к БД</b>, топ {top} по общему времени (порог медленного запроса {threshold:.0f} мс):",
+        "dbprofile_on": "✅ Профилирование запросов включено. Отчет: /dbprofile [N], сброс: /dbprofile reset.",
+        "dbprofile_off": "⏸ Профилирование запросов выключено, накопленная статистика сохранена.",
+        "dbprofile_reset": "🧹 Статистика запросов сброшена.",
     },
     "ua": {
         "welcome": "Вітаю! Я бот для продажу техніки Apple. Чим можу допомогти?",
@@ -165,6 +228,9 @@ translations = {
         "model_not_found": "На жаль, таку модель не знайдено.",
         "model_found": "Знайдено наступні моделі:",
         "buy": "Купити 🛒",
+        "page_prev": "⬅️ Назад",
+        "page_next": "Далі ➡️",
+        "card_back": "🔙 До списку",
         "price": "Ціна",
         "no_access": "У вас немає доступу до цієї команди.",
         "no_products_in_category": "У цій категорії поки що немає товарів.",
@@ -219,6 +285,8 @@ translations = {
         "stats_today": "За сегодня:",
         "stats_week": "За неделю:",
         "stats_month": "За месяц:",
+        "stats_orders": "Замовлень за місяць (сплачено):",
+        "stats_revenue": "Виручка за місяць:",
         "cat_manage": "Управление категориями:",
         "cat_add": "Добавить категорию",
         "cat_del": "Удалить категорию",
@@ -247,98 +315,98 @@ translations = {
         "post_success": "✅ Пост успешно опубликован в канале!",
         "post_fail": "❌ Не удалось опубликовать пост.",
         "post_fail_chat_not_found": "\n\n<b>Причина:</b> Чат не найден.\n<b>Решение:</b>\n1. Убедитесь, что `SOURCE_CHANNEL_ID` в `config.py` указан верно (должен начинаться с `-100...`).\n2. Убедитесь, что бот добавлен в канал как администратор с правом публикации постов.",
-        "sync_command_info": """⚙️ <b>Імпорт існуючих товарів з каналу</b> (інфо для адміна)""",
+        "sync_command_info": """⚙️ <b>Імпорт існуючих товарів з каналу</b> (інфо для адміна)
+
+1. У Telegram Desktop експортуйте історію каналу у форматі JSON.
+2. Покладіть result.json на сервер бота.
+3. Виконайте <code>/sync шлях/до/result.json</code> або <code>python -m backfill шлях/до/result.json</code>.
+
+Додаються лише нові товари: товари з уже наявними назвами не змінюються.
+Експорт іншого каналу імпортується лише з прапорцем: <code>/sync --force шлях/до/result.json</code>.""",
+        "sync_started": "⏳ Імпорт історії каналу запущено...",
+        "sync_done": "✅ Імпорт завершено: повідомлень {messages}, товарів {products} за {seconds:.1f} с.",
+        "sync_fail": "❌ Не вдалося імпортувати історію каналу: {error}",
+        "dbprofile_title": "🐢 <b>Запити до БД</b>, топ {top} за загальним часом (поріг повільного запиту {threshold:.0f} мс):",
+        "dbprofile_on": "✅ Профілювання запитів увімкнено. Звіт: /dbprofile [N], скидання: /dbprofile reset.",
+        "dbprofile_off": "⏸ Профілювання запитів вимкнено, накопичену статистику збережено.",
+        "dbprofile_reset": "🧹 Статистику запитів скинуто.",
     }
 }
 
-def get_text(key, user_id):
-    lang = user_languages.get(user_id, "ua")
+def text_for(key, lang):
     return translations.get(lang, translations["ua"]).get(key) or translations["ru"].get(key, f"_{key}_")
 
+def get_text(key, user_id):
+    return text_for(key, language_store.get(user_id))
+
 def l10n_regex(key, lang_codes=['ru', 'ua']):
     parts = [translations[lang].get(key, "") for lang in lang_codes]
     cleaned_parts = [re.sub(r'\(.*\)', '', part).strip() for part in parts]
     return f"^({ '|'.join(filter(None, cleaned_parts)) })$"
 
 # --- ХЕЛПЕРЫ ДЛЯ РАБОТЫ С БД ---
-def load_data_from_db():
-    global products_cache, product_details_cache
-    products_cache.clear()
-    product_details_cache.clear()
-    all_products = db_query("SELECT id, name, description, price, price_numeric, photo_id, video_id, category_name FROM products", fetchall=True)
-    for p in all_products:
-        prod_id, name, desc, price, price_num, photo, video, cat = p
-        products_cache.setdefault(cat, []).append((prod_id, name))
-        product_details_cache[prod_id] = {
-            "name": name, "description": desc, "price": price,
-            "price_numeric": price_num, "photo": photo, "video": video
-        }
-    logger.info(f"Данные из БД загружены в кэш. Товаров: {len(product_details_cache)}, Категорий: {len(products_cache)}")
+async def load_data_from_db():
+    """Полная загрузка каталога в кэш. Вызывается только при старте и после массового импорта."""
+    await catalog_cache.load(pool)
+
+async def insert_product(name, description, price, price_numeric, year, photo, video, category,
+                         price_amount=None, price_currency=None) -> Product | None:
+    """Добавляет товар в БД и применяет дельту к кэшу. Возвращает None, если имя уже занято."""
+    result = await pool.execute(
+        "INSERT OR IGNORE INTO products (name, description, price, price_numeric, year, photo_id, video_id, category_name, price_amount, price_currency) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+        (name, description, price, price_numeric, year, photo, video, category, price_amount, price_currency)
+    )
+    if result.rowcount == 0:
+        return None
+    product = Product(result.lastrowid, name, description, price, price_numeric, year, photo, video, category,
+                      price_amount, price_currency)
+    catalog_cache.upsert(product)
+    return product
 
 
 # --- ЛОГИКА ПАРСИНГА ЦЕНЫ ---
 def process_price_string(text_with_price: str) -> tuple[str, int | None, str]:
-    price_pattern = re.compile(
-        r'Цена\s*[:\-]*\s*([\d\s.,]+)\s*?(\$|usd|eur|€|грн|uah|руб|rub)|'
-        r'([\d\s.,]+)\s*?(\$|usd|eur|€|грн|uah|руб|rub)',
-        re.IGNORECASE | re.UNICODE
-    )
-    price_display = "По запросу"
-    price_numeric = None
-    cleaned_text = text_with_price
-    match = price_pattern.search(text_with_price)
-    if match:
-        if match.group(1):
-            price_str = match.group(1)
-            currency = match.group(2).lower() if match.group(2) else ''
-        else:
-            price_str = match.group(3)
-            currency = match.group(4).lower() if match.group(4) else ''
-
-        price_value = float(re.sub(r'[^\d.]', '', price_str.replace(',', '.')))
-        
-        currency_symbol = currency.replace('usd','$').replace('eur', '€').replace('грн', 'UAH').replace('uah', 'UAH').upper()
-        price_display = f"{int(price_value) if price_value.is_integer() else price_value} {currency_symbol}"
-
-        if currency in ['$', 'usd']:
-            usd_rate = get_usd_to_uah_rate()
-            if usd_rate:
-                price_numeric = int(price_value * usd_rate * 100)
-                logger.info(f"Конвертация: {price_value}$ * {usd_rate} = {price_numeric / 100} UAH")
-            else:
-                logger.warning("Не удалось получить курс USD, цена не будет установлена.")
-        elif currency in ['грн', 'uah']:
-            price_numeric = int(price_value * 100)
-        
-        lines = text_with_price.splitlines()
-        cleaned_lines = [line for line in lines if not price_pattern.search(line)]
-        cleaned_text = "\n".join(cleaned_lines).strip()
-
-    return price_display, price_numeric, cleaned_text
+    return ingest.process_price_string(text_with_price, get_usd_to_uah_rate())
 
 # --- ОСНОВНЫЕ ФУНКЦИИ БОТА ---
-def get_main_keyboard(user_id):
+# Клавиатуры, зависящие только от языка, строятся один раз: объекты PTB неизменяемы
+@functools.lru_cache(maxsize=16)
+def build_main_keyboard(lang):
     keyboard = [
-        [KeyboardButton(get_text("catalog", user_id)), KeyboardButton(get_text("find_model", user_id))],
-        [KeyboardButton(get_text("filters", user_id)), KeyboardButton(get_text("support", user_id))],
-        [KeyboardButton(get_text("change_language", user_id))],
+        [KeyboardButton(text_for("catalog", lang)), KeyboardButton(text_for("find_model", lang))],
+        [KeyboardButton(text_for("filters", lang)), KeyboardButton(text_for("support", lang))],
+        [KeyboardButton(text_for("change_language", lang))],
     ]
     return ReplyKeyboardMarkup(keyboard, resize_keyboard=True)
 
+def get_main_keyboard(user_id):
+    return build_main_keyboard(language_store.get(user_id))
+
+async def track_user(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    """
+    Обновляет кэш профилей и подгружает язык пользователя по каждому входящему
+    апдейту (группа -1, до остальных обработчиков), чтобы get_text не ходил в БД.
+    """
+    if update.effective_user:
+        try:
+            await language_store.load(update.effective_user.id)
+            await user_profiles.observe(update.effective_user)
+        except Exception as e:
+            logger.error(f"Не удалось обновить профиль пользователя {update.effective_user.id}: {e}")
+
 async def start(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
     user = update.effective_user
-    user_languages.setdefault(user.id, "ua")
-    db_query("INSERT OR IGNORE INTO users (user_id, username, first_name, join_date) VALUES (?, ?, ?, ?)",
-             (user.id, user.username, user.first_name, datetime.datetime.now().isoformat()), commit=True)
+    registrations.register(user)
     await update.message.reply_text(get_text("welcome", user.id), reply_markup=get_main_keyboard(user.id))
     return MAIN_MENU
 
 # --- ОБРАБОТЧИКИ ГЛАВНОГО МЕНЮ ---
 async def catalog(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
     user_id = update.effective_user.id
-    categories = db_query("SELECT name FROM categories", fetchall=True)
-    keyboard = [[InlineKeyboardButton(cat['name'], callback_data=f"cat_{cat['name']}")] for cat in categories]
-    await update.message.reply_text(get_text("choose_category", user_id), reply_markup=InlineKeyboardMarkup(keyboard))
+    markup = page_markups.get("categories", lambda: InlineKeyboardMarkup(
+        [[InlineKeyboardButton(cat, callback_data=f"cat_{cat}")] for cat in catalog_cache.categories]
+    ))
+    await update.message.reply_text(get_text("choose_category", user_id), reply_markup=markup)
     return MAIN_MENU
 
 async def change_language_prompt(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
@@ -378,7 +446,7 @@ async def set_language(update: Update, context: ContextTypes.DEFAULT_TYPE) -> in
     await query.answer()
     user_id = query.from_user.id
     lang_code = query.data.split("_")[1]
-    user_languages[user_id] = lang_code
+    language_store.set(user_id, lang_code)
     
     lang_changed_text = "Язык изменен на русский." if lang_code == "ru" else "Мову змінено на українську."
     
@@ -399,55 +467,42 @@ async def catalog_button_handler(update: Update, context: ContextTypes.DEFAULT_T
 
     if data.startswith("cat_"):
         category = data.split("_", 1)[1]
-        products_in_cat = products_cache.get(category, [])
-        if products_in_cat:
-            keyboard = [[InlineKeyboardButton(name, callback_data=f"prod_{prod_id}")] for prod_id, name in products_in_cat]
-            await query.edit_message_text(text=f"{get_text('choose_category', user_id)}: {category}", reply_markup=InlineKeyboardMarkup(keyboard))
+        markup = category_page_markup(category, user_id)
+        text = f"{get_text('choose_category', user_id)}: {category}" if markup else get_text("no_products_in_category", user_id)
+        if query.message.photo or query.message.video:
+            # Возврат из карточки: медиа остается, меняются подпись и клавиатура (один вызов API)
+            await query.edit_message_caption(caption=text, reply_markup=markup)
         else:
-            await query.edit_message_text(text=get_text("no_products_in_category", user_id))
+            await query.edit_message_text(text=text, reply_markup=markup)
+
+    elif data.startswith(("catn_", "catp_")):
+        # Листание страниц категории: catn_<id>_<категория> - после товара, catp_ - перед ним
+        direction, anchor, category = data.split("_", 2)
+        anchor = int(anchor)
+        markup = category_page_markup(category, user_id, after_id=anchor if direction == "catn" else None,
+                                      before_id=anchor if direction == "catp" else None)
+        if markup:
+            await query.edit_message_reply_markup(reply_markup=markup)
 
     elif data.startswith("prod_"):
         product_id = int(data.replace("prod_", "", 1))
-        details = product_details_cache.get(product_id)
-        if details:
-            caption_parts = [
-                f"<b>{details['name']}</b>",
-                details['description'],
-                f"<b>{get_text('price', user_id)}: {details['price']}</b>"
-            ]
-            caption = "\n\n".join(filter(None, caption_parts))
-            keyboard = [[InlineKeyboardButton(get_text("buy", user_id), callback_data=f"buy_{product_id}")]]
-            
-            try:
-                await query.delete_message()
-            except TelegramError as e:
-                logger.warning(f"Не удалось удалить сообщение при показе товара: {e}")
-
-            try:
-                if details.get("photo"):
-                    await context.bot.send_photo(chat_id=user_id, photo=details["photo"], caption=caption, reply_markup=InlineKeyboardMarkup(keyboard), parse_mode="HTML")
-                elif details.get("video"):
-                    await context.bot.send_video(chat_id=user_id, video=details["video"], caption=caption, reply_markup=InlineKeyboardMarkup(keyboard), parse_mode="HTML")
-                else:
-                    await context.bot.send_message(chat_id=user_id, text=caption, reply_markup=InlineKeyboardMarkup(keyboard), parse_mode="HTML")
-            except TelegramError as e:
-                logger.error(f"Ошибка отправки карточки товара ID {product_id}: {e}")
-                await context.bot.send_message(chat_id=user_id, text=caption, reply_markup=InlineKeyboardMarkup(keyboard), parse_mode="HTML")
+        card = render_product_card(product_id, user_id)
+        if card:
+            await show_product_card(query, context, user_id, *card)
 
     elif data.startswith("buy_"):
         product_id = int(data.replace("buy_", "", 1))
-        details = product_details_cache.get(product_id)
+        details = catalog_cache.get(product_id)
         
-        if not details or not details.get("price_numeric"):
+        if not details or not details.price_numeric:
             await context.bot.send_message(user_id, get_text("price_not_set", user_id))
             return
 
         order_id = str(uuid.uuid4())
-        amount = details["price_numeric"]
-        db_query(
+        amount = details.price_numeric
+        await pool.execute(
             "INSERT INTO orders (id, user_id, product_id, amount, created_at) VALUES (?, ?, ?, ?, ?)",
-            (order_id, user_id, product_id, amount, datetime.datetime.now().isoformat()),
-            commit=True
+            (order_id, user_id, product_id, amount, datetime.datetime.now().isoformat())
         )
 
         keyboard = get_payment_keyboard(user_id, order_id)
@@ -455,16 +510,124 @@ async def catalog_button_handler(update: Update, context: ContextTypes.DEFAULT_T
             await query.edit_message_reply_markup(reply_markup=None) 
         await context.bot.send_message(chat_id=user_id, text=get_text("choose_payment_method", user_id), reply_markup=keyboard)
 
+def paged_markup(category: str | None, user_id, item_prefix: str, nav_prefix: str, after_id=None, before_id=None):
+    """
+    Inline-клавиатура одной страницы списка товаров с кнопками навигации.
+    Страницы кэшируются по (список, якорь, язык) до изменения версии каталога.
+    Возвращает None, если на странице нет товаров.
+    """
+    lang = language_store.get(user_id)
+
+    def build():
+        page = catalog_cache.page(category, after_id=after_id, before_id=before_id)
+        if not page.items:
+            return None
+        keyboard = [[InlineKeyboardButton(p.name, callback_data=f"{item_prefix}{p.id}")] for p in page.items]
+        suffix = f"_{category}" if category is not None else ""
+        nav = []
+        if page.prev_anchor is not None:
+            nav.append(InlineKeyboardButton(get_text("page_prev", user_id), callback_data=f"{nav_prefix}p_{page.prev_anchor}{suffix}"))
+        if page.next_anchor is not None:
+            nav.append(InlineKeyboardButton(get_text("page_next", user_id), callback_data=f"{nav_prefix}n_{page.next_anchor}{suffix}"))
+        if nav:
+            keyboard.append(nav)
+        return InlineKeyboardMarkup(keyboard)
+
+    return page_markups.get((category, item_prefix, after_id, before_id, lang), build)
+
+def category_page_markup(category: str, user_id, after_id=None, before_id=None):
+    return paged_markup(category, user_id, "prod_", "cat", after_id, before_id)
+
+def admin_products_page_markup(user_id, after_id=None, before_id=None):
+    return paged_markup(None, user_id, "delprod_", "delpg", after_id, before_id)
+
+PAYMENT_METHODS = (
+    ("payment_mono_card", "monocard"),
+    ("payment_mono_parts", "monoparts"),
+    ("payment_cod", "cod"),
+    ("payment_cash", "cash"),
+    ("payment_cashless", "cashless"),
+)
+
+@functools.lru_cache(maxsize=16)
+def payment_labels(lang) -> tuple:
+    return tuple((text_for(key, lang), method) for key, method in PAYMENT_METHODS)
+
+async def show_product_card(query, context, user_id, details: Product, caption: str, markup: InlineKeyboardMarkup):
+    """
+    Показывает карточку товара, по возможности редактируя текущее сообщение (один вызов API):
+    медиа -> медиа через edit_message_media, текст -> текст через edit_message_text.
+    Текстовое сообщение нельзя превратить в медиа (и наоборот), поэтому в этих случаях
+    сообщение удаляется и карточка отправляется заново.
+    """
+    message = query.message
+    has_media = bool(message.photo or message.video)
+    try:
+        if has_media and (details.photo or details.video):
+            media_cls = InputMediaPhoto if details.photo else InputMediaVideo
+            media = media_cls(details.photo or details.video, caption=caption, parse_mode="HTML")
+            await query.edit_message_media(media=media, reply_markup=markup)
+            return
+        if not has_media and not (details.photo or details.video) and message.text:
+            await query.edit_message_text(text=caption, reply_markup=markup, parse_mode="HTML")
+            return
+    except TelegramError as e:
+        if "not modified" in str(e).lower():
+            return
+        logger.warning(f"Не удалось обновить карточку товара ID {details.id} на месте: {e}")
+
+    try:
+        await query.delete_message()
+    except TelegramError as e:
+        logger.warning(f"Не удалось удалить сообщение при показе товара: {e}")
+
+    try:
+        if details.photo:
+            await context.bot.send_photo(chat_id=user_id, photo=details.photo, caption=caption, reply_markup=markup, parse_mode="HTML")
+        elif details.video:
+            await context.bot.send_video(chat_id=user_id, video=details.video, caption=caption, reply_markup=markup, parse_mode="HTML")
+        else:
+            await context.bot.send_message(chat_id=user_id, text=caption, reply_markup=markup, parse_mode="HTML")
+    except TelegramError as e:
+        logger.error(f"Ошибка отправки карточки товара ID {details.id}: {e}")
+        await context.bot.send_message(chat_id=user_id, text=caption, reply_markup=markup, parse_mode="HTML")
+
 def get_payment_keyboard(user_id: int, order_id: str) -> InlineKeyboardMarkup:
-    keyboard = [
-        [InlineKeyboardButton(get_text("payment_mono_card", user_id), callback_data=f"pay_monocard_{order_id}")],
-        [InlineKeyboardButton(get_text("payment_mono_parts", user_id), callback_data=f"pay_monoparts_{order_id}")],
-        [InlineKeyboardButton(get_text("payment_cod", user_id), callback_data=f"pay_cod_{order_id}")],
-        [InlineKeyboardButton(get_text("payment_cash", user_id), callback_data=f"pay_cash_{order_id}")],
-        [InlineKeyboardButton(get_text("payment_cashless", user_id), callback_data=f"pay_cashless_{order_id}")],
-    ]
+    # Клавиатура уникальна для заказа, кэшируются только подписи кнопок
+    keyboard = [[InlineKeyboardButton(label, callback_data=f"pay_{method}_{order_id}")]
+                for label, method in payment_labels(language_store.get(user_id))]
     return InlineKeyboardMarkup(keyboard)
 
+def build_product_card(details: Product, lang) -> tuple[str, InlineKeyboardMarkup]:
+    caption_parts = [
+        f"<b>{details.name}</b>",
+        details.description,
+        f"<b>{text_for('price', lang)}: {details.price}</b>"
+    ]
+    caption = "\n\n".join(filter(None, caption_parts))
+    keyboard = [[InlineKeyboardButton(text_for("buy", lang), callback_data=f"buy_{details.id}")]]
+    # Навигация по товарам категории: карточка меняется на месте (см. show_product_card)
+    prev_id, next_id = catalog_cache.neighbors(details.id)
+    nav = []
+    if prev_id is not None:
+        nav.append(InlineKeyboardButton(text_for("page_prev", lang), callback_data=f"prod_{prev_id}"))
+    nav.append(InlineKeyboardButton(text_for("card_back", lang), callback_data=f"cat_{details.category}"))
+    if next_id is not None:
+        nav.append(InlineKeyboardButton(text_for("page_next", lang), callback_data=f"prod_{next_id}"))
+    keyboard.append(nav)
+    return caption, InlineKeyboardMarkup(keyboard)
+
+def render_product_card(product_id: int, user_id) -> tuple[Product, str, InlineKeyboardMarkup] | None:
+    """Товар, подпись и клавиатура карточки; кэшируются до изменения версии каталога."""
+    def build():
+        details = catalog_cache.get(product_id)
+        if details is None:
+            return None
+        return (details, *build_product_card(details, lang))
+
+    lang = language_store.get(user_id)
+    return card_renders.get((product_id, lang), build)
+
 # === НОВЫЙ БЛОК: СБОР ДАННЫХ И ОФОРМЛЕНИЕ ЗАКАЗА ===
 
 async def start_checkout_flow(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
@@ -482,7 +645,7 @@ async def start_checkout_flow(update: Update, context: ContextTypes.DEFAULT_TYPE
         'payment_system': payment_system
     }
 
-    db_query("UPDATE orders SET payment_method = ? WHERE id = ?", (payment_system, order_id), commit=True)
+    await pool.execute("UPDATE orders SET payment_method = ? WHERE id = ?", (payment_system, order_id))
     
     await query.edit_message_reply_markup(reply_markup=None)
     
@@ -531,21 +694,21 @@ async def get_novaposhta_and_finalize(update: Update, context: ContextTypes.DEFA
         await update.message.reply_text("Произошла ошибка, попробуйте начать сначала.", reply_markup=get_main_keyboard(user_id))
         return MAIN_MENU
         
-    db_query(
+    await pool.execute(
         """UPDATE orders 
            SET customer_phone = ?, customer_name = ?, customer_city = ?, customer_address = ?
            WHERE id = ?""",
-        (customer_info['phone'], customer_info['name'], customer_info['city'], customer_info['address'], order_id),
-        commit=True
+        (customer_info['phone'], customer_info['name'], customer_info['city'], customer_info['address'], order_id)
     )
 
-    order_data = db_query("SELECT product_id, amount FROM orders WHERE id = ?", (order_id,), fetchone=True)
+    order_data = await pool.fetchone("SELECT product_id, amount FROM orders WHERE id = ?", (order_id,))
     if not order_data:
         await update.message.reply_text("❌ Ошибка: заказ не найден.", reply_markup=get_main_keyboard(user_id))
         return MAIN_MENU
         
     product_id, amount = order_data['product_id'], order_data['amount']
-    product_name = product_details_cache.get(product_id, {}).get("name", f"ID: {product_id}")
+    product = catalog_cache.get(product_id)
+    product_name = product.name if product else f"ID: {product_id}"
 
     await notify_admin_of_new_order(context, order_id, payment_system, product_name, customer_info)
 
@@ -553,13 +716,13 @@ async def get_novaposhta_and_finalize(update: Update, context: ContextTypes.DEFA
     if payment_system in ['monocard', 'monoparts']:
         invoice_data = None
         if payment_system == 'monocard':
-            invoice_data = generate_mono_card_invoice(order_id, amount, f"Оплата за: {product_name}")
+            invoice_data = await generate_mono_card_invoice(order_id, amount, f"Оплата за: {product_name}")
         elif payment_system == 'monoparts':
-            invoice_data = generate_mono_parts_invoice(order_id, amount, f"Покупка частинами: {product_name}")
+            invoice_data = await generate_mono_parts_invoice(order_id, amount, f"Покупка частинами: {product_name}")
         
         if invoice_data and invoice_data.get("url"):
             payment_url = invoice_data["url"]
-            db_query("UPDATE orders SET payment_invoice_id = ? WHERE id = ?", (invoice_data["invoice_id"], order_id), commit=True)
+            await pool.execute("UPDATE orders SET payment_invoice_id = ? WHERE id = ?", (invoice_data["invoice_id"], order_id))
             
             keyboard = [[InlineKeyboardButton(get_text("go_to_payment", user_id), url=payment_url)]]
             await update.message.reply_text(get_text("order_created", user_id), reply_markup=InlineKeyboardMarkup(keyboard))
@@ -578,14 +741,10 @@ async def get_novaposhta_and_finalize(update: Update, context: ContextTypes.DEFA
 # === КОНЕЦ НОВОГО БЛОКА ===
 
 async def notify_admin_of_new_order(context: ContextTypes.DEFAULT_TYPE, order_id: str, payment_method: str, product_name: str, customer_info: dict):
-    order_info = db_query("SELECT user_id FROM orders WHERE id = ?", (order_id,), fetchone=True)
+    order_info = await pool.fetchone("SELECT user_id FROM orders WHERE id = ?", (order_id,))
     if not order_info: return
     user_id = order_info['user_id']
-    try:
-        user = await context.bot.get_chat(user_id)
-        user_info = f"{user.first_name} (@{user.username})" if user.username else user.first_name
-    except TelegramError:
-        user_info = f"ID: {user_id}"
+    user_info = await user_profiles.display_name(user_id, context.bot)
 
     details_text = get_text("order_details_for_admin", "ru").format( # Используем язык админа
         name=customer_info.get('name', '-'),
@@ -602,20 +761,11 @@ async def notify_admin_of_new_order(context: ContextTypes.DEFAULT_TYPE, order_id
         f"<b>Order ID:</b> {order_id}\n\n"
         f"{details_text}"
     )
-    for admin_id in ADMIN_IDS:
-        try:
-            await context.bot.send_message(chat_id=admin_id, text=text_for_admin, parse_mode="HTML")
-        except Exception as e:
-            logger.error(f"Не удалось отправить уведомление админу {admin_id}: {e}")
+    admin_notifier.notify(text_for_admin, summary=f"Новый заказ {order_id}: {product_name} ({payment_method}), {user_info}")
 
 async def search_model_result(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
     user_id = update.effective_user.id
-    query_text = update.message.text.lower()
-    
-    found_products = []
-    for prod_id, details in product_details_cache.items():
-        if query_text in details['name'].lower():
-            found_products.append((prod_id, details['name']))
+    found_products = search_index.search(update.message.text)
 
     if not found_products:
         await update.message.reply_text(get_text("model_not_found", user_id))
@@ -629,22 +779,27 @@ async def search_model_result(update: Update, context: ContextTypes.DEFAULT_TYPE
 # --- ФИЛЬТРЫ (без изменений) ---
 def get_filter_keyboard(user_id, context):
     filters_data = context.user_data.get('filters', {})
-    min_price = filters_data.get('min_price')
-    max_price = filters_data.get('max_price')
-    currency = filters_data.get('currency', 'UAH').upper()
+    return build_filter_keyboard(
+        language_store.get(user_id),
+        filters_data.get('min_price'),
+        filters_data.get('max_price'),
+        filters_data.get('currency', 'UAH').upper()
+    )
 
+@functools.lru_cache(maxsize=1024)
+def build_filter_keyboard(lang, min_price, max_price, currency):
     min_price_text = f" ({min_price})" if min_price else ""
     max_price_text = f" ({max_price})" if max_price else ""
     currency_text = f" ({currency})"
 
     keyboard = [
         [
-            KeyboardButton(get_text("set_min_price", user_id) + min_price_text),
-            KeyboardButton(get_text("set_max_price", user_id) + max_price_text)
+            KeyboardButton(text_for("set_min_price", lang) + min_price_text),
+            KeyboardButton(text_for("set_max_price", lang) + max_price_text)
         ],
-        [KeyboardButton(get_text("choose_currency", user_id) + currency_text)],
-        [KeyboardButton(get_text("apply_filters", user_id))],
-        [KeyboardButton(get_text("reset_filters", user_id)), KeyboardButton(get_text("back_to_main", user_id))],
+        [KeyboardButton(text_for("choose_currency", lang) + currency_text)],
+        [KeyboardButton(text_for("apply_filters", lang))],
+        [KeyboardButton(text_for("reset_filters", lang)), KeyboardButton(text_for("back_to_main", lang))],
     ]
     return ReplyKeyboardMarkup(keyboard, resize_keyboard=True)
 
@@ -733,32 +888,24 @@ async def apply_filters(update: Update, context: ContextTypes.DEFAULT_TYPE) -> i
         if not usd_rate:
             await update.message.reply_text(get_text("currency_rate_error", user_id))
             return FILTER_MENU
+        # Тот же пересчет, что и для цен товаров, чтобы границы фильтра совпадали с ценами точно
         if min_price is not None:
-            min_price_kopecks = int(min_price * usd_rate * 100)
+            min_price_kopecks = ingest.to_kopecks(round(min_price * 100), 'USD', usd_rate)
         if max_price is not None:
-            max_price_kopecks = int(max_price * usd_rate * 100)
+            max_price_kopecks = ingest.to_kopecks(round(max_price * 100), 'USD', usd_rate)
     else: # UAH
         if min_price is not None:
             min_price_kopecks = min_price * 100
         if max_price is not None:
             max_price_kopecks = max_price * 100
 
-    query = "SELECT id, name FROM products WHERE price_numeric IS NOT NULL"
-    params = []
-    if min_price_kopecks is not None:
-        query += " AND price_numeric >= ?"
-        params.append(min_price_kopecks)
-    if max_price_kopecks is not None:
-        query += " AND price_numeric <= ?"
-        params.append(max_price_kopecks)
-
-    found_products = db_query(query, tuple(params), fetchall=True)
+    found_products = [catalog_cache.get(product_id) for product_id in price_index.range(min_price_kopecks, max_price_kopecks)]
     await update.message.reply_text("Поиск завершен.", reply_markup=get_main_keyboard(user_id))
 
     if not found_products:
         await update.message.reply_text(get_text("no_results_filters", user_id))
     else:
-        keyboard = [[InlineKeyboardButton(row['name'], callback_data=f"prod_{row['id']}")] for row in found_products]
+        keyboard = [[InlineKeyboardButton(p.name, callback_data=f"prod_{p.id}")] for p in found_products]
         await update.message.reply_text(get_text("filters_applied", user_id), reply_markup=InlineKeyboardMarkup(keyboard))
         
     context.user_data.pop('filters', None)
@@ -768,44 +915,11 @@ async def apply_filters(update: Update, context: ContextTypes.DEFAULT_TYPE) -> i
 # --- ПАРСИНГ КАНАЛА И АДМИН-ПАНЕЛЬ (без изменений) ---
 def parse_message_for_product(message):
     text = message.text or message.caption or ""
-    text_lower = text.lower()
-    
-    category = None
-    categories_from_db = db_query("SELECT name FROM categories", fetchall=True)
-    for cat_tuple in categories_from_db:
-        cat_name = cat_tuple[0]
-        if re.search(r'\b' + re.escape(cat_name.lower()) + r'\b', text_lower, re.UNICODE):
-            category = cat_name
-            break
-    if not category: return None
-
-    product_name = None
-    lines = [line for line in text.splitlines() if line.strip()]
-    if not lines: return None
-
-    if category.lower() in lines[0].lower():
-        product_name = lines[0].strip()
-    else:
-        for line in lines:
-            if category.lower() in line.lower():
-                product_name = line.strip()
-                break
-    if not product_name: product_name = lines[0].strip()
-    if len(product_name) > 100: product_name = product_name[:97] + "..."
-
-    price_display, price_numeric, cleaned_description = process_price_string(text)
-    
-    year_match = re.search(r'\b(20\d{2})\b', text)
-    year = int(year_match.group(1)) if year_match else None
-
-    details = {
-        "description": cleaned_description,
-        "price": price_display,
-        "price_numeric": price_numeric,
-        "year": year,
-        "photo": message.photo[-1].file_id if message.photo else None,
-        "video": message.video.file_id if message.video else None
-    }
+    parsed = ingest.parse_post_text(text, category_matcher, get_usd_to_uah_rate())
+    if not parsed: return None
+    category, product_name, details = parsed
+    details["photo"] = message.photo[-1].file_id if message.photo else None
+    details["video"] = message.video.file_id if message.video else None
     return category, product_name, details
 
 async def channel_post_handler(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
@@ -814,23 +928,28 @@ async def channel_post_handler(update: Update, context: ContextTypes.DEFAULT_TYP
     parsed_data = parse_message_for_product(message)
     if parsed_data:
         category, product_name, details = parsed_data
-        exists = db_query("SELECT 1 FROM products WHERE name = ?", (product_name,), fetchone=True)
-        if not exists:
-            db_query("INSERT INTO products (name, description, price, price_numeric, year, photo_id, video_id, category_name) VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
-                     (product_name, details['description'], details['price'], details['price_numeric'], details['year'], details['photo'], details['video'], category), commit=True)
+        added = None
+        if catalog_cache.get_by_name(product_name) is None:
+            added = await insert_product(product_name, details['description'], details['price'], details['price_numeric'],
+                                         details['year'], details['photo'], details['video'], category,
+                                         details['price_amount'], details['price_currency'])
+        if added:
             logger.info(f"Добавлен новый товар из канала: {product_name}")
-            load_data_from_db()
         else:
             logger.info(f"Товар '{product_name}' из канала уже существует в БД. Пропускаем.")
 
-def get_admin_keyboard(user_id):
+@functools.lru_cache(maxsize=16)
+def build_admin_keyboard(lang):
     keyboard = [
-        [KeyboardButton(get_text("admin_stats", user_id)), KeyboardButton(get_text("admin_categories", user_id))],
-        [KeyboardButton(get_text("admin_products", user_id)), KeyboardButton(get_text("admin_posting", user_id))],
-        [KeyboardButton(get_text("admin_back", user_id))]
+        [KeyboardButton(text_for("admin_stats", lang)), KeyboardButton(text_for("admin_categories", lang))],
+        [KeyboardButton(text_for("admin_products", lang)), KeyboardButton(text_for("admin_posting", lang))],
+        [KeyboardButton(text_for("admin_back", lang))]
     ]
     return ReplyKeyboardMarkup(keyboard, resize_keyboard=True)
 
+def get_admin_keyboard(user_id):
+    return build_admin_keyboard(language_store.get(user_id))
+
 async def admin_panel(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
     user_id = update.effective_user.id
     if user_id not in ADMIN_IDS:
@@ -851,7 +970,45 @@ async def sync_channel_info(update: Update, context: ContextTypes.DEFAULT_TYPE)
     if user_id not in ADMIN_IDS:
         await update.message.reply_text(get_text("no_access", user_id))
         return
-    await update.message.reply_text(get_text("sync_command_info", user_id), parse_mode="HTML")
+    if not context.args:
+        await update.message.reply_text(get_text("sync_command_info", user_id), parse_mode="HTML")
+        return
+    force = context.args[0] == "--force"
+    export_path = " ".join(context.args[1:] if force else context.args)
+    if not export_path:
+        await update.message.reply_text(get_text("sync_command_info", user_id), parse_mode="HTML")
+        return
+    await update.message.reply_text(get_text("sync_started", user_id))
+    try:
+        # Импорт идет в отдельном потоке со своим соединением; кэш каталога перечитывается один раз в конце
+        result = await asyncio.to_thread(backfill.run, export_path, get_usd_to_uah_rate(),
+                                         source_channel_id=SOURCE_CHANNEL_ID, force=force)
+    except (OSError, ValueError, sqlite3.Error) as e:
+        logger.error(f"Ошибка импорта истории канала из {export_path}: {e}")
+        await update.message.reply_text(get_text("sync_fail", user_id).format(error=e))
+        return
+    await load_data_from_db()
+    await update.message.reply_text(get_text("sync_done", user_id).format(**result._asdict()))
+
+async def db_profile_report(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    """/dbprofile [N | reset | on | off] - топ запросов профилировщика пула (см. query_profiler)."""
+    user_id = update.effective_user.id
+    if user_id not in ADMIN_IDS:
+        await update.message.reply_text(get_text("no_access", user_id))
+        return
+    profiler = pool.profiler
+    action = context.args[0].lower() if context.args else ""
+    if action in ("on", "off", "reset"):
+        {"on": profiler.enable, "off": profiler.disable, "reset": profiler.reset}[action]()
+        await update.message.reply_text(get_text(f"dbprofile_{action}", user_id))
+        return
+    top = int(action) if action.isdigit() else 10
+    report = html.escape(profiler.format_report(top, width=300))
+    # Лимит сообщения Telegram - 4096 символов
+    if len(report) > 3500:
+        report = report[:3500] + "\n..."
+    title = get_text("dbprofile_title", user_id).format(top=top, threshold=profiler.slow_query_ms)
+    await update.message.reply_text(f"{title}\n<pre>{report}</pre>", parse_mode="HTML")
 
 async def admin_stats(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
     user_id = update.effective_user.id
@@ -859,16 +1016,20 @@ async def admin_stats(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int
     week_ago = today - datetime.timedelta(days=7)
     month_ago = today - datetime.timedelta(days=30)
     
-    total = db_query("SELECT COUNT(*) FROM users", fetchone=True)[0]
-    today_count = db_query("SELECT COUNT(*) FROM users WHERE date(join_date) = ?", (today.isoformat(),), fetchone=True)[0]
-    week_count = db_query("SELECT COUNT(*) FROM users WHERE date(join_date) >= ?", (week_ago.isoformat(),), fetchone=True)[0]
-    month_count = db_query("SELECT COUNT(*) FROM users WHERE date(join_date) >= ?", (month_ago.isoformat(),), fetchone=True)[0]
+    # Дневные сводки поддерживаются триггерами (см. db.sync_daily_stats): O(дней) вместо сканов users
+    total = await stats.totals(pool)
+    days = await stats.daily_rows(pool, month_ago, today)
+    today_stats = stats.sum_since(days, today)
+    week_stats = stats.sum_since(days, week_ago)
+    month_stats = stats.sum_since(days, month_ago)
     
     stats_text = (f"{get_text('stats_title', user_id)}\n\n"
-                  f"👤 {get_text('stats_total', user_id)} <b>{total}</b>\n"
-                  f"☀️ {get_text('stats_today', user_id)} <b>{today_count}</b>\n"
-                  f"📅 {get_text('stats_week', user_id)} <b>{week_count}</b>\n"
-                  f"🗓️ {get_text('stats_month', user_id)} <b>{month_count}</b>")
+                  f"👤 {get_text('stats_total', user_id)} <b>{total.signups}</b>\n"
+                  f"☀️ {get_text('stats_today', user_id)} <b>{today_stats.signups}</b>\n"
+                  f"📅 {get_text('stats_week', user_id)} <b>{week_stats.signups}</b>\n"
+                  f"🗓️ {get_text('stats_month', user_id)} <b>{month_stats.signups}</b>\n\n"
+                  f"🛒 {get_text('stats_orders', user_id)} <b>{month_stats.orders} ({month_stats.paid_orders})</b>\n"
+                  f"💰 {get_text('stats_revenue', user_id)} <b>{month_stats.revenue / 100:.2f} UAH</b>")
     await update.message.reply_text(stats_text, parse_mode="HTML")
     return ADMIN_PANEL
 
@@ -886,32 +1047,35 @@ async def admin_add_category_prompt(update: Update, context: ContextTypes.DEFAUL
 async def admin_add_category_save(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
     cat_name = update.message.text.strip()
     user_id = update.effective_user.id
-    if db_query("SELECT 1 FROM categories WHERE name = ?", (cat_name,), fetchone=True):
+    if cat_name in catalog_cache.categories:
         await update.message.reply_text(get_text("cat_exists", user_id))
     else:
-        db_query("INSERT INTO categories (name) VALUES (?)", (cat_name,), commit=True)
-        load_data_from_db()
+        await pool.execute("INSERT OR IGNORE INTO categories (name) VALUES (?)", (cat_name,))
+        catalog_cache.add_category(cat_name)
         await update.message.reply_text(get_text("cat_added", user_id).format(cat_name))
     return await admin_categories(update, context)
 
 async def admin_del_category_prompt(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
     user_id = update.effective_user.id
-    categories = db_query("SELECT name FROM categories", fetchall=True)
+    categories = catalog_cache.categories
     if not categories:
         await update.message.reply_text("Нет категорий для удаления.")
         return await admin_categories(update, context)
-    keyboard = [[InlineKeyboardButton(cat['name'], callback_data=f"delcat_{cat['name']}")] for cat in categories]
+    keyboard = [[InlineKeyboardButton(cat, callback_data=f"delcat_{cat}")] for cat in categories]
     await update.message.reply_text(get_text("cat_choose_del", user_id), reply_markup=InlineKeyboardMarkup(keyboard))
     return ADMIN_DEL_CATEGORY
 
+def _delete_category(conn, cat_name):
+    conn.execute("DELETE FROM products WHERE category_name = ?", (cat_name,))
+    conn.execute("DELETE FROM categories WHERE name = ?", (cat_name,))
+
 async def admin_del_category_confirm(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
     query = update.callback_query
     await query.answer()
     user_id = query.from_user.id
     cat_name = query.data.split("_", 1)[1]
-    db_query("DELETE FROM products WHERE category_name = ?", (cat_name,), commit=True)
-    db_query("DELETE FROM categories WHERE name = ?", (cat_name,), commit=True)
-    load_data_from_db()
+    await pool.transaction(_delete_category, cat_name)
+    catalog_cache.remove_category(cat_name)
     await query.edit_message_text(get_text("cat_deleted", user_id).format(cat_name))
     # Hack to pass message object to the next state function
     query.message.from_user = query.from_user 
@@ -926,8 +1090,7 @@ async def admin_products(update: Update, context: ContextTypes.DEFAULT_TYPE) ->
 
 async def admin_add_product_start(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
     user_id = update.effective_user.id
-    categories = db_query("SELECT name FROM categories", fetchall=True)
-    keyboard = [[InlineKeyboardButton(cat['name'], callback_data=f"addprod_{cat['name']}")] for cat in categories]
+    keyboard = [[InlineKeyboardButton(cat, callback_data=f"addprod_{cat}")] for cat in catalog_cache.categories]
     await update.message.reply_text(get_text("prod_choose_cat_for_add", user_id), reply_markup=InlineKeyboardMarkup(keyboard))
     return ADMIN_ADD_PRODUCT_STEP1_CAT
 
@@ -950,9 +1113,9 @@ async def admin_add_product_price(update: Update, context: ContextTypes.DEFAULT_
 
 async def admin_add_product_media(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
     price_str = update.message.text.strip()
-    price_display, numeric_price, _ = process_price_string(f"Цена: {price_str}")
-    context.user_data['new_product']['price'] = price_display
-    context.user_data['new_product']['price_numeric'] = numeric_price
+    price = ingest.extract_price(f"Цена: {price_str}", get_usd_to_uah_rate())
+    for key in ("price", "price_numeric", "price_amount", "price_currency"):
+        context.user_data['new_product'][key] = price[key]
     await update.message.reply_text(get_text("prod_send_media", update.effective_user.id))
     return ADMIN_ADD_PRODUCT_STEP5_MEDIA
 
@@ -961,26 +1124,39 @@ async def admin_add_product_save(update: Update, context: ContextTypes.DEFAULT_T
     product = context.user_data['new_product']
     product['photo'] = update.message.photo[-1].file_id if update.message.photo else None
     product['video'] = update.message.video.file_id if update.message.video else None
-    year_match = re.search(r'\b(20\d{2})\b', product['description'])
+    year_match = ingest.YEAR_PATTERN.search(product['description'])
     year = int(year_match.group(1)) if year_match else None
-    if db_query("SELECT 1 FROM products WHERE name = ?", (product['name'],), fetchone=True):
+    added = None
+    if catalog_cache.get_by_name(product['name']) is None:
+        added = await insert_product(product['name'], product['description'], product['price'], product['price_numeric'],
+                                     year, product['photo'], product['video'], product['category'],
+                                     product['price_amount'], product['price_currency'])
+    if not added:
         await update.message.reply_text(get_text("prod_exists", user_id))
     else:
-        db_query("INSERT INTO products (name, description, price, price_numeric, year, photo_id, video_id, category_name) VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
-                 (product['name'], product['description'], product['price'], product['price_numeric'], year, product['photo'], product['video'], product['category']), commit=True)
-        load_data_from_db()
         await update.message.reply_text(get_text("prod_added", user_id).format(product['name']))
     context.user_data.pop('new_product', None)
     return await admin_panel(update, context)
 
 async def admin_del_product_prompt(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
     user_id = update.effective_user.id
-    all_products = db_query("SELECT id, name FROM products ORDER BY name", fetchall=True)
-    if not all_products:
+    markup = admin_products_page_markup(user_id)
+    if not markup:
         await update.message.reply_text(get_text("no_products_in_category", user_id))
         return await admin_products(update, context)
-    keyboard = [[InlineKeyboardButton(row['name'], callback_data=f"delprod_{row['id']}")] for row in all_products]
-    await update.message.reply_text(get_text("prod_choose_del", user_id), reply_markup=InlineKeyboardMarkup(keyboard))
+    await update.message.reply_text(get_text("prod_choose_del", user_id), reply_markup=markup)
+    return ADMIN_DEL_PRODUCT
+
+async def admin_del_product_page(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
+    """Листание списка товаров на удаление: delpgn_<id> - после товара, delpgp_<id> - перед ним."""
+    query = update.callback_query
+    await query.answer()
+    direction, anchor = query.data.split("_", 1)
+    anchor = int(anchor)
+    markup = admin_products_page_markup(query.from_user.id, after_id=anchor if direction == "delpgn" else None,
+                                        before_id=anchor if direction == "delpgp" else None)
+    if markup:
+        await query.edit_message_reply_markup(reply_markup=markup)
     return ADMIN_DEL_PRODUCT
 
 async def admin_del_product_confirm(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
@@ -988,9 +1164,10 @@ async def admin_del_product_confirm(update: Update, context: ContextTypes.DEFAUL
     await query.answer()
     user_id = query.from_user.id
     product_id = int(query.data.replace("delprod_", "", 1))
-    product_name = product_details_cache.get(product_id, {}).get("name", f"ID: {product_id}")
-    db_query("DELETE FROM products WHERE id = ?", (product_id,), commit=True)
-    load_data_from_db()
+    product = catalog_cache.get(product_id)
+    product_name = product.name if product else f"ID: {product_id}"
+    await pool.execute("DELETE FROM products WHERE id = ?", (product_id,))
+    catalog_cache.delete(product_id)
     await query.edit_message_text(get_text("prod_deleted", user_id).format(product_name))
     query.message.from_user = query.from_user
     return await admin_products(query.message, context)
@@ -1035,10 +1212,35 @@ async def admin_posting_publish(update: Update, context: ContextTypes.DEFAULT_TY
     return await admin_panel(update, context)
 
 # --- ГЛАВНАЯ ФУНКЦИЯ ЗАПУСКА ---
-def main() -> None:
-    init_db()
-    load_data_from_db()
-    application = Application.builder().token(BOT_TOKEN).build()
+async def on_startup(application: Application) -> None:
+    await load_data_from_db()
+    await rate_service.start()
+    admin_notifier.start(application.bot)
+    language_store.start()
+    registrations.start()
+    currency_repricer.start()
+    metrics_server.start()
+
+async def on_shutdown(application: Application) -> None:
+    await admin_notifier.drain()
+    await language_store.stop()
+    await registrations.stop()
+    await rate_service.stop()
+    await currency_repricer.stop()
+    await mono_client.aclose()
+    metrics_server.stop()
+    pool.close()
+
+def build_application(token: str = BOT_TOKEN, base_url: str | None = None) -> Application:
+    """
+    Собирает Application со всеми обработчиками.
+    base_url - адрес Bot API вида "http://host:port/bot" (например, локальной
+    заглушки loadtest.fake_telegram); по умолчанию используется api.telegram.org.
+    """
+    builder = Application.builder().token(token).post_init(on_startup).post_shutdown(on_shutdown)
+    if base_url:
+        builder = builder.base_url(base_url)
+    application = builder.build()
     
     main_menu_handlers = [
         MessageHandler(filters.Regex(l10n_regex("catalog")), catalog),
@@ -1101,7 +1303,10 @@ def main() -> None:
             ADMIN_ADD_PRODUCT_STEP3_DESC: [MessageHandler(filters.TEXT & ~filters.COMMAND, admin_add_product_price)],
             ADMIN_ADD_PRODUCT_STEP4_PRICE: [MessageHandler(filters.TEXT & ~filters.COMMAND, admin_add_product_media)],
             ADMIN_ADD_PRODUCT_STEP5_MEDIA: [MessageHandler(filters.PHOTO | filters.VIDEO, admin_add_product_save)],
-            ADMIN_DEL_PRODUCT: [CallbackQueryHandler(admin_del_product_confirm, pattern="^delprod_")],
+            ADMIN_DEL_PRODUCT: [
+                CallbackQueryHandler(admin_del_product_confirm, pattern="^delprod_"),
+                CallbackQueryHandler(admin_del_product_page, pattern="^delpg[np]_"),
+            ],
             ADMIN_POSTING_STEP1_TEXT: [MessageHandler(filters.TEXT & ~filters.COMMAND, admin_posting_media)],
             ADMIN_POSTING_STEP2_MEDIA: [MessageHandler(filters.PHOTO, admin_posting_btn_text)],
             ADMIN_POSTING_STEP3_BTN_TEXT: [MessageHandler(filters.TEXT & ~filters.COMMAND, admin_posting_btn_url)],
@@ -1112,18 +1317,34 @@ def main() -> None:
         allow_reentry=True
     )
     
+    # Профили пользователей обновляются до всех остальных обработчиков
+    application.add_handler(TypeHandler(Update, track_user), group=-1)
+
     # Глобальный обработчик для кнопок, которые не меняют состояние диалога
-    application.add_handler(CallbackQueryHandler(catalog_button_handler, pattern="^(cat_|prod_|buy_)"))
+    application.add_handler(CallbackQueryHandler(catalog_button_handler, pattern="^(cat_|catn_|catp_|prod_|buy_)"))
 
     # ConversationHandler должен идти после глобальных обработчиков, которые он не должен перехватывать
     application.add_handler(conv_handler)
     
     # Прочие обработчики
     application.add_handler(CommandHandler("sync", sync_channel_info))
+    application.add_handler(CommandHandler("dbprofile", db_profile_report))
     application.add_handler(MessageHandler(filters.ChatType.CHANNEL, channel_post_handler))
 
-    logger.info("Бот запущен...")
-    application.run_polling()
+    # Время и ошибки каждого обработчика пишутся в метрики
+    metrics.instrument_application(application)
+    return application
+
+def main() -> None:
+    init_db()
+    application = build_application()
+    if BOT_MODE == "webhook":
+        import bot_server
+        logger.info("Бот запущен в режиме вебхуков...")
+        bot_server.run(application, admin_notifier, user_profiles)
+    else:
+        logger.info("Бот запущен...")
+        application.run_polling()
 
 if __name__ == "__main__":
     main()
\ No newline at end of file
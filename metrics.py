@@ -0,0 +1,333 @@
+import bisect
+import functools
+import logging
+import os
+import re
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+logger = logging.getLogger(__name__)
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+# Порт встроенного endpoint'а метрик бота; 0 отключает его
+METRICS_PORT = int(os.getenv("METRICS_PORT", "9101"))
+METRICS_HOST = os.getenv("METRICS_HOST", "127.0.0.1")
+# Границы корзин в секундах: от запросов SQLite по индексу до медленных внешних API
+DEFAULT_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+# Сколько разных SQL-текстов помнить в кеше нормализации
+STATEMENT_CACHE_SIZE = 4096
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_labels(names, values, extra=()) -> str:
+    pairs = [f'{name}="{_escape(str(value))}"' for name, value in zip(names, values)]
+    pairs.extend(f'{name}="{value}"' for name, value in extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def _format_value(value: float) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if not float(value).is_integer() else str(int(value))
+
+
+class Counter:
+    """Монотонный счетчик с метками (имя по соглашению Prometheus оканчивается на _total)."""
+    kind = "counter"
+
+    def __init__(self, name: str, documentation: str, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, *labelvalues, amount: float = 1):
+        with self._lock:
+            self._values[labelvalues] = self._values.get(labelvalues, 0) + amount
+
+    def value(self, *labelvalues) -> float:
+        return self._values.get(labelvalues, 0)
+
+    def samples(self):
+        with self._lock:
+            items = list(self._values.items())
+        for labelvalues, value in items:
+            yield f"{self.name}{_format_labels(self.labelnames, labelvalues)} {_format_value(value)}"
+
+
+class Gauge:
+    """Текущее значение, которое читается функцией в момент запроса метрик."""
+    kind = "gauge"
+
+    def __init__(self, name: str, documentation: str, function):
+        self.name = name
+        self.documentation = documentation
+        self.function = function
+
+    def samples(self):
+        try:
+            value = self.function()
+        except Exception as e:
+            logger.error(f"Не удалось прочитать значение метрики {self.name}: {e}")
+            return
+        yield f"{self.name} {_format_value(value)}"
+
+
+class Histogram:
+    """
+    Гистограмма с фиксированными корзинами. Для каждого набора меток хранится
+    список [счетчики корзин..., сумма, количество]; накопительные значения
+    корзин считаются только при выводе.
+    """
+    kind = "histogram"
+
+    def __init__(self, name: str, documentation: str, labelnames=(), buckets=DEFAULT_BUCKETS):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(sorted(buckets))
+        self._series = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value: float, *labelvalues):
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.get(labelvalues)
+            if series is None:
+                series = self._series[labelvalues] = [0] * (len(self.buckets) + 3)
+            series[index] += 1
+            series[-2] += value
+            series[-1] += 1
+
+    def time(self, *labelvalues):
+        """Контекстный менеджер, замеряющий время выполнения блока."""
+        return _Timer(self, labelvalues)
+
+    def count(self, *labelvalues) -> int:
+        series = self._series.get(labelvalues)
+        return series[-1] if series else 0
+
+    def samples(self):
+        with self._lock:
+            items = [(labelvalues, list(series)) for labelvalues, series in self._series.items()]
+        bounds = self.buckets + (float("inf"),)
+        for labelvalues, series in items:
+            cumulative = 0
+            for bound, count in zip(bounds, series):
+                cumulative += count
+                labels = _format_labels(self.labelnames, labelvalues, (("le", _format_value(bound)),))
+                yield f"{self.name}_bucket{labels} {cumulative}"
+            labels = _format_labels(self.labelnames, labelvalues)
+            yield f"{self.name}_sum{labels} {_format_value(series[-2])}"
+            yield f"{self.name}_count{labels} {series[-1]}"
+
+
+class _Timer:
+    __slots__ = ("histogram", "labelvalues", "started")
+
+    def __init__(self, histogram: Histogram, labelvalues: tuple):
+        self.histogram = histogram
+        self.labelvalues = labelvalues
+
+    def __enter__(self):
+        self.started = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.histogram.observe(time.perf_counter() - self.started, *self.labelvalues)
+
+
+class Registry:
+    """
+    Набор метрик процесса, сериализуемый в текстовый формат Prometheus.
+    observe() и inc() - поиск по кортежу меток, bisect по корзинам и несколько
+    сложений под блокировкой; текст формируется только при запросе /metrics.
+    """
+
+    def __init__(self):
+        self._metrics = {}
+
+    def register(self, metric):
+        if metric.name in self._metrics:
+            raise ValueError(f"Метрика {metric.name} уже зарегистрирована")
+        self._metrics[metric.name] = metric
+        return metric
+
+    def unregister(self, name: str):
+        self._metrics.pop(name, None)
+
+    def render(self) -> str:
+        lines = []
+        for metric in list(self._metrics.values()):
+            lines.append(f"# HELP {metric.name} {metric.documentation}")
+            lines.append(f"# TYPE {metric.name} {metric.kind}")
+            lines.extend(metric.samples())
+        return "\n".join(lines) + "\n"
+
+
+registry = Registry()
+
+
+def counter(name: str, documentation: str, labelnames=()) -> Counter:
+    return registry.register(Counter(name, documentation, labelnames))
+
+
+def histogram(name: str, documentation: str, labelnames=(), buckets=DEFAULT_BUCKETS) -> Histogram:
+    return registry.register(Histogram(name, documentation, labelnames, buckets))
+
+
+def gauge(name: str, documentation: str, function) -> Gauge:
+    """Регистрирует gauge; повторная регистрация с тем же именем заменяет функцию."""
+    registry.unregister(name)
+    return registry.register(Gauge(name, documentation, function))
+
+
+# --- Метрики приложения ---
+
+HANDLER_LATENCY = histogram("bot_handler_duration_seconds", "Время выполнения обработчиков PTB", ("handler",))
+HANDLER_ERRORS = counter("bot_handler_errors_total", "Исключения в обработчиках PTB", ("handler",))
+DB_QUERY_LATENCY = histogram("db_query_duration_seconds", "Время выполнения запросов SQLite в потоке пула",
+                             ("statement",))
+RATE_CACHE_LOOKUPS = counter("currency_rate_cache_lookups_total", "Обращения к кешу курса USD/UAH (hit, stale, miss)",
+                             ("result",))
+EXTERNAL_LATENCY = histogram("external_request_duration_seconds", "Запросы к внешним API",
+                             ("service", "operation", "outcome"))
+WEBHOOK_LATENCY = histogram("webhook_request_duration_seconds", "Прием вебхуков платежей до ответа провайдеру",
+                            ("endpoint", "status"))
+PAYMENT_EVENT_LATENCY = histogram("payment_event_duration_seconds", "Обработка событий журнала платежей",
+                                  ("provider", "result"))
+
+
+# --- Нормализация SQL для меток ---
+
+_WHITESPACE = re.compile(r"\s+")
+_STRING_LITERAL = re.compile(r"'(?:[^']|'')*'")
+_NUMBER_LITERAL = re.compile(r"(?<![\w.])-?\d+(?:\.\d+)?\b")
+_PLACEHOLDER_LIST = re.compile(r"\(\s*\?(?:\s*,\s*\?)+\s*\)")
+_statement_labels = {}
+
+
+def statement_label(query: str) -> str:
+    """
+    Нормализованный текст запроса для метки: пробелы схлопнуты, литералы заменены
+    на ?, списки параметров IN (?, ?, ...) сведены к (?...). Результат кешируется.
+    """
+    label = _statement_labels.get(query)
+    if label is None:
+        label = _WHITESPACE.sub(" ", query).strip()
+        label = _STRING_LITERAL.sub("?", label)
+        label = _NUMBER_LITERAL.sub("?", label)
+        label = _PLACEHOLDER_LIST.sub("(?...)", label)
+        if len(_statement_labels) < STATEMENT_CACHE_SIZE:
+            _statement_labels[query] = label
+    return label
+
+
+# --- Обработчики PTB ---
+
+def timed_handler(callback, name: str | None = None):
+    """Оборачивает async-обработчик PTB: время в HANDLER_LATENCY, исключения в HANDLER_ERRORS."""
+    from telegram.ext import ApplicationHandlerStop
+    if getattr(callback, "_metrics_name", None):
+        return callback
+    name = name or getattr(callback, "__name__", repr(callback))
+
+    @functools.wraps(callback)
+    async def wrapper(update, context):
+        started = time.perf_counter()
+        try:
+            return await callback(update, context)
+        except ApplicationHandlerStop:
+            raise
+        except Exception:
+            HANDLER_ERRORS.inc(name)
+            raise
+        finally:
+            HANDLER_LATENCY.observe(time.perf_counter() - started, name)
+
+    wrapper._metrics_name = name
+    return wrapper
+
+
+def instrument_application(application) -> int:
+    """
+    Оборачивает callback'и всех обработчиков Application, включая точки входа,
+    состояния и fallbacks ConversationHandler. Возвращает число обработчиков.
+    """
+    from telegram.ext import ConversationHandler
+
+    def walk(handlers):
+        count = 0
+        for handler in handlers:
+            if isinstance(handler, ConversationHandler):
+                count += walk(handler.entry_points)
+                for state_handlers in handler.states.values():
+                    count += walk(state_handlers)
+                count += walk(handler.fallbacks)
+            elif getattr(handler, "callback", None) is not None:
+                handler.callback = timed_handler(handler.callback)
+                count += 1
+        return count
+
+    return sum(walk(handlers) for handlers in application.handlers.values())
+
+
+# --- HTTP endpoint ---
+
+class _MetricsRequestHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path.split("?", 1)[0] != "/metrics":
+            self.send_error(404)
+            return
+        body = self.server.registry.render().encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", CONTENT_TYPE)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        # Опросы Prometheus не пишутся в лог
+        pass
+
+
+class MetricsServer:
+    """
+    Минимальный HTTP-сервер /metrics бота в фоновом потоке процесса: endpoint
+    отвечает даже при заблокированном event loop. Веб-сервер вебхуков отдает
+    метрики маршрутом /metrics Flask-приложения.
+    """
+
+    def __init__(self, port: int = METRICS_PORT, host: str = METRICS_HOST, metrics_registry: Registry = registry):
+        self.host = host
+        self.port = port
+        self.registry = metrics_registry
+        self._server = None
+        self._thread = None
+
+    def start(self):
+        if not self.port or self._server is not None:
+            return
+        try:
+            self._server = ThreadingHTTPServer((self.host, self.port), _MetricsRequestHandler)
+        except OSError as e:
+            logger.error(f"Не удалось запустить endpoint метрик на {self.host}:{self.port}: {e}")
+            return
+        self._server.daemon_threads = True
+        self._server.registry = self.registry
+        self._thread = threading.Thread(target=self._server.serve_forever, name="metrics-http", daemon=True)
+        self._thread.start()
+        logger.info(f"Метрики доступны на http://{self.host}:{self.port}/metrics")
+
+    def stop(self):
+        if self._server is None:
+            return
+        self._server.shutdown()
+        self._server.server_close()
+        self._thread.join()
+        self._server = self._thread = None
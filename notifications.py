@@ -0,0 +1,163 @@
+import asyncio
+import html
+import logging
+import time
+from collections import deque
+
+from telegram.error import RetryAfter, TelegramError
+
+logger = logging.getLogger(__name__)
+
+# Лимиты Telegram Bot API: ~30 сообщений в секунду всего и ~1 сообщение в секунду в один чат
+GLOBAL_RATE_PER_SECOND = 30
+PER_CHAT_RATE_PER_SECOND = 1
+# Если за окно пришло больше DIGEST_THRESHOLD событий, остальные объединяются в одну сводку
+DIGEST_WINDOW_SECONDS = 10
+DIGEST_THRESHOLD = 5
+# Сколько раз повторять отправку после RetryAfter (flood control)
+MAX_SEND_RETRIES = 3
+TELEGRAM_MESSAGE_LIMIT = 4096
+
+
+class TokenBucket:
+    """Асинхронный token bucket: rate токенов в секунду, не больше capacity накопленных."""
+
+    def __init__(self, rate: float, capacity: float | None = None):
+        self.rate = rate
+        self.capacity = capacity if capacity is not None else rate
+        self._tokens = self.capacity
+        self._updated = time.monotonic()
+        self._lock = asyncio.Lock()
+
+    def _refill(self):
+        now = time.monotonic()
+        self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+    async def acquire(self):
+        # Очередь на lock сохраняет порядок ожидающих (FIFO)
+        async with self._lock:
+            self._refill()
+            if self._tokens < 1:
+                await asyncio.sleep((1 - self._tokens) / self.rate)
+                self._refill()
+            self._tokens -= 1
+
+
+class AdminNotifier:
+    """
+    Рассылка уведомлений администраторам.
+
+    - Сообщение отправляется всем чатам параллельно; общий token bucket и
+      bucket на каждый чат удерживают рассылку в пределах лимитов Telegram.
+    - notify() не ждет отправки: вызывающий обработчик не блокируется сетью.
+    - Если за DIGEST_WINDOW_SECONDS пришло больше DIGEST_THRESHOLD событий,
+      следующие копятся и уходят одной сводкой в конце окна.
+    """
+
+    def __init__(self, chat_ids, window: float = DIGEST_WINDOW_SECONDS, threshold: int = DIGEST_THRESHOLD,
+                 global_rate: float = GLOBAL_RATE_PER_SECOND, per_chat_rate: float = PER_CHAT_RATE_PER_SECOND):
+        self.chat_ids = list(chat_ids)
+        self.window = window
+        self.threshold = threshold
+        self.bot = None
+        self._global_rate = global_rate
+        self._per_chat_rate = per_chat_rate
+        self._global_bucket = None
+        self._chat_buckets = {}
+        self._recent = deque()
+        self._digest = []
+        self._digest_task = None
+        self._tasks = set()
+
+    def start(self, bot):
+        """Привязывает рассылку к боту; вызывается внутри event loop, в котором будут идти отправки."""
+        self.bot = bot
+        self._global_bucket = TokenBucket(self._global_rate)
+        self._chat_buckets = {chat_id: TokenBucket(self._per_chat_rate) for chat_id in self.chat_ids}
+
+    def notify(self, text: str, summary: str | None = None, parse_mode: str | None = "HTML"):
+        """
+        Ставит уведомление в рассылку. summary - короткая строка (без разметки)
+        для сводки; по умолчанию используется первая строка text.
+        """
+        if self.bot is None:
+            logger.error("Рассылка администраторам не запущена, уведомление пропущено.")
+            return
+        now = time.monotonic()
+        while self._recent and now - self._recent[0] > self.window:
+            self._recent.popleft()
+        self._recent.append(now)
+
+        if len(self._recent) <= self.threshold and self._digest_task is None:
+            self._spawn(self._fan_out(text, parse_mode))
+            return
+
+        self._digest.append(summary or text.split("\n", 1)[0])
+        if self._digest_task is None:
+            self._digest_task = self._spawn(self._flush_digest_later())
+
+    def _spawn(self, coro) -> asyncio.Task:
+        task = asyncio.get_running_loop().create_task(coro)
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+        return task
+
+    async def _flush_digest_later(self):
+        await asyncio.sleep(self.window)
+        self._flush_digest()
+
+    def _flush_digest(self):
+        """Отправляет накопленную сводку отдельной задачей и закрывает окно."""
+        self._digest_task = None
+        events, self._digest = self._digest, []
+        if events:
+            self._spawn(self._fan_out(self._format_digest(events), "HTML"))
+
+    def _format_digest(self, events: list) -> str:
+        header = f"📦 <b>Сводка: {len(events)} событий</b>\n\n"
+        lines = []
+        length = len(header)
+        for index, event in enumerate(events):
+            line = f"• {html.escape(event)}"
+            tail = f"\n… и еще {len(events) - index}"
+            if length + len(line) + 1 + len(tail) > TELEGRAM_MESSAGE_LIMIT:
+                lines.append(tail.strip())
+                break
+            lines.append(line)
+            length += len(line) + 1
+        return header + "\n".join(lines)
+
+    async def _fan_out(self, text: str, parse_mode: str | None):
+        await asyncio.gather(*(self._send(chat_id, text, parse_mode) for chat_id in self.chat_ids))
+
+    async def _send(self, chat_id, text: str, parse_mode: str | None):
+        bucket = self._chat_buckets.get(chat_id)
+        if bucket is None:
+            bucket = self._chat_buckets[chat_id] = TokenBucket(self._per_chat_rate)
+        for attempt in range(MAX_SEND_RETRIES + 1):
+            await bucket.acquire()
+            await self._global_bucket.acquire()
+            try:
+                await self.bot.send_message(chat_id=chat_id, text=text, parse_mode=parse_mode)
+                return
+            except RetryAfter as e:
+                retry_after = e.retry_after.total_seconds() if hasattr(e.retry_after, "total_seconds") else e.retry_after
+                logger.warning(f"Flood control при отправке админу {chat_id}, повтор через {retry_after} с.")
+                if attempt < MAX_SEND_RETRIES:
+                    await asyncio.sleep(retry_after)
+            except TelegramError as e:
+                logger.error(f"Не удалось отправить уведомление админу {chat_id}: {e}")
+                return
+        logger.error(f"Уведомление админу {chat_id} не отправлено после {MAX_SEND_RETRIES} повторов.")
+
+    async def drain(self, timeout: float = 30):
+        """Дожидается отправки поставленных уведомлений, включая накопленную сводку."""
+        # Отмененная до первого шага задача не выполняет свой код, поэтому сводка отправляется здесь
+        if self._digest_task is not None:
+            self._digest_task.cancel()
+            self._flush_digest()
+        if self._tasks:
+            done, pending = await asyncio.wait(set(self._tasks), timeout=timeout)
+            if pending:
+                logger.warning(f"Не отправлено уведомлений администраторам: {len(pending)}")
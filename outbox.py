@@ -0,0 +1,205 @@
+import logging
+import os
+import sqlite3
+import threading
+import time
+import uuid
+
+from db import DB_NAME, DB_BUSY_TIMEOUT_MS
+
+logger = logging.getLogger(__name__)
+
+# Групповая запись: сколько событий максимум в одной транзакции и сколько ждать попутчиков
+OUTBOX_BATCH_SIZE = 200
+OUTBOX_FLUSH_INTERVAL_SECONDS = 0.005
+# Повторная обработка: экспоненциальная задержка и число попыток до dead-letter
+OUTBOX_MAX_ATTEMPTS = 8
+OUTBOX_BASE_BACKOFF_SECONDS = 5
+OUTBOX_MAX_BACKOFF_SECONDS = 3600
+# Аренда захваченного события: столько процесс-владелец может его обрабатывать,
+# после этого событие считается брошенным и его забирает любой процесс
+OUTBOX_LEASE_SECONDS = 120
+
+
+class PaymentOutbox:
+    """
+    Персистентный журнал платежных событий в SQLite (таблица payment_events).
+
+    Запись: append() вызывается в потоке обработки вебхука и возвращается
+    только после фиксации события на диске. Одновременные вызовы объединяются
+    фоновым писателем в одну транзакцию executemany (group commit), поэтому
+    подтверждение вебхука стоит одной быстрой вставки.
+
+    Чтение: воркеры забирают события через claim() и отмечают результат
+    complete()/fail(). claim() записывает владельца (owner) и срок аренды в
+    next_attempt_at; чужое событие в состоянии 'processing' забирается только
+    после истечения аренды, поэтому несколько процессов на одной БД не
+    обрабатывают одно событие одновременно. Обработка "как минимум один раз":
+    событие процесса, который упал, обрабатывается снова после конца аренды.
+    После OUTBOX_MAX_ATTEMPTS неудач событие переходит в состояние 'dead'.
+    """
+
+    def __init__(self, pool, db_path: str = DB_NAME, batch_size: int = OUTBOX_BATCH_SIZE,
+                 flush_interval: float = OUTBOX_FLUSH_INTERVAL_SECONDS, max_attempts: int = OUTBOX_MAX_ATTEMPTS,
+                 lease_seconds: float = OUTBOX_LEASE_SECONDS, owner: str | None = None):
+        self.pool = pool
+        self.db_path = db_path
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.max_attempts = max_attempts
+        self.lease_seconds = lease_seconds
+        self.owner = owner or f"{os.getpid()}-{uuid.uuid4().hex[:8]}"
+        self.on_append = None
+        self._pending = []
+        self._cond = threading.Condition()
+        self._writer = None
+        self._closed = False
+
+    # --- Запись (синхронно, из потоков веб-сервера) ---
+
+    def start(self):
+        with self._cond:
+            if self._writer is not None:
+                return
+            self._closed = False
+            self._writer = threading.Thread(target=self._write_loop, name="outbox-writer", daemon=True)
+            self._writer.start()
+
+    def append(self, provider: str, order_id: str, status: str, payload: str, timeout: float = 5.0) -> bool:
+        """
+        Сохраняет событие и ждет фиксации транзакции.
+        Возвращает False, если запись не удалась или не успела за timeout.
+        """
+        now = time.time()
+        waiter = {"done": threading.Event(), "ok": False}
+        with self._cond:
+            if self._closed or self._writer is None:
+                return False
+            self._pending.append(((provider, order_id, status, payload, now, now), waiter))
+            self._cond.notify()
+        if not waiter["done"].wait(timeout):
+            logger.error(f"Событие {provider}/{order_id} не записано в журнал за {timeout} с.")
+            return False
+        return waiter["ok"]
+
+    def _write_loop(self):
+        conn = sqlite3.connect(self.db_path, timeout=DB_BUSY_TIMEOUT_MS / 1000)
+        conn.execute("PRAGMA journal_mode=WAL")
+        # Подтвержденное провайдеру событие не должно теряться даже при сбое питания
+        conn.execute("PRAGMA synchronous=FULL")
+        try:
+            while True:
+                with self._cond:
+                    while not self._pending and not self._closed:
+                        self._cond.wait()
+                    if not self._pending and self._closed:
+                        return
+                # Короткая пауза собирает в пакет одновременные вебхуки
+                if len(self._pending) < self.batch_size:
+                    time.sleep(self.flush_interval)
+                with self._cond:
+                    batch, self._pending = self._pending[:self.batch_size], self._pending[self.batch_size:]
+                ok = True
+                try:
+                    with conn:
+                        conn.executemany(
+                            """INSERT INTO payment_events (provider, order_id, status, payload, received_at, next_attempt_at)
+                               VALUES (?, ?, ?, ?, ?, ?)""",
+                            [row for row, _ in batch]
+                        )
+                except sqlite3.Error as e:
+                    logger.error(f"Ошибка записи {len(batch)} событий в журнал платежей: {e}")
+                    ok = False
+                for _, waiter in batch:
+                    waiter["ok"] = ok
+                    waiter["done"].set()
+                if ok and self.on_append is not None:
+                    self.on_append()
+        finally:
+            conn.close()
+
+    def close(self, timeout: float = 5.0):
+        """Дописывает накопленные события и останавливает писателя."""
+        with self._cond:
+            self._closed = True
+            writer, self._writer = self._writer, None
+            self._cond.notify()
+        if writer is not None:
+            writer.join(timeout)
+
+    # --- Обработка (async, через пул соединений) ---
+
+    async def recover(self) -> int:
+        """
+        Возвращает в очередь события с истекшей арендой (их владелец упал или завис).
+        События, которые сейчас обрабатывают другие процессы, не затрагиваются.
+        """
+        result = await self.pool.execute(
+            "UPDATE payment_events SET state = 'pending', claimed_by = NULL "
+            "WHERE state = 'processing' AND next_attempt_at <= ?", (time.time(),)
+        )
+        if result.rowcount:
+            logger.warning(f"Возвращено в очередь {result.rowcount} необработанных платежных событий.")
+        return result.rowcount
+
+    async def claim(self, limit: int) -> list:
+        """
+        Захватывает до limit событий, время обработки которых наступило: ожидающих
+        и захваченных ранее, но с истекшей арендой.
+        """
+        def _claim(conn, now):
+            rows = conn.execute(
+                """SELECT id, provider, order_id, status, payload, attempts FROM payment_events
+                   WHERE state IN ('pending', 'processing') AND next_attempt_at <= ?
+                   ORDER BY next_attempt_at, id LIMIT ?""",
+                (now, limit)
+            ).fetchall()
+            conn.executemany(
+                "UPDATE payment_events SET state = 'processing', attempts = attempts + 1, claimed_by = ?, "
+                "next_attempt_at = ? WHERE id = ?",
+                [(self.owner, now + self.lease_seconds, row["id"]) for row in rows]
+            )
+            return rows
+        return await self.pool.transaction(_claim, time.time())
+
+    async def _release(self, event_id: int, query: str, params: tuple) -> bool:
+        """Обновляет событие, только если этот процесс все еще владеет им."""
+        result = await self.pool.execute(
+            f"{query} WHERE id = ? AND state = 'processing' AND claimed_by = ?", (*params, event_id, self.owner)
+        )
+        if not result.rowcount:
+            logger.warning(f"Аренда платежного события {event_id} истекла до завершения обработки, "
+                           f"результат не сохранен.")
+        return bool(result.rowcount)
+
+    async def complete(self, event_id: int) -> bool:
+        return await self._release(event_id, "UPDATE payment_events SET state = 'done', last_error = NULL", ())
+
+    async def fail(self, event, error: Exception) -> bool:
+        """
+        Планирует повтор с экспоненциальной задержкой или переводит событие в dead-letter.
+        Возвращает True, если событие больше не будет обрабатываться.
+        """
+        attempts = event["attempts"] + 1
+        if attempts >= self.max_attempts:
+            logger.error(f"Платежное событие {event['id']} ({event['provider']}/{event['order_id']}) "
+                         f"отправлено в dead-letter после {attempts} попыток: {error!r}")
+            await self._release(event["id"], "UPDATE payment_events SET state = 'dead', last_error = ?", (repr(error),))
+            return True
+        delay = min(OUTBOX_BASE_BACKOFF_SECONDS * 2 ** (attempts - 1), OUTBOX_MAX_BACKOFF_SECONDS)
+        logger.warning(f"Платежное событие {event['id']} не обработано (попытка {attempts}), "
+                       f"повтор через {delay} с.: {error!r}")
+        await self._release(
+            event["id"], "UPDATE payment_events SET state = 'pending', next_attempt_at = ?, last_error = ?",
+            (time.time() + delay, repr(error))
+        )
+        return False
+
+    async def next_due_in(self) -> float | None:
+        """Через сколько секунд наступит ближайшая повторная попытка (None, если ожидающих нет)."""
+        row = await self.pool.fetchone("SELECT MIN(next_attempt_at) FROM payment_events WHERE state = 'pending'")
+        return None if row[0] is None else max(0.0, row[0] - time.time())
+
+    async def backlog(self) -> int:
+        row = await self.pool.fetchone("SELECT COUNT(*) FROM payment_events WHERE state IN ('pending', 'processing')")
+        return row[0]
@@ -1,131 +1,284 @@
-
-import base64
-import hashlib
-import json
-import logging
-import requests
-from config import (
-    LIQPAY_PUBLIC_KEY, LIQPAY_PRIVATE_KEY, # Оставлено на случай, если захотите вернуть
-    MONOBANK_API_TOKEN,
-    WEBHOOK_DOMAIN,
-    BOT_USERNAME
-)
-
-# Настройка логирования
-logger = logging.getLogger(__name__)
-
-
-# --- LIQPAY INTEGRATION --- (без изменений, но больше не используется в main.py)
-def generate_liqpay_link(order_id: str, amount: int, description: str) -> str:
-    try:
-        if not BOT_USERNAME or BOT_USERNAME == "YourBotUsername":
-            logger.warning("BOT_USERNAME не установлен в config.py. Ссылка возврата может быть некорректной.")
-            result_url = "" 
-        else:
-            result_url = f'https://t.me/{BOT_USERNAME}'
-
-        params = {
-            'action': 'pay',
-            'amount': str(amount / 100), 
-            'currency': 'UAH',
-            'description': description,
-            'order_id': order_id,
-            'version': '3',
-            'public_key': LIQPAY_PUBLIC_KEY,
-            'result_url': result_url, 
-            'server_url': f'{WEBHOOK_DOMAIN}/webhook/liqpay',
-        }
-        
-        data_to_encode = json.dumps(params).encode('utf-8')
-        data = base64.b64encode(data_to_encode).decode('utf-8')
-        
-        checkout_url = f"https://www.liqpay.ua/api/3/checkout?data={data}"
-        
-        return checkout_url
-    except Exception as e:
-        logger.error(f"Ошибка при генерации ссылки LiqPay: {e}")
-        return None
-
-
-# --- MONOBANK INTEGRATION ---
-
-def _create_mono_invoice(order_id: str, amount: int, description: str, payment_type: str) -> dict | None:
-    """
-    Универсальная функция для создания счета Monobank.
-    payment_type: 'debit' (оплата картой) или 'ib' (покупка частями).
-    """
-    try:
-        if not BOT_USERNAME or BOT_USERNAME == "YourBotUsername":
-            logger.warning("BOT_USERNAME не установлен в config.py. Ссылка возврата может быть некорректной.")
-            redirect_url = ""
-        else:
-            redirect_url = f'https://t.me/{BOT_USERNAME}'
-
-        invoice_details = {
-            "amount": amount,
-            "ccy": 980, # Код валюты UAH
-            "merchantPaymInfo": {
-                "reference": order_id,
-                "destination": description,
-                "basketOrder": [
-                    {
-                        "name": description[:127], 
-                        "qty": 1,
-                        "sum": amount,
-                        "code": str(order_id)
-                    }
-                ]
-            },
-            "redirectUrl": redirect_url,
-            "webHookUrl": f'{WEBHOOK_DOMAIN}/webhook/monobank',
-            "paymentType": payment_type,
-        }
-        # Для "Покупки Частями" требуется дополнительное поле
-        if payment_type == "ib":
-            invoice_details["merchantPaymInfo"]["paymentDetails"] = description
-
-        headers = {
-            "X-Token": MONOBANK_API_TOKEN.strip(),
-        }
-
-        response = requests.post("https://api.monobank.ua/api/merchant/invoice/create", json=invoice_details, headers=headers)
-        response.raise_for_status()
-        data = response.json()
-        
-        if "pageUrl" in data:
-            return {
-                "url": data.get("pageUrl"),
-                "invoice_id": data.get("invoiceId")
-            }
-        else:
-            logger.error(f"Ошибка от API Monobank: {data.get('errText')}")
-            return None
-            
-    except requests.exceptions.RequestException as e:
-        error_details = "Нет ответа от сервера"
-        if e.response is not None:
-            try:
-                error_details = e.response.json()
-            except json.JSONDecodeError:
-                error_details = e.response.text
-        logger.error(f"Ошибка создания счета Monobank: {e}. Детали: {error_details}")
-        return None
-    except Exception as e:
-        logger.error(f"Неизвестная ошибка при создании счета Monobank: {e}")
-        return None
-
-def generate_mono_card_invoice(order_id: str, amount: int, description: str) -> dict:
-    """
-    Создает счет для обычной оплаты картой Monobank (debit).
-    """
-    logger.info(f"Создание счета Monobank (Оплата картой) для заказа {order_id}")
-    return _create_mono_invoice(order_id, amount, description, "debit")
-
-def generate_mono_parts_invoice(order_id: str, amount: int, description: str) -> dict:
-    """
-    Создает счет для "Покупки Частинами" Monobank (ib).
-    ВАЖНО: Для работы этого метода в боевом режиме требуется соответствующий эквайринг.
-    Тестовый токен может не поддерживать тип 'ib'.
-    """
-    logger.info(f"Создание счета Monobank (Покупка Частинами) для заказа {order_id}")
-    return _create_mono_invoice(order_id, amount, description, "ib")
\ No newline at end of file
+import asyncio
+import base64
+import hashlib
+import json
+import logging
+import random
+import time
+import httpx
+from db import pool as db_pool
+from metrics import EXTERNAL_LATENCY
+from config import (
+    LIQPAY_PUBLIC_KEY, LIQPAY_PRIVATE_KEY, # Оставлено на случай, если захотите вернуть
+    MONOBANK_API_TOKEN,
+    WEBHOOK_DOMAIN,
+    BOT_USERNAME
+)
+
+# Настройка логирования
+logger = logging.getLogger(__name__)
+
+
+# --- LIQPAY INTEGRATION --- (без изменений, но больше не используется в main.py)
+def generate_liqpay_link(order_id: str, amount: int, description: str) -> str:
+    try:
+        if not BOT_USERNAME or BOT_USERNAME == "YourBotUsername":
+            logger.warning("BOT_USERNAME не установлен в config.py. Ссылка возврата может быть некорректной.")
+            result_url = "" 
+        else:
+            result_url = f'https://t.me/{BOT_USERNAME}'
+
+        params = {
+            'action': 'pay',
+            'amount': str(amount / 100), 
+            'currency': 'UAH',
+            'description': description,
+            'order_id': order_id,
+            'version': '3',
+            'public_key': LIQPAY_PUBLIC_KEY,
+            'result_url': result_url, 
+            'server_url': f'{WEBHOOK_DOMAIN}/webhook/liqpay',
+        }
+        
+        data_to_encode = json.dumps(params).encode('utf-8')
+        data = base64.b64encode(data_to_encode).decode('utf-8')
+        
+        checkout_url = f"https://www.liqpay.ua/api/3/checkout?data={data}"
+        
+        return checkout_url
+    except Exception as e:
+        logger.error(f"Ошибка при генерации ссылки LiqPay: {e}")
+        return None
+
+
+# --- MONOBANK INTEGRATION ---
+
+MONOBANK_API_URL = "https://api.monobank.ua"
+MONO_REQUEST_TIMEOUT_SECONDS = 15
+# Повторы только для ошибок установки соединения, 429 и 503; 4xx означает ошибку в запросе
+MONO_MAX_RETRIES = 3
+MONO_RETRY_BACKOFF_SECONDS = 0.5
+MONO_MAX_CONNECTIONS = 10
+# Ошибки, после которых запрос заведомо не дошел до Monobank. После остальных
+# (ReadTimeout, RemoteProtocolError, ...) счет мог быть создан, и повтор создал бы второй.
+MONO_CONNECT_ERRORS = (httpx.ConnectError, httpx.ConnectTimeout, httpx.PoolTimeout)
+# Ответы, при которых запрос не обработан. Остальные 5xx (500, 502, 504) не гарантируют,
+# что счет не создан: результат считается неизвестным и запрос не повторяется.
+MONO_RETRY_STATUSES = (429, 503)
+
+# Состояния строки monobank_invoices
+INVOICE_SENDING = "sending"
+INVOICE_UNKNOWN = "unknown"
+INVOICE_CREATED = "created"
+
+
+class MonobankClient:
+    """
+    Асинхронный клиент эквайринга Monobank.
+
+    - Одно httpx.AsyncClient с пулом keep-alive соединений на весь процесс.
+    - Таймаут на каждый вызов и ограниченное число повторов с экспоненциальной задержкой.
+    - Идемпотентность по order_id (reference счета): перед отправкой заказ отмечается
+      в таблице monobank_invoices, созданный счет сохраняется там же. Повторный
+      вызов, в том числе после перезапуска, возвращает сохраненный счет; параллельные
+      вызовы в процессе ждут один запрос. Если результат отправки неизвестен (таймаут
+      чтения, обрыв соединения), счет повторно не запрашивается.
+    """
+
+    def __init__(self, token: str = MONOBANK_API_TOKEN, base_url: str = MONOBANK_API_URL,
+                 timeout: float = MONO_REQUEST_TIMEOUT_SECONDS, max_retries: int = MONO_MAX_RETRIES,
+                 max_connections: int = MONO_MAX_CONNECTIONS, backoff: float = MONO_RETRY_BACKOFF_SECONDS,
+                 pool=db_pool):
+        self.token = token
+        self.base_url = base_url
+        self.timeout = timeout
+        self.max_retries = max_retries
+        self.max_connections = max_connections
+        self.backoff = backoff
+        self.pool = pool
+        self._client = None
+        self._inflight = {}
+
+    def _get_client(self) -> httpx.AsyncClient:
+        if self._client is None:
+            self._client = httpx.AsyncClient(
+                base_url=self.base_url,
+                timeout=self.timeout,
+                headers={"X-Token": self.token.strip()},
+                limits=httpx.Limits(max_connections=self.max_connections,
+                                    max_keepalive_connections=self.max_connections),
+            )
+        return self._client
+
+    async def aclose(self):
+        if self._client is not None:
+            await self._client.aclose()
+            self._client = None
+
+    async def create_invoice(self, order_id: str, amount: int, description: str, payment_type: str) -> dict | None:
+        """
+        Создает счет Monobank.
+        payment_type: 'debit' (оплата картой) или 'ib' (покупка частями).
+        Возвращает {"url": ..., "invoice_id": ...} или None при ошибке.
+        """
+        key = (order_id, payment_type)
+        task = self._inflight.get(key)
+        if task is None:
+            task = asyncio.ensure_future(self._create(order_id, amount, description, payment_type))
+            self._inflight[key] = task
+            task.add_done_callback(lambda _: self._inflight.pop(key, None))
+        return await asyncio.shield(task)
+
+    async def _create(self, order_id: str, amount: int, description: str, payment_type: str) -> dict | None:
+        try:
+            claimed = await self.pool.execute(
+                "INSERT OR IGNORE INTO monobank_invoices (reference, payment_type, state, updated_at) VALUES (?, ?, ?, ?)",
+                (order_id, payment_type, INVOICE_SENDING, time.time())
+            )
+            if not claimed.rowcount:
+                stored = await self.pool.fetchone(
+                    "SELECT state, invoice_id, page_url FROM monobank_invoices WHERE reference = ? AND payment_type = ?",
+                    (order_id, payment_type)
+                )
+                if stored and stored["state"] == INVOICE_CREATED:
+                    logger.info(f"Счет Monobank для заказа {order_id} уже создан, используем его повторно.")
+                    return {"url": stored["page_url"], "invoice_id": stored["invoice_id"]}
+                logger.error(f"Счет Monobank для заказа {order_id} уже запрашивался с неизвестным результатом "
+                             f"(состояние {stored['state'] if stored else None}), повторный запрос не отправляется.")
+                return None
+
+            state, result = await self._send(order_id, amount, description, payment_type)
+            if state == INVOICE_CREATED:
+                await self.pool.execute(
+                    "UPDATE monobank_invoices SET state = ?, invoice_id = ?, page_url = ?, updated_at = ? "
+                    "WHERE reference = ? AND payment_type = ?",
+                    (state, result["invoice_id"], result["url"], time.time(), order_id, payment_type)
+                )
+            elif state == INVOICE_UNKNOWN:
+                await self.pool.execute(
+                    "UPDATE monobank_invoices SET state = ?, updated_at = ? WHERE reference = ? AND payment_type = ?",
+                    (state, time.time(), order_id, payment_type)
+                )
+            else:
+                # Счет точно не создан: заказ можно запросить снова
+                await self.pool.execute(
+                    "DELETE FROM monobank_invoices WHERE reference = ? AND payment_type = ?", (order_id, payment_type)
+                )
+            return result
+        except Exception as e:
+            logger.error(f"Ошибка при создании счета Monobank для заказа {order_id}: {e!r}")
+            # Счет мог быть создан до ошибки: заказ не остается навсегда в состоянии sending
+            try:
+                await self.pool.execute(
+                    "UPDATE monobank_invoices SET state = ?, updated_at = ? "
+                    "WHERE reference = ? AND payment_type = ? AND state = ?",
+                    (INVOICE_UNKNOWN, time.time(), order_id, payment_type, INVOICE_SENDING)
+                )
+            except Exception as e:
+                logger.error(f"Не удалось отметить счет Monobank для заказа {order_id} как неизвестный: {e!r}")
+            return None
+
+    async def _send(self, order_id: str, amount: int, description: str, payment_type: str) -> tuple[str | None, dict | None]:
+        """
+        Отправляет запрос на создание счета с повторами.
+        Возвращает (INVOICE_CREATED, счет), (INVOICE_UNKNOWN, None), если запрос мог
+        дойти до Monobank без ответа, или (None, None), если счет не создан.
+        """
+        if not BOT_USERNAME or BOT_USERNAME == "YourBotUsername":
+            logger.warning("BOT_USERNAME не установлен в config.py. Ссылка возврата может быть некорректной.")
+            redirect_url = ""
+        else:
+            redirect_url = f'https://t.me/{BOT_USERNAME}'
+
+        invoice_details = {
+            "amount": amount,
+            "ccy": 980, # Код валюты UAH
+            "merchantPaymInfo": {
+                "reference": order_id,
+                "destination": description,
+                "basketOrder": [
+                    {
+                        "name": description[:127], 
+                        "qty": 1,
+                        "sum": amount,
+                        "code": str(order_id)
+                    }
+                ]
+            },
+            "redirectUrl": redirect_url,
+            "webHookUrl": f'{WEBHOOK_DOMAIN}/webhook/monobank',
+            "paymentType": payment_type,
+        }
+        # Для "Покупки Частями" требуется дополнительное поле
+        if payment_type == "ib":
+            invoice_details["merchantPaymInfo"]["paymentDetails"] = description
+
+        client = self._get_client()
+        for attempt in range(self.max_retries + 1):
+            if attempt:
+                delay = self.backoff * 2 ** (attempt - 1)
+                await asyncio.sleep(delay + random.uniform(0, delay / 2))
+            started = time.perf_counter()
+            try:
+                response = await client.post("/api/merchant/invoice/create", json=invoice_details)
+            except MONO_CONNECT_ERRORS as e:
+                EXTERNAL_LATENCY.observe(time.perf_counter() - started, "monobank", "invoice_create", "connect_error")
+                logger.warning(f"Не удалось подключиться к Monobank для заказа {order_id} (попытка {attempt + 1}): {e!r}")
+                continue
+            except httpx.TransportError as e:
+                EXTERNAL_LATENCY.observe(time.perf_counter() - started, "monobank", "invoice_create", "transport_error")
+                logger.error(f"Сетевая ошибка Monobank после отправки запроса для заказа {order_id}: {e!r}. "
+                             f"Счет мог быть создан, повтор не выполняется.")
+                return INVOICE_UNKNOWN, None
+            EXTERNAL_LATENCY.observe(time.perf_counter() - started, "monobank", "invoice_create", str(response.status_code))
+
+            if response.status_code in MONO_RETRY_STATUSES:
+                logger.warning(f"Monobank вернул {response.status_code} для заказа {order_id} (попытка {attempt + 1})")
+                continue
+            if response.status_code >= 500:
+                logger.error(f"Monobank вернул {response.status_code} для заказа {order_id}. "
+                             f"Счет мог быть создан, повтор не выполняется.")
+                return INVOICE_UNKNOWN, None
+
+            try:
+                data = response.json()
+            except json.JSONDecodeError:
+                data = None
+            if not isinstance(data, dict):
+                data = {"errText": response.text}
+
+            if response.is_error:
+                logger.error(f"Ошибка создания счета Monobank: HTTP {response.status_code}. Детали: {data}")
+                return None, None
+
+            if "pageUrl" in data:
+                return INVOICE_CREATED, {
+                    "url": data.get("pageUrl"),
+                    "invoice_id": data.get("invoiceId")
+                }
+            # Запрос принят, но ответ не разобран: счет мог быть создан
+            logger.error(f"Неожиданный ответ Monobank для заказа {order_id}: {data.get('errText')}")
+            return INVOICE_UNKNOWN, None
+
+        logger.error(f"Не удалось создать счет Monobank для заказа {order_id} после {self.max_retries + 1} попыток.")
+        return None, None
+
+
+mono_client = MonobankClient()
+
+
+async def generate_mono_card_invoice(order_id: str, amount: int, description: str) -> dict | None:
+    """
+    Создает счет для обычной оплаты картой Monobank (debit).
+    """
+    logger.info(f"Создание счета Monobank (Оплата картой) для заказа {order_id}")
+    return await mono_client.create_invoice(order_id, amount, description, "debit")
+
+async def generate_mono_parts_invoice(order_id: str, amount: int, description: str) -> dict | None:
+    """
+    Создает счет для "Покупки Частинами" Monobank (ib).
+    ВАЖНО: Для работы этого метода в боевом режиме требуется соответствующий эквайринг.
+    Тестовый токен может не поддерживать тип 'ib'.
+    """
+    logger.info(f"Создание счета Monobank (Покупка Частинами) для заказа {order_id}")
+    return await mono_client.create_invoice(order_id, amount, description, "ib")
@@ -0,0 +1,139 @@
+import logging
+import os
+import sqlite3
+import threading
+from collections import deque
+from typing import NamedTuple
+
+logger = logging.getLogger(__name__)
+
+DB_PROFILE = os.getenv("DB_PROFILE", "0") == "1"
+# Запросы дольше порога пишутся в лог с планом выполнения
+DB_SLOW_QUERY_MS = float(os.getenv("DB_SLOW_QUERY_MS", "100"))
+# Сколько последних замеров хранить на форму запроса для расчета p95
+PROFILE_SAMPLES = 512
+# Операторы, для которых имеет смысл EXPLAIN QUERY PLAN
+EXPLAINABLE = ("SELECT", "INSERT", "UPDATE", "DELETE", "REPLACE", "WITH")
+
+
+class StatementStats(NamedTuple):
+    """Строка отчета профилировщика (время в миллисекундах)."""
+    statement: str
+    count: int
+    total_ms: float
+    mean_ms: float
+    p95_ms: float
+    max_ms: float
+    slow: int
+    full_scan: bool
+    plan: tuple
+
+
+class _Entry:
+    __slots__ = ("count", "total", "max", "slow", "samples")
+
+    def __init__(self):
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+        self.slow = 0
+        self.samples = deque(maxlen=PROFILE_SAMPLES)
+
+
+def full_scans(plan) -> list[str]:
+    """Строки плана с перебором всей таблицы или всего индекса (SCAN; SEARCH - поиск по индексу)."""
+    return [detail for detail in plan if detail.startswith("SCAN ") and detail != "SCAN CONSTANT ROW"]
+
+
+class QueryProfiler:
+    """
+    Накопитель статистики по формам запросов; record() вызывается из потоков пула.
+    Для каждой формы один раз снимается EXPLAIN QUERY PLAN: полные сканы помечаются
+    в отчете, запросы дольше slow_query_ms пишутся в лог с планом.
+    Отчет выводит команда администратора /dbprofile [N | reset | on | off].
+    """
+
+    def __init__(self, enabled: bool = DB_PROFILE, slow_query_ms: float = DB_SLOW_QUERY_MS):
+        self.enabled = enabled
+        self.slow_query_ms = slow_query_ms
+        self._entries = {}
+        self._plans = {}
+        self._lock = threading.Lock()
+
+    def enable(self):
+        self.enabled = True
+
+    def disable(self):
+        self.enabled = False
+
+    def reset(self):
+        with self._lock:
+            self._entries.clear()
+            self._plans.clear()
+
+    def record(self, conn: sqlite3.Connection, label: str, query: str | None, params, seconds: float):
+        """Учитывает выполненную операцию; план снимается на том же соединении при первой встрече формы."""
+        with self._lock:
+            entry = self._entries.get(label)
+            if entry is None:
+                entry = self._entries[label] = _Entry()
+            entry.count += 1
+            entry.total += seconds
+            entry.samples.append(seconds)
+            if seconds > entry.max:
+                entry.max = seconds
+            slow = seconds * 1000 >= self.slow_query_ms
+            if slow:
+                entry.slow += 1
+            plan = self._plans.get(label)
+
+        if plan is None and query is not None:
+            plan = self._explain(conn, query, params)
+            with self._lock:
+                self._plans.setdefault(label, plan)
+            scans = full_scans(plan)
+            if scans:
+                logger.warning(f"Полный скан в запросе: {label} ({'; '.join(scans)})")
+        if slow:
+            plan_text = "\n".join(f"  {detail}" for detail in plan) if plan else "  (план недоступен)"
+            logger.warning(f"Медленный запрос {seconds * 1000:.1f} мс: {label}\n{plan_text}")
+
+    @staticmethod
+    def _explain(conn: sqlite3.Connection, query: str, params) -> tuple:
+        if not query.lstrip().upper().startswith(EXPLAINABLE):
+            return ()
+        try:
+            rows = conn.execute(f"EXPLAIN QUERY PLAN {query}", params).fetchall()
+        except sqlite3.Error as e:
+            return (f"EXPLAIN не выполнен: {e}",)
+        # Последний столбец строки плана - detail
+        return tuple(row[-1] for row in rows)
+
+    def report(self, top: int = 10, order_by: str = "total_ms") -> list[StatementStats]:
+        """Топ форм запросов по order_by (total_ms, p95_ms, max_ms, count, mean_ms)."""
+        with self._lock:
+            items = [(label, entry.count, entry.total, entry.max, entry.slow, sorted(entry.samples))
+                     for label, entry in self._entries.items()]
+            plans = dict(self._plans)
+        rows = []
+        for label, count, total, maximum, slow, samples in items:
+            p95 = samples[max(0, int(len(samples) * 0.95) - 1)] if samples else 0.0
+            plan = plans.get(label, ())
+            rows.append(StatementStats(label, count, round(total * 1000, 2), round(total * 1000 / count, 3),
+                                       round(p95 * 1000, 3), round(maximum * 1000, 3), slow,
+                                       bool(full_scans(plan)), plan))
+        rows.sort(key=lambda row: getattr(row, order_by), reverse=True)
+        return rows[:top]
+
+    def format_report(self, top: int = 10, order_by: str = "total_ms", width: int = 160) -> str:
+        rows = self.report(top, order_by)
+        if not rows:
+            return "Нет данных профилирования" + ("" if self.enabled else " (профилирование выключено)")
+        lines = []
+        for number, row in enumerate(rows, 1):
+            statement = row.statement if len(row.statement) <= width else row.statement[:width - 3] + "..."
+            scan = " [FULL SCAN]" if row.full_scan else ""
+            lines.append(f"{number}. {statement}{scan}\n"
+                         f"   n={row.count} total={row.total_ms} мс mean={row.mean_ms} p95={row.p95_ms} "
+                         f"max={row.max_ms} мс slow={row.slow}")
+        return "\n".join(lines)
@@ -0,0 +1,292 @@
+import bisect
+import heapq
+import itertools
+import logging
+import re
+import threading
+
+logger = logging.getLogger(__name__)
+
+_TOKEN_RE = re.compile(r"\w+", re.UNICODE)
+
+# Веса совпадений токена запроса с токеном названия
+WEIGHT_EXACT = 3
+WEIGHT_PREFIX = 2
+WEIGHT_FUZZY = 1
+
+# Ограничения, чтобы короткие запросы ("i") не разворачивались во весь словарь
+MAX_PREFIX_EXPANSIONS = 64
+MAX_FUZZY_CANDIDATES = 256
+
+
+def tokenize(text: str) -> list[str]:
+    return _TOKEN_RE.findall(text.lower())
+
+
+def trigrams(token: str) -> set[str]:
+    padded = f" {token} "
+    return {padded[i:i + 3] for i in range(len(padded) - 2)}
+
+
+def max_typos(token: str) -> int:
+    """Допустимое число опечаток в зависимости от длины токена."""
+    if len(token) <= 2:
+        return 0
+    if len(token) <= 5:
+        return 1
+    return 2
+
+
+def edit_distance(a: str, b: str, limit: int) -> int:
+    """
+    Расстояние Левенштейна с ранним выходом.
+    Возвращает limit + 1, если расстояние заведомо больше limit.
+    """
+    if abs(len(a) - len(b)) > limit:
+        return limit + 1
+    previous = list(range(len(b) + 1))
+    for i, ca in enumerate(a, 1):
+        current = [i]
+        row_min = i
+        for j, cb in enumerate(b, 1):
+            value = min(previous[j] + 1, current[j - 1] + 1, previous[j - 1] + (ca != cb))
+            current.append(value)
+            if value < row_min:
+                row_min = value
+        if row_min > limit:
+            return limit + 1
+        previous = current
+    return previous[-1]
+
+
+class SearchIndex:
+    """
+    Инвертированный индекс названий товаров с префиксным поиском и исправлением опечаток.
+
+    - токен -> id товаров (множество для проверки вхождения и список,
+      упорядоченный по статическому рангу названия, для раннего выхода);
+    - отсортированный словарь токенов для префиксного поиска через bisect;
+    - триграммы -> токены словаря для поиска кандидатов с опечатками,
+      которые затем проверяются расстоянием Левенштейна.
+
+    Индекс обновляется построчно вместе с кэшем каталога (см. attach).
+    """
+
+    def __init__(self):
+        self._lock = threading.RLock()
+        self._postings = {}
+        self._ordered = {}
+        self._vocabulary = []
+        self._gram_postings = {}
+        self._doc_tokens = {}
+        self._names = {}
+        self._rank = {}
+
+    def __len__(self) -> int:
+        return len(self._names)
+
+    # --- Построение индекса ---
+
+    @staticmethod
+    def _rank_key(product_id: int, name: str) -> int:
+        # При равной релевантности сначала показываются более новые товары
+        return -product_id
+
+    def _add_token(self, token: str):
+        bisect.insort(self._vocabulary, token)
+        for gram in trigrams(token):
+            self._gram_postings.setdefault(gram, set()).add(token)
+
+    def _drop_token(self, token: str):
+        index = bisect.bisect_left(self._vocabulary, token)
+        if index < len(self._vocabulary) and self._vocabulary[index] == token:
+            del self._vocabulary[index]
+        for gram in trigrams(token):
+            tokens = self._gram_postings.get(gram)
+            if tokens is not None:
+                tokens.discard(token)
+                if not tokens:
+                    del self._gram_postings[gram]
+
+    def add(self, product_id: int, name: str):
+        with self._lock:
+            if product_id in self._names:
+                self.remove(product_id)
+            tokens = tuple(set(tokenize(name)))
+            self._names[product_id] = name
+            self._rank[product_id] = self._rank_key(product_id, name)
+            self._doc_tokens[product_id] = tokens
+            for token in tokens:
+                ids = self._postings.get(token)
+                if ids is None:
+                    ids = self._postings[token] = set()
+                    self._ordered[token] = []
+                    self._add_token(token)
+                ids.add(product_id)
+                bisect.insort(self._ordered[token], product_id, key=self._rank.__getitem__)
+
+    def remove(self, product_id: int):
+        with self._lock:
+            if product_id not in self._names:
+                return
+            rank = self._rank[product_id]
+            for token in self._doc_tokens.pop(product_id, ()):
+                ids = self._postings.get(token)
+                if ids is None:
+                    continue
+                ids.discard(product_id)
+                ordered = self._ordered[token]
+                index = bisect.bisect_left(ordered, rank, key=self._rank.__getitem__)
+                if index < len(ordered) and ordered[index] == product_id:
+                    del ordered[index]
+                if not ids:
+                    del self._postings[token]
+                    del self._ordered[token]
+                    self._drop_token(token)
+            del self._names[product_id]
+            del self._rank[product_id]
+
+    def rebuild(self, items):
+        """Полностью перестраивает индекс из пар (id, name)."""
+        with self._lock:
+            self._postings = {}
+            self._doc_tokens = {}
+            self._names = {}
+            self._rank = {}
+            for product_id, name in items:
+                tokens = tuple(set(tokenize(name)))
+                self._names[product_id] = name
+                self._rank[product_id] = self._rank_key(product_id, name)
+                self._doc_tokens[product_id] = tokens
+                for token in tokens:
+                    self._postings.setdefault(token, set()).add(product_id)
+            rank = self._rank.__getitem__
+            self._ordered = {token: sorted(ids, key=rank) for token, ids in self._postings.items()}
+            self._vocabulary = sorted(self._postings)
+            self._gram_postings = {}
+            for token in self._vocabulary:
+                for gram in trigrams(token):
+                    self._gram_postings.setdefault(gram, set()).add(token)
+        logger.info(f"Поисковый индекс перестроен. Товаров: {len(self._names)}, токенов: {len(self._vocabulary)}")
+
+    def attach(self, catalog_cache):
+        """Подписывает индекс на дельты кэша каталога."""
+        def on_change(event, old, new):
+            if event == "reload":
+                self.rebuild((p.id, p.name) for p in catalog_cache.products())
+            elif event == "delete":
+                self.remove(old.id)
+            elif event in ("insert", "update") and (old is None or old.name != new.name):
+                self.add(new.id, new.name)
+        catalog_cache.subscribe(on_change)
+        self.rebuild((p.id, p.name) for p in catalog_cache.products())
+
+    # --- Поиск ---
+
+    def _expand(self, token: str) -> list[tuple[int, str]]:
+        """Находит токены словаря, подходящие под токен запроса, с весами совпадения (по убыванию веса)."""
+        matches = []
+        if token in self._postings:
+            matches.append((WEIGHT_EXACT, token))
+
+        start = bisect.bisect_left(self._vocabulary, token)
+        for candidate in self._vocabulary[start:start + MAX_PREFIX_EXPANSIONS + 1]:
+            if not candidate.startswith(token):
+                break
+            if candidate != token:
+                matches.append((WEIGHT_PREFIX, candidate))
+        if matches:
+            return matches
+
+        limit = max_typos(token)
+        if not limit:
+            return matches
+        grams = trigrams(token)
+        overlap = {}
+        for gram in grams:
+            for candidate in self._gram_postings.get(gram, ()):
+                overlap[candidate] = overlap.get(candidate, 0) + 1
+        # Каждая опечатка портит не более трех триграмм
+        required = max(1, len(grams) - 3 * limit)
+        candidates = sorted((c for c, n in overlap.items() if n >= required), key=overlap.get, reverse=True)
+        for candidate in candidates[:MAX_FUZZY_CANDIDATES]:
+            if edit_distance(token, candidate, limit) <= limit:
+                matches.append((WEIGHT_FUZZY, candidate))
+        return matches
+
+    def _token_weight(self, product_id: int, matches) -> int:
+        for weight, token in matches:
+            if product_id in self._postings[token]:
+                return weight
+        return 0
+
+    def _tier(self, matches, weight=None) -> set:
+        """Объединение postings токенов словаря с данным весом (или всех весов)."""
+        sets = [self._postings[token] for w, token in matches if weight is None or w == weight]
+        return sets[0] if len(sets) == 1 else set().union(*sets)
+
+    def _ranked(self, tokens):
+        """id товаров с любым из токенов в порядке ранга, без повторов."""
+        if len(tokens) == 1:
+            return iter(self._ordered[tokens[0]])
+        merged = heapq.merge(*(self._ordered[token] for token in tokens), key=self._rank.__getitem__)
+        # Повторы в слиянии идут подряд
+        return (product_id for product_id, _ in itertools.groupby(merged))
+
+    def search(self, query: str, limit: int = 30) -> list[tuple[int, str]]:
+        """
+        Возвращает до limit пар (id, name), отсортированных по релевантности.
+        Все найденные слова запроса должны присутствовать в названии; если
+        таких товаров нет, возвращаются товары, совпавшие хотя бы с частью слов.
+        """
+        with self._lock:
+            expanded = [m for m in (self._expand(t) for t in dict.fromkeys(tokenize(query))) if m]
+            if not expanded:
+                return []
+
+            # 1. Товары с лучшим совпадением по каждому слову. Самое редкое слово
+            # обходится в порядке ранга через цепочку filter() по множествам остальных
+            # слов (от самого избирательного): проверка идет в C и прекращается на
+            # limit-м совпадении, без построения полного пересечения.
+            top_sets = [self._tier(matches, matches[0][0]) for matches in expanded]
+            order = sorted(range(len(expanded)), key=lambda i: len(top_sets[i]))
+            driver = expanded[order[0]]
+            stream = self._ranked([token for w, token in driver if w == driver[0][0]])
+            for i in order[1:]:
+                stream = filter(top_sets[i].__contains__, stream)
+            hits = list(itertools.islice(stream, limit))
+            if len(hits) >= limit:
+                return [(product_id, self._names[product_id]) for product_id in hits]
+
+            # Поток исчерпан: hits - все товары с лучшим совпадением по каждому слову
+            best = set(hits)
+
+            # 2. Остальные товары, содержащие все слова запроса хотя бы через префикс или опечатку
+            ceiling = sum(matches[0][0] for matches in expanded)
+            scored = [(-ceiling, self._rank[product_id], product_id) for product_id in best]
+            matched = set.intersection(*(self._tier(matches) for matches in expanded)) - best
+            for product_id in matched:
+                score = sum(self._token_weight(product_id, matches) for matches in expanded)
+                scored.append((-score, self._rank[product_id], product_id))
+
+            # 3. Ничего не найдено по всем словам: товары, совпавшие с частью слов
+            if not scored:
+                scored = self._search_any(expanded, limit)
+
+            return [(product_id, self._names[product_id]) for _, _, product_id in heapq.nsmallest(limit, scored)]
+
+    def _search_any(self, expanded, limit: int) -> list[tuple]:
+        """
+        Запасной режим: товары, совпавшие хотя бы с одним словом запроса.
+        Рассматриваются только первые limit товаров каждого токена словаря,
+        чтобы стоимость не зависела от размера каталога.
+        """
+        candidates = set()
+        for matches in expanded:
+            for _, token in matches:
+                candidates.update(self._ordered[token][:limit])
+        scored = []
+        for product_id in candidates:
+            score = sum(self._token_weight(product_id, matches) for matches in expanded)
+            scored.append((-score, self._rank[product_id], product_id))
+        return scored
@@ -0,0 +1,38 @@
+import datetime
+from typing import NamedTuple
+
+
+class DailyStats(NamedTuple):
+    """Сводка за день или сумма за период из таблицы daily_stats (выручка в копейках)."""
+    signups: int = 0
+    orders: int = 0
+    paid_orders: int = 0
+    revenue: int = 0
+
+    def __add__(self, other: "DailyStats") -> "DailyStats":
+        return DailyStats(*(a + b for a, b in zip(self, other)))
+
+
+async def daily_rows(pool, start: datetime.date, end: datetime.date) -> dict:
+    """Сводки по дням в диапазоне [start, end]: {date: DailyStats}. Дни без событий отсутствуют."""
+    rows = await pool.fetchall(
+        "SELECT day, signups, orders, paid_orders, revenue FROM daily_stats WHERE day BETWEEN ? AND ?",
+        (start.isoformat(), end.isoformat())
+    )
+    return {datetime.date.fromisoformat(row["day"]): DailyStats(*row[1:]) for row in rows}
+
+
+async def totals(pool, start: datetime.date | None = None, end: datetime.date | None = None) -> DailyStats:
+    """Сумма сводок за период (границы включительно; None - без ограничения). Стоимость O(дней)."""
+    row = await pool.fetchone(
+        """SELECT COALESCE(SUM(signups), 0), COALESCE(SUM(orders), 0),
+                  COALESCE(SUM(paid_orders), 0), COALESCE(SUM(revenue), 0)
+           FROM daily_stats WHERE day >= COALESCE(?, '') AND day <= COALESCE(?, '9999-12-31')""",
+        (start.isoformat() if start else None, end.isoformat() if end else None)
+    )
+    return DailyStats(*row)
+
+
+def sum_since(rows: dict, since: datetime.date) -> DailyStats:
+    """Сумма строк daily_rows() начиная с даты since."""
+    return sum((stats for day, stats in rows.items() if day >= since), DailyStats())
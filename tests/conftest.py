@@ -0,0 +1,18 @@
+import os
+import sys
+
+import pytest
+
+# Модули бота лежат в корне репозитория
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import db
+
+
+@pytest.fixture
+def database(tmp_path, monkeypatch):
+    """Пустая БД со схемой и индексами init_db во временном каталоге."""
+    path = str(tmp_path / "bot_database.db")
+    monkeypatch.setattr(db, "DB_NAME", path)
+    db.init_db()
+    return path
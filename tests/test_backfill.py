@@ -0,0 +1,63 @@
+import json
+import sqlite3
+
+import pytest
+
+import backfill
+
+CHAT_ID = 1234567890
+SOURCE_CHANNEL_ID = f"-100{CHAT_ID}"
+
+
+def write_export(path, texts, chat_id=CHAT_ID):
+    messages = [{"id": 1, "type": "service", "action": "pin_message", "text": ""}]
+    messages += [{"id": index + 2, "type": "message", "text": text} for index, text in enumerate(texts)]
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump({"name": "Apple Store", "type": "public_channel", "id": chat_id, "messages": messages}, f,
+                  ensure_ascii=False)
+    return str(path)
+
+
+def products(database):
+    with sqlite3.connect(database) as conn:
+        return conn.execute("SELECT name, price, price_numeric, category_name FROM products ORDER BY name").fetchall()
+
+
+def test_export_chat_id_and_messages_are_read_separately(tmp_path):
+    path = write_export(tmp_path / "result.json", ["Iphone 13\nЦена: 800 $"])
+    assert backfill.export_chat_id(path) == CHAT_ID
+    # Маленький фрагмент чтения: объекты собираются из нескольких кусков файла
+    messages = list(backfill.iter_export_messages(path, chunk_size=16))
+    assert [message["type"] for message in messages] == ["service", "message"]
+    assert all(isinstance(message, dict) for message in messages)
+
+
+def test_older_post_does_not_overwrite_existing_product(database, tmp_path):
+    with sqlite3.connect(database) as conn:
+        conn.execute("INSERT INTO products (name, price, price_numeric, category_name) VALUES (?, ?, ?, ?)",
+                     ("Iphone 13 Pro", "30000 UAH", 3_000_000, "Iphone"))
+    path = write_export(tmp_path / "result.json", [
+        "Iphone 13 Pro\nЦена: 20 000 грн",
+        "MacBook Air M1\nЦена: 900 $",
+        "MacBook Air M1\nЦена: 700 $",
+    ])
+
+    result = backfill.run(path, 40.0, db_path=database, source_channel_id=SOURCE_CHANNEL_ID)
+
+    assert (result.messages, result.products) == (3, 1)
+    assert products(database) == [
+        ("Iphone 13 Pro", "30000 UAH", 3_000_000, "Iphone"),
+        # Из постов с одним названием берется первый, как при приеме постов канала
+        ("MacBook Air M1", "900 $", 3_600_000, "MacBook"),
+    ]
+
+
+def test_foreign_channel_export_requires_force(database, tmp_path):
+    path = write_export(tmp_path / "result.json", ["Iphone 13\nЦена: 800 $"], chat_id=42)
+
+    with pytest.raises(ValueError):
+        backfill.run(path, 40.0, db_path=database, source_channel_id=SOURCE_CHANNEL_ID)
+    assert products(database) == []
+
+    result = backfill.run(path, 40.0, db_path=database, source_channel_id=SOURCE_CHANNEL_ID, force=True)
+    assert result.products == 1
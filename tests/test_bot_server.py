@@ -0,0 +1,101 @@
+import asyncio
+import json
+from types import SimpleNamespace
+
+import httpx
+import tornado.httpserver
+import tornado.netutil
+
+import webhook_server
+from bot_server import TELEGRAM_WEBHOOK_PATH, UpdateIntake, make_app
+
+SECRET = "test-secret"
+
+
+class BlockingApplication:
+    """Заглушка telegram.ext.Application: process_update ждет release, обработанные апдейты сохраняются."""
+
+    def __init__(self):
+        self.bot = None
+        self.update_processor = SimpleNamespace(max_concurrent_updates=1)
+        self.release = asyncio.Event()
+        self.started = asyncio.Event()
+        self.processed = []
+
+    async def process_update(self, update):
+        self.started.set()
+        await self.release.wait()
+        self.processed.append(update.update_id)
+
+
+def run_with_app(scenario, maxsize=10):
+    """Запускает make_app на свободном порту и scenario(client, application) в одном event loop."""
+    async def main():
+        application = BlockingApplication()
+        intake = UpdateIntake(application, maxsize=maxsize)
+        intake.start()
+        server = tornado.httpserver.HTTPServer(make_app(intake, SECRET))
+        sockets = tornado.netutil.bind_sockets(0, "127.0.0.1")
+        server.add_sockets(sockets)
+        base_url = f"http://127.0.0.1:{sockets[0].getsockname()[1]}"
+        try:
+            async with httpx.AsyncClient(base_url=base_url) as client:
+                return await scenario(client, application)
+        finally:
+            application.release.set()
+            await intake.stop(timeout=5)
+            server.stop()
+    return asyncio.run(main())
+
+
+def post_update(client, update_id, secret=SECRET):
+    headers = {"X-Telegram-Bot-Api-Secret-Token": secret} if secret is not None else {}
+    return client.post(TELEGRAM_WEBHOOK_PATH, content=json.dumps({"update_id": update_id}), headers=headers)
+
+
+def test_update_with_wrong_secret_is_rejected():
+    async def scenario(client, application):
+        wrong = await post_update(client, 1, secret="other")
+        missing = await post_update(client, 2, secret=None)
+        ok = await post_update(client, 3)
+        application.release.set()
+        await asyncio.sleep(0.05)
+        return wrong.status_code, missing.status_code, ok.status_code, application.processed
+
+    assert run_with_app(scenario) == (403, 403, 200, [3])
+
+
+def test_malformed_update_is_rejected():
+    async def scenario(client, application):
+        headers = {"X-Telegram-Bot-Api-Secret-Token": SECRET}
+        not_json = await client.post(TELEGRAM_WEBHOOK_PATH, content="{", headers=headers)
+        not_object = await client.post(TELEGRAM_WEBHOOK_PATH, content="[1]", headers=headers)
+        return not_json.status_code, not_object.status_code
+
+    assert run_with_app(scenario) == (400, 400)
+
+
+def test_full_update_queue_answers_503():
+    async def scenario(client, application):
+        # Первый апдейт занимает единственный обработчик, второй заполняет очередь
+        responses = [await post_update(client, 1)]
+        await asyncio.wait_for(application.started.wait(), 5)
+        responses += [await post_update(client, update_id) for update_id in (2, 3)]
+        return [(response.status_code, response.headers.get("Retry-After")) for response in responses]
+
+    assert run_with_app(scenario, maxsize=1) == [
+        (200, None), (200, None), (503, str(webhook_server.RETRY_AFTER_SECONDS)),
+    ]
+
+
+def test_intake_drains_accepted_updates_on_stop():
+    async def scenario():
+        application = BlockingApplication()
+        intake = UpdateIntake(application, maxsize=5)
+        intake.start()
+        accepted = [intake.offer({"update_id": update_id}) for update_id in range(1, 4)]
+        application.release.set()
+        await intake.stop(timeout=5)
+        return accepted, application.processed, intake.qsize()
+
+    assert asyncio.run(scenario()) == ([True, True, True], [1, 2, 3], 0)
@@ -0,0 +1,126 @@
+import asyncio
+import sqlite3
+
+import pytest
+
+from catalog import CatalogCache, CurrencyRepricer, PriceIndex, Product
+from db import DatabasePool
+
+
+def product(product_id, category):
+    return Product(product_id, f"Товар {product_id}", None, None, 1000, None, None, None, category)
+
+
+def make_cache():
+    cache = CatalogCache()
+    cache.replace_all(["Iphone", "MacBook"], [product(i, "Iphone" if i % 2 else "MacBook") for i in range(1, 11)])
+    return cache
+
+
+def page_ids(page):
+    return [p.id for p in page.items]
+
+
+def test_pages_follow_id_order_after_category_move():
+    cache = make_cache()
+    # Товар 2 переносится в Iphone и оказывается в конце порядка добавления
+    cache.upsert(product(2, "Iphone"))
+    first = cache.page("Iphone", size=3)
+    assert page_ids(first) == [1, 2, 3]
+    second = cache.page("Iphone", after_id=first.next_anchor, size=3)
+    assert page_ids(second) == [5, 7, 9]
+    assert second.next_anchor is None
+    assert page_ids(cache.page("Iphone", before_id=second.prev_anchor, size=3)) == [1, 2, 3]
+    assert cache.neighbors(2) == (1, 3)
+    assert cache.neighbors(9) == (7, None)
+
+
+def test_pages_cover_category_once():
+    cache = make_cache()
+    cache.upsert(product(4, "Iphone"))
+    cache.upsert(product(12, "Iphone"))
+    seen = []
+    page = cache.page("Iphone", size=2)
+    while True:
+        seen.extend(page_ids(page))
+        if page.next_anchor is None:
+            break
+        page = cache.page("Iphone", after_id=page.next_anchor, size=2)
+    assert seen == [1, 3, 4, 5, 7, 9, 12]
+
+
+def usd_product(product_id, cents):
+    return Product(product_id, f"Товар {product_id}", None, None, None, None, None, None, "Iphone", cents, "USD")
+
+
+@pytest.mark.parametrize("usd_count", [2, 200])
+def test_reprice_updates_cache_and_price_index(usd_count):
+    # 2 из 400 товаров - построчное обновление индекса, 200 из 400 - пересборка одной сортировкой
+    uah = [product(i, "Iphone")._replace(price_numeric=i * 100, price_currency="UAH") for i in range(1, 401 - usd_count)]
+    usd = [usd_product(i, 1000 + i) for i in range(401 - usd_count, 401)]
+    cache = CatalogCache()
+    cache.replace_all(["Iphone"], uah + usd)
+    index = PriceIndex()
+    index.attach(cache)
+    repricer = CurrencyRepricer()
+    repricer.attach(cache)
+
+    for rate in (40.0, 41.5, 41.5):
+        changed = repricer.apply(rate)
+        expected = {p.id: int(p.price_amount * rate) for p in usd}
+        assert all(cache.get(product_id).price_numeric == price for product_id, price in expected.items())
+        assert index._keys == sorted((p.price_numeric, p.id) for p in cache.products() if p.price_numeric is not None)
+    # Повторный курс ничего не меняет
+    assert changed == 0
+
+
+def test_repriced_prices_are_persisted_for_db_filters(database):
+    with sqlite3.connect(database) as conn:
+        conn.executemany(
+            "INSERT INTO products (name, price_numeric, category_name, price_amount, price_currency) VALUES (?, ?, ?, ?, ?)",
+            [(f"Товар {i}", i * 400_000, "Iphone", i * 10_000, "USD" if i % 2 else "UAH") for i in range(1, 21)]
+        )
+    pool = DatabasePool(database, size=1)
+
+    async def scenario():
+        cache = CatalogCache()
+        index = PriceIndex()
+        index.attach(cache)
+        repricer = CurrencyRepricer(pool=pool)
+        repricer.attach(cache)
+        await cache.load(pool)
+        repricer.apply(42.0)
+        # Изменение товара после пересчета: его цену в БД пишет автор изменения
+        cache.upsert(cache.get(1)._replace(price_numeric=1))
+        written = await repricer.flush()
+        rows = await pool.fetchall(
+            "SELECT id FROM products WHERE price_numeric BETWEEN ? AND ? ORDER BY price_numeric, id",
+            (1_000_000, 6_000_000)
+        )
+        return written, [row["id"] for row in rows], index.range(1_000_000, 6_000_000)
+
+    try:
+        written, from_db, from_index = asyncio.run(scenario())
+    finally:
+        pool.close()
+    assert written == 9
+    assert from_db == from_index
+    with sqlite3.connect(database) as conn:
+        assert conn.execute("SELECT price_numeric FROM products WHERE id = 3").fetchone() == (int(30_000 * 42.0),)
+        assert conn.execute("SELECT price_numeric FROM products WHERE id = 1").fetchone() == (400_000,)
+
+
+def test_page_after_deleted_anchor():
+    cache = make_cache()
+    first = cache.page("Iphone", size=2)
+    assert page_ids(first) == [1, 3]
+    cache.delete(first.next_anchor)
+    # В категории страница продолжается с места удаленного якоря
+    assert page_ids(cache.page("Iphone", after_id=first.next_anchor, size=2)) == [5, 7]
+    assert page_ids(cache.page("Iphone", before_id=first.next_anchor, size=2)) == [1]
+
+    everything = cache.page(None, size=2)
+    assert page_ids(everything) == [1, 10]
+    cache.delete(everything.next_anchor)
+    # Во всем каталоге порядок по названиям: без якоря возвращается первая страница
+    assert page_ids(cache.page(None, after_id=everything.next_anchor, size=2)) == [1, 2]
@@ -0,0 +1,110 @@
+import asyncio
+import sqlite3
+import time
+
+import pytest
+
+import currency_converter
+from currency_converter import CACHE_KEY, CURRENCY_CACHE, RateService, StaticProvider
+from db import DatabasePool
+
+
+@pytest.fixture(autouse=True)
+def empty_cache():
+    CURRENCY_CACHE.clear()
+    yield
+    CURRENCY_CACHE.clear()
+
+
+def provider(rate, name):
+    static = StaticProvider(rate)
+    static.name = name
+    return static
+
+
+def test_providers_are_tried_in_order():
+    async def scenario():
+        service = RateService(providers=[provider(None, "first"), provider(41.5, "second"), provider(42.0, "third")])
+        try:
+            return await service.refresh()
+        finally:
+            await service.stop()
+
+    assert asyncio.run(scenario()) == 41.5
+    assert CURRENCY_CACHE[CACHE_KEY]["provider"] == "second"
+
+
+def test_refresh_without_rates_keeps_cache_empty():
+    async def scenario():
+        service = RateService(providers=[provider(None, "first"), provider(None, "second")])
+        try:
+            return await service.refresh()
+        finally:
+            await service.stop()
+
+    assert asyncio.run(scenario()) is None
+    assert CACHE_KEY not in CURRENCY_CACHE
+
+
+def test_stale_rate_is_served_while_refreshing():
+    CURRENCY_CACHE[CACHE_KEY] = {"rate": 40.0, "timestamp": time.time() - 7200, "provider": "old"}
+    changes = []
+
+    async def scenario():
+        service = RateService(providers=[provider(42.0, "fresh")], lifetime=3600)
+        service.subscribe(changes.append)
+        try:
+            stale = service.get_rate()
+            task = service._refresh_task
+            assert task is not None
+            await task
+            return stale, service.get_rate()
+        finally:
+            await service.stop()
+
+    stale, fresh = asyncio.run(scenario())
+    assert stale == 40.0
+    assert fresh == 42.0
+    assert changes == [42.0]
+
+
+def test_fresh_rate_does_not_trigger_refresh():
+    CURRENCY_CACHE[CACHE_KEY] = {"rate": 40.0, "timestamp": time.time(), "provider": "old"}
+
+    async def scenario():
+        service = RateService(providers=[provider(42.0, "fresh")], lifetime=3600)
+        return service.get_rate(), service._refresh_task
+
+    assert asyncio.run(scenario()) == (40.0, None)
+
+
+def test_persisted_rate_is_loaded_on_start(database):
+    with sqlite3.connect(database) as conn:
+        conn.execute("INSERT INTO currency_rates (pair, rate, provider, updated_at) VALUES (?, ?, ?, ?)",
+                     (CACHE_KEY, 41.25, "privatbank", time.time()))
+    pool = DatabasePool(database, size=1)
+
+    async def scenario():
+        # Провайдер без курса: значение может прийти только из БД
+        service = RateService(providers=[provider(None, "offline")], pool=pool)
+        changes = []
+        service.subscribe(changes.append)
+        await service.start()
+        try:
+            return service.get_rate(), changes
+        finally:
+            await service.stop()
+
+    try:
+        rate, changes = asyncio.run(scenario())
+    finally:
+        pool.close()
+    assert rate == 41.25
+    assert changes == [41.25]
+    assert CURRENCY_CACHE[CACHE_KEY]["provider"] == "privatbank"
+
+
+def test_get_usd_to_uah_rate_without_loop_or_rate():
+    assert currency_converter.get_usd_to_uah_rate() is None
+    # Вне event loop фоновое обновление не запускается
+    assert currency_converter.rate_service._refresh_task is None
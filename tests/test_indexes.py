@@ -0,0 +1,67 @@
+import re
+import sqlite3
+
+import pytest
+
+import db
+from catalog import PriceIndex, Product
+
+HOT_QUERIES = [
+    ("SELECT id, status FROM orders WHERE user_id = ?", (1,), "idx_orders_user_id"),
+    ("SELECT id, user_id FROM orders WHERE status = ?", ("pending",), "idx_orders_status"),
+    ("SELECT id, status FROM orders WHERE payment_invoice_id = ?", ("inv-1",), "idx_orders_payment_invoice_id"),
+    ("SELECT COUNT(*) FROM users WHERE join_date >= ?", ("2024-01-01",), "idx_users_join_date"),
+    ("SELECT id FROM products WHERE price_numeric BETWEEN ? AND ?", (1000, 5000), "idx_products_price_numeric"),
+]
+
+
+def product(product_id, price_numeric):
+    return Product(product_id, f"Товар {product_id}", None, None, price_numeric, None, None, None, "Iphone")
+
+
+@pytest.mark.parametrize("query, params, index", HOT_QUERIES, ids=[q[2] for q in HOT_QUERIES])
+def test_hot_query_uses_index(database, query, params, index):
+    plan = db.explain_query_plan(query, params, db_path=database)
+    # Для запросов только по столбцам индекса SQLite пишет USING COVERING INDEX
+    search = re.compile(rf"SEARCH \w+ USING (COVERING )?INDEX {index}\b")
+    assert any(search.match(line) for line in plan), plan
+    assert not any(line.startswith("SCAN") for line in plan), plan
+
+
+def test_sync_indexes_drops_stale_and_restores_missing(database):
+    with sqlite3.connect(database) as conn:
+        conn.execute("CREATE INDEX idx_orders_created_at ON orders (created_at)")
+        conn.execute("DROP INDEX idx_orders_status")
+        db.sync_indexes(conn.cursor())
+        names = {row[0] for row in conn.execute(
+            "SELECT name FROM sqlite_master WHERE type = 'index' AND name LIKE 'idx_%'"
+        )}
+    assert names == set(db.INDEXES)
+
+
+def test_price_range_bounds_are_inclusive():
+    index = PriceIndex()
+    index.rebuild([product(1, 100), product(2, 200), product(3, 300), product(4, None)])
+    assert index.range(100, 300) == [1, 2, 3]
+    assert index.range(200, 200) == [2]
+    assert index.range(101, 299) == [2]
+    assert index.range(None, 200) == [1, 2]
+    assert index.range(200, None) == [2, 3]
+
+
+def test_price_range_empty():
+    index = PriceIndex()
+    index.rebuild([product(1, 100), product(2, 300)])
+    assert index.range(150, 250) == []
+    assert index.range(400, 500) == []
+    assert index.range(300, 100) == []
+    assert PriceIndex().range(0, 1000) == []
+
+
+def test_equal_prices_are_ordered_by_id():
+    index = PriceIndex()
+    index.rebuild([product(5, 200), product(2, 200), product(9, 100)])
+    index.add(product(3, 200))
+    assert index.range(100, 200) == [9, 2, 3, 5]
+    index.remove(product(2, 200))
+    assert index.range(200, 200) == [3, 5]
@@ -0,0 +1,60 @@
+import random
+import re
+
+import pytest
+
+from benchmarks.datagen import MODELS, post_texts
+from ingest import CategoryMatcher
+
+
+def sequential_match(categories, text_lower):
+    """Прежняя проверка: категории по одной в порядке БД, первая найденная побеждает."""
+    for cat_name in categories:
+        if re.search(r'\b' + re.escape(cat_name.lower()) + r'\b', text_lower, re.UNICODE):
+            return cat_name
+    return None
+
+
+CATEGORIES = ["Iphone", "MacBook", "AirPods", "Apple Watch", "Apple Watch Ultra", "Iphone 15", "AirPods (2)",
+              "Чехлы", "iPad", "IPAD"]
+
+
+@pytest.mark.parametrize("text", [
+    "",
+    "продам macbook air m1",
+    # Несколько категорий: побеждает более ранняя в списке, а не первая в тексте
+    "macbook pro и iphone 13 в подарок",
+    "iphone 15 pro max",
+    "apple watch ultra 2",
+    "ремешок для apple watch ultra",
+    "airpods (2) новые",
+    "airpods (2)x",
+    "чехлы для iphone",
+    "новые чехлы",
+    "iphones и macbooks",
+    "ipad mini",
+    "ipad\niphone",
+    "xiphone без границы слова",
+])
+def test_matcher_equals_sequential_check(text):
+    assert CategoryMatcher(CATEGORIES).match(text) == sequential_match(CATEGORIES, text)
+
+
+@pytest.mark.parametrize("seed", range(5))
+def test_matcher_equals_sequential_check_for_any_category_order(seed):
+    rng = random.Random(seed)
+    categories = list(MODELS) + CATEGORIES
+    rng.shuffle(categories)
+    matcher = CategoryMatcher(categories)
+    for text in post_texts(200, seed):
+        text_lower = text.lower()
+        assert matcher.match(text_lower) == sequential_match(categories, text_lower)
+
+
+def test_rebuild_changes_priority():
+    matcher = CategoryMatcher(["Iphone", "MacBook"])
+    assert matcher.match("macbook и iphone") == "Iphone"
+    matcher.rebuild(["MacBook", "Iphone"])
+    assert matcher.match("macbook и iphone") == "MacBook"
+    matcher.rebuild([])
+    assert matcher.match("macbook и iphone") is None
@@ -0,0 +1,83 @@
+import socket
+import urllib.request
+
+import pytest
+
+import metrics
+from metrics import Counter, Gauge, Histogram, MetricsServer, Registry, statement_label
+
+
+def make_registry():
+    registry = Registry()
+    requests = registry.register(Counter("app_requests_total", "Запросы", ("path",)))
+    latency = registry.register(Histogram("app_latency_seconds", "Задержка", ("path",), buckets=(0.1, 1.0)))
+    registry.register(Gauge("app_queue_size", "Очередь", lambda: 3))
+    return registry, requests, latency
+
+
+def test_render_prometheus_text():
+    registry, requests, latency = make_registry()
+    requests.inc("/a")
+    requests.inc("/a", amount=2)
+    requests.inc('/b"\n')
+    latency.observe(0.05, "/a")
+    latency.observe(0.1, "/a")
+    latency.observe(2.5, "/a")
+
+    assert registry.render() == "\n".join([
+        "# HELP app_requests_total Запросы",
+        "# TYPE app_requests_total counter",
+        'app_requests_total{path="/a"} 3',
+        'app_requests_total{path="/b\\"\\n"} 1',
+        "# HELP app_latency_seconds Задержка",
+        "# TYPE app_latency_seconds histogram",
+        # Граница корзины включительная, значения накопительные
+        'app_latency_seconds_bucket{path="/a",le="0.1"} 2',
+        'app_latency_seconds_bucket{path="/a",le="1"} 2',
+        'app_latency_seconds_bucket{path="/a",le="+Inf"} 3',
+        'app_latency_seconds_sum{path="/a"} 2.65',
+        'app_latency_seconds_count{path="/a"} 3',
+        "# HELP app_queue_size Очередь",
+        "# TYPE app_queue_size gauge",
+        "app_queue_size 3",
+    ]) + "\n"
+    assert latency.count("/a") == 3
+
+
+def test_failing_gauge_is_skipped_and_duplicates_rejected():
+    registry = Registry()
+    registry.register(Gauge("broken", "Ошибка чтения", lambda: 1 / 0))
+    assert registry.render() == "# HELP broken Ошибка чтения\n# TYPE broken gauge\n"
+    with pytest.raises(ValueError):
+        registry.register(Counter("broken", "Повтор"))
+
+
+@pytest.mark.parametrize("query, label", [
+    ("SELECT *\n  FROM products\tWHERE id = ?", "SELECT * FROM products WHERE id = ?"),
+    ("SELECT id FROM users WHERE name = 'O''Brien' AND age > 30", "SELECT id FROM users WHERE name = ? AND age > ?"),
+    ("SELECT * FROM orders WHERE id IN (?, ?, ?)", "SELECT * FROM orders WHERE id IN (?...)"),
+    ("SELECT * FROM orders WHERE id IN (?,?)", "SELECT * FROM orders WHERE id IN (?...)"),
+    ("SELECT price_numeric FROM products LIMIT 10 OFFSET -2.5", "SELECT price_numeric FROM products LIMIT ? OFFSET ?"),
+    # Цифры внутри идентификаторов не заменяются
+    ("SELECT col1 FROM t2 WHERE x = ?", "SELECT col1 FROM t2 WHERE x = ?"),
+])
+def test_statement_label_normalizes_sql(query, label):
+    assert statement_label(query) == label
+
+
+def test_metrics_server_serves_registry():
+    registry, requests, _ = make_registry()
+    requests.inc("/a")
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        port = sock.getsockname()[1]
+    server = MetricsServer(port=port, host="127.0.0.1", metrics_registry=registry)
+    server.start()
+    try:
+        with urllib.request.urlopen(f"http://127.0.0.1:{port}/metrics", timeout=5) as response:
+            body = response.read().decode("utf-8")
+            content_type = response.headers["Content-Type"]
+    finally:
+        server.stop()
+    assert body == registry.render()
+    assert content_type == metrics.CONTENT_TYPE
@@ -0,0 +1,208 @@
+import asyncio
+import socket
+import sqlite3
+
+import pytest
+
+import metrics
+from db import DatabasePool
+from loadtest.fake_monobank import FakeMonobank
+from payment_gateways import INVOICE_CREATED, INVOICE_SENDING, INVOICE_UNKNOWN, MonobankClient
+
+
+@pytest.fixture
+def pool(database):
+    pool = DatabasePool(database, size=2)
+    yield pool
+    pool.close()
+
+
+def run_with_server(scenario, **server_options):
+    """Запускает FakeMonobank и scenario(server) в одном event loop."""
+    async def main():
+        server = FakeMonobank(**server_options)
+        await server.start()
+        try:
+            return await scenario(server)
+        finally:
+            await server.stop()
+    return asyncio.run(main())
+
+
+def make_client(base_url, pool, **options) -> MonobankClient:
+    options.setdefault("backoff", 0.01)
+    return MonobankClient(token="test", base_url=base_url, pool=pool, **options)
+
+
+def stored_states(pool) -> dict:
+    with sqlite3.connect(pool.db_path) as conn:
+        return dict(conn.execute("SELECT reference, state FROM monobank_invoices"))
+
+
+def test_reuses_pooled_connection(pool):
+    async def scenario(server):
+        client = make_client(server.base_url, pool)
+        try:
+            results = [await client.create_invoice(f"order-{i}", 1000, "Товар", "debit") for i in range(5)]
+        finally:
+            await client.aclose()
+        return server, results
+
+    server, results = run_with_server(scenario)
+    assert all(result and result["url"] for result in results)
+    assert len(server.requests) == 5
+    assert server.connections == 1
+
+
+@pytest.mark.parametrize("status", [503, 429])
+def test_retries_unavailable_and_rate_limit(pool, status):
+    async def scenario(server):
+        client = make_client(server.base_url, pool, max_retries=3)
+        try:
+            return server, await client.create_invoice("order-1", 1000, "Товар", "debit")
+        finally:
+            await client.aclose()
+
+    server, result = run_with_server(scenario, fail_first=2, fail_status=status)
+    assert result is not None and result["invoice_id"] in server.invoices
+    assert len(server.requests) == 3
+    assert stored_states(pool) == {"order-1": INVOICE_CREATED}
+
+
+def test_gives_up_after_max_retries(pool):
+    async def scenario(server):
+        client = make_client(server.base_url, pool, max_retries=2)
+        try:
+            return server, await client.create_invoice("order-1", 1000, "Товар", "debit")
+        finally:
+            await client.aclose()
+
+    server, result = run_with_server(scenario, fail_first=10)
+    assert result is None
+    assert len(server.requests) == 3
+    # Счет точно не создан, заказ можно запросить снова
+    assert stored_states(pool) == {}
+
+
+@pytest.mark.parametrize("status", [500, 502, 504])
+def test_ambiguous_server_error_is_not_retried(pool, status):
+    async def scenario(server):
+        client = make_client(server.base_url, pool, max_retries=3)
+        try:
+            first = await client.create_invoice("order-1", 1000, "Товар", "debit")
+            second = await client.create_invoice("order-1", 1000, "Товар", "debit")
+        finally:
+            await client.aclose()
+        return server, first, second
+
+    server, first, second = run_with_server(scenario, fail_first=1, fail_status=status)
+    assert first is None and second is None
+    # Счет мог быть создан: ни повтора, ни нового запроса для того же заказа
+    assert len(server.requests) == 1
+    assert stored_states(pool) == {"order-1": INVOICE_UNKNOWN}
+
+
+def test_client_error_is_not_retried(pool):
+    async def scenario(server):
+        client = make_client(server.base_url, pool)
+        try:
+            return server, await client.create_invoice("order-1", 0, "Товар", "debit")
+        finally:
+            await client.aclose()
+
+    server, result = run_with_server(scenario)
+    assert result is None
+    assert len(server.requests) == 1
+
+
+def test_concurrent_duplicates_create_one_invoice(pool):
+    async def scenario(server):
+        client = make_client(server.base_url, pool)
+        try:
+            results = await asyncio.gather(*(client.create_invoice("order-1", 1000, "Товар", "debit")
+                                             for _ in range(10)))
+        finally:
+            await client.aclose()
+        # Новый клиент (перезапуск бота) берет счет из БД
+        restarted = make_client(server.base_url, pool)
+        try:
+            results.append(await restarted.create_invoice("order-1", 1000, "Товар", "debit"))
+        finally:
+            await restarted.aclose()
+        return server, results
+
+    server, results = run_with_server(scenario, latency=0.05)
+    assert len(server.requests) == 1
+    assert results[0] is not None
+    assert all(result == results[0] for result in results)
+
+
+def test_read_timeout_is_not_resent(pool):
+    async def scenario(server):
+        client = make_client(server.base_url, pool, timeout=0.1)
+        try:
+            first = await client.create_invoice("order-1", 1000, "Товар", "debit")
+            second = await client.create_invoice("order-1", 1000, "Товар", "debit")
+        finally:
+            await client.aclose()
+        return server, first, second
+
+    server, first, second = run_with_server(scenario, latency=0.5)
+    assert first is None and second is None
+    # Запрос мог создать счет: второй не отправляется
+    assert len(server.requests) == 1
+    assert stored_states(pool) == {"order-1": INVOICE_UNKNOWN}
+
+
+def test_connect_error_is_retried(pool):
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        port = sock.getsockname()[1]
+
+    async def scenario():
+        client = make_client(f"http://127.0.0.1:{port}", pool, max_retries=2)
+        try:
+            return await client.create_invoice("order-1", 1000, "Товар", "debit")
+        finally:
+            await client.aclose()
+
+    attempts = metrics.EXTERNAL_LATENCY.count("monobank", "invoice_create", "connect_error")
+    assert asyncio.run(scenario()) is None
+    assert metrics.EXTERNAL_LATENCY.count("monobank", "invoice_create", "connect_error") - attempts == 3
+    assert stored_states(pool) == {}
+
+
+def test_unexpected_response_returns_none(pool):
+    async def scenario(server):
+        async def malformed(request):
+            server.requests.append(request)
+            return 200, ["not", "an", "invoice"]
+        server.route("POST", "/api/merchant/invoice/create", malformed)
+        client = make_client(server.base_url, pool)
+        try:
+            return server, await client.create_invoice("order-1", 1000, "Товар", "debit")
+        finally:
+            await client.aclose()
+
+    server, result = run_with_server(scenario)
+    assert result is None
+    assert len(server.requests) == 1
+    # Ответ 200 не разобран: счет мог быть создан
+    assert stored_states(pool) == {"order-1": INVOICE_UNKNOWN}
+
+
+def test_unexpected_error_does_not_leave_order_sending(pool):
+    async def scenario(server):
+        client = make_client(server.base_url, pool)
+
+        async def broken_send(*args):
+            assert stored_states(pool) == {"order-1": INVOICE_SENDING}
+            raise RuntimeError("boom")
+        client._send = broken_send
+        try:
+            return await client.create_invoice("order-1", 1000, "Товар", "debit")
+        finally:
+            await client.aclose()
+
+    assert run_with_server(scenario) is None
+    assert stored_states(pool) == {"order-1": INVOICE_UNKNOWN}
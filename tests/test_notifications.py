@@ -0,0 +1,117 @@
+import asyncio
+import datetime
+import time
+
+from telegram.error import BadRequest, RetryAfter
+
+from notifications import MAX_SEND_RETRIES, AdminNotifier, TokenBucket
+
+ADMINS = [101, 102]
+
+
+class RecordingBot:
+    """Заглушка telegram.Bot: сохраняет отправленные сообщения; первые failures вызовов - ошибка error."""
+
+    def __init__(self, failures: int = 0, error: Exception | None = None):
+        self.failures = failures
+        self.error = error
+        self.attempts = 0
+        self.sent = []
+
+    async def send_message(self, chat_id, text, **kwargs):
+        self.attempts += 1
+        if self.attempts <= self.failures:
+            raise self.error
+        self.sent.append((chat_id, text, time.monotonic()))
+
+
+def run_notifier(bot, notifications, **options):
+    """Запускает AdminNotifier, ставит уведомления и дожидается их через drain()."""
+    # Лимит на чат по умолчанию (1 в секунду) замедлил бы тесты, не проверяющие его
+    options.setdefault("per_chat_rate", 100)
+
+    async def scenario():
+        notifier = AdminNotifier(ADMINS, **options)
+        notifier.start(bot)
+        started = time.monotonic()
+        for text in notifications:
+            notifier.notify(text)
+        await notifier.drain()
+        return time.monotonic() - started
+    return asyncio.run(scenario())
+
+
+def test_token_bucket_limits_rate():
+    async def scenario():
+        bucket = TokenBucket(rate=20, capacity=1)
+        started = time.monotonic()
+        for _ in range(5):
+            await bucket.acquire()
+        return time.monotonic() - started
+
+    # Первый токен доступен сразу, остальные четыре - по одному за 1/20 с
+    assert 0.18 <= asyncio.run(scenario()) < 1.0
+
+
+def test_sends_are_throttled_per_chat_and_globally():
+    bot = RecordingBot()
+    elapsed = run_notifier(bot, [f"Событие {i}" for i in range(7)], threshold=10, per_chat_rate=20)
+    assert sorted((chat_id, text) for chat_id, text, _ in bot.sent) == sorted(
+        (chat_id, f"Событие {i}") for chat_id in ADMINS for i in range(7))
+    # Емкость bucket чата - 20 сообщений: лимит на чат не достигнут
+    assert elapsed < 0.5
+
+    bot = RecordingBot()
+    elapsed = run_notifier(bot, [f"Событие {i}" for i in range(3)], threshold=10, per_chat_rate=2)
+    # Третье сообщение в каждый чат ждет токен 0.5 с
+    assert len(bot.sent) == 6
+    assert 0.45 <= elapsed < 2
+
+    bot = RecordingBot()
+    elapsed = run_notifier(bot, [f"Событие {i}" for i in range(3)], threshold=10, global_rate=4)
+    # 6 отправок при общем лимите 4 в секунду и емкости 4: две последние ждут 0.25 с каждая
+    assert len(bot.sent) == 6
+    assert 0.45 <= elapsed < 2
+
+
+def test_burst_over_threshold_is_collapsed_into_digest():
+    bot = RecordingBot()
+    run_notifier(bot, [f"Заказ {i}\nподробности" for i in range(6)], threshold=2, window=0.2)
+
+    texts = [text for chat_id, text, _ in bot.sent if chat_id == ADMINS[0]]
+    assert texts[:2] == ["Заказ 0\nподробности", "Заказ 1\nподробности"]
+    assert len(texts) == 3
+    digest = texts[2]
+    assert "Сводка: 4 событий" in digest
+    assert all(f"• Заказ {i}" in digest for i in range(2, 6))
+    assert "подробности" not in digest
+
+
+def test_retry_after_is_respected():
+    bot = RecordingBot(failures=2, error=RetryAfter(datetime.timedelta(milliseconds=50)))
+    elapsed = run_notifier(bot, ["Оплата"], threshold=10)
+
+    assert bot.attempts == 2 + len(ADMINS)
+    assert elapsed >= 0.05
+    assert sorted(chat_id for chat_id, _, _ in bot.sent) == ADMINS
+
+
+def test_send_gives_up_after_retries_and_on_other_errors():
+    bot = RecordingBot(failures=100, error=RetryAfter(datetime.timedelta(milliseconds=1)))
+    run_notifier(bot, ["Оплата"], threshold=10)
+    assert bot.attempts == (MAX_SEND_RETRIES + 1) * len(ADMINS)
+    assert bot.sent == []
+
+    bot = RecordingBot(failures=100, error=BadRequest("Chat not found"))
+    run_notifier(bot, ["Оплата"], threshold=10)
+    assert bot.attempts == len(ADMINS)
+
+
+def test_drain_sends_pending_digest_without_waiting_for_window():
+    bot = RecordingBot()
+    elapsed = run_notifier(bot, ["Первое", "Второе", "Третье"], threshold=1, window=30)
+
+    texts = [text for chat_id, text, _ in bot.sent if chat_id == ADMINS[0]]
+    assert texts[0] == "Первое"
+    assert "Сводка: 2 событий" in texts[1]
+    assert elapsed < 5
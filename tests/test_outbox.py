@@ -0,0 +1,186 @@
+import asyncio
+import sqlite3
+import threading
+
+import pytest
+
+import outbox
+import webhook_server
+from db import DatabasePool
+from outbox import OUTBOX_BASE_BACKOFF_SECONDS, PaymentOutbox
+from webhook_server import PaymentEngine
+
+
+@pytest.fixture
+def pool(database):
+    pool = DatabasePool(database, size=2)
+    yield pool
+    pool.close()
+
+
+@pytest.fixture
+def journal(pool):
+    journal = PaymentOutbox(pool, db_path=pool.db_path, owner="first")
+    journal.start()
+    yield journal
+    journal.close()
+
+
+def events(pool) -> list:
+    with sqlite3.connect(pool.db_path) as conn:
+        return conn.execute("SELECT order_id, state, attempts, claimed_by FROM payment_events ORDER BY id").fetchall()
+
+
+def make_due(pool):
+    """Переносит время следующей попытки (или конец аренды) всех событий в прошлое."""
+    with sqlite3.connect(pool.db_path) as conn:
+        conn.execute("UPDATE payment_events SET next_attempt_at = 0")
+
+
+def test_concurrent_appends_are_committed_together(pool):
+    journal = PaymentOutbox(pool, db_path=pool.db_path, flush_interval=0.05)
+    commits = []
+    journal.on_append = lambda: commits.append(1)
+    journal.start()
+    barrier = threading.Barrier(20)
+    results = []
+
+    def append(number):
+        barrier.wait()
+        results.append(journal.append("Monobank", f"order-{number}", "success", "{}"))
+
+    threads = [threading.Thread(target=append, args=(number,)) for number in range(20)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    journal.close()
+
+    assert results == [True] * 20
+    assert len(events(pool)) == 20
+    # Одновременные события записаны меньшим числом транзакций
+    assert len(commits) < 20
+    assert journal.append("Monobank", "order-late", "success", "{}") is False
+
+
+def test_failed_event_is_retried_with_backoff(pool, journal):
+    assert journal.append("LiqPay", "order-1", "success", "{}")
+
+    async def scenario():
+        [event] = await journal.claim(10)
+        assert await journal.fail(event, RuntimeError("db locked")) is False
+        # Время повтора еще не наступило
+        not_due = await journal.claim(10)
+        due_in = await journal.next_due_in()
+        make_due(pool)
+        [retry] = await journal.claim(10)
+        assert await journal.complete(retry["id"]) is True
+        return not_due, due_in, retry["attempts"], await journal.backlog()
+
+    not_due, due_in, attempts, backlog = asyncio.run(scenario())
+    assert not_due == []
+    assert OUTBOX_BASE_BACKOFF_SECONDS - 1 < due_in <= OUTBOX_BASE_BACKOFF_SECONDS
+    assert attempts == 1
+    assert backlog == 0
+    assert events(pool) == [("order-1", "done", 2, "first")]
+
+
+def test_event_is_dead_lettered_after_max_attempts(pool, journal):
+    assert journal.append("Monobank", "order-1", "failure", "{}")
+
+    async def scenario():
+        results = []
+        for _ in range(journal.max_attempts):
+            make_due(pool)
+            [event] = await journal.claim(10)
+            results.append(await journal.fail(event, RuntimeError("boom")))
+        make_due(pool)
+        return results, await journal.claim(10)
+
+    results, after = asyncio.run(scenario())
+    assert results == [False] * (journal.max_attempts - 1) + [True]
+    assert after == []
+    assert events(pool) == [("order-1", "dead", journal.max_attempts, "first")]
+
+
+def test_live_lease_is_not_recovered_by_another_process(pool, journal):
+    other = PaymentOutbox(pool, db_path=pool.db_path, owner="second")
+    assert journal.append("Monobank", "order-1", "success", "{}")
+
+    async def scenario():
+        [event] = await journal.claim(10)
+        # Второй процесс стартует, пока первый обрабатывает событие
+        recovered = await other.recover()
+        stolen = await other.claim(10)
+        # Аренда истекла: первый процесс считается упавшим
+        make_due(pool)
+        [taken] = await other.claim(10)
+        late = await journal.complete(event["id"])
+        return recovered, stolen, taken["id"] == event["id"], late
+
+    assert asyncio.run(scenario()) == (0, [], True, False)
+    assert events(pool) == [("order-1", "processing", 2, "second")]
+
+
+def test_recover_requeues_expired_leases(pool, journal):
+    assert journal.append("Monobank", "order-1", "success", "{}")
+
+    async def scenario():
+        await journal.claim(10)
+        make_due(pool)
+        return await PaymentOutbox(pool, db_path=pool.db_path, owner="restarted").recover()
+
+    assert asyncio.run(scenario()) == 1
+    assert events(pool) == [("order-1", "pending", 1, None)]
+
+
+def test_engine_retries_failed_event(pool, monkeypatch):
+    monkeypatch.setattr(outbox, "OUTBOX_BASE_BACKOFF_SECONDS", 0)
+    calls = []
+
+    async def handler(event):
+        calls.append(event["order_id"])
+        if len(calls) == 1:
+            raise RuntimeError("temporary")
+
+    async def scenario():
+        engine = PaymentEngine(PaymentOutbox(pool, db_path=pool.db_path), handler, workers=1)
+        await engine.start_in_loop()
+        try:
+            assert await asyncio.to_thread(engine.record, "LiqPay", "order-1", "success", "{}")
+            for _ in range(100):
+                if engine.pending == 0:
+                    break
+                await asyncio.sleep(0.01)
+            return engine.pending
+        finally:
+            await engine.stop_in_loop()
+
+    assert asyncio.run(scenario()) == 0
+    assert calls == ["order-1", "order-1"]
+    assert [row[1] for row in events(pool)] == ["done"]
+
+
+def test_full_backlog_answers_503(pool, monkeypatch):
+    async def scenario():
+        release = asyncio.Event()
+
+        async def handler(event):
+            await release.wait()
+
+        engine = PaymentEngine(PaymentOutbox(pool, db_path=pool.db_path), handler, workers=1, queue_size=2)
+        monkeypatch.setattr(webhook_server, "engine", engine)
+        await engine.start_in_loop()
+        try:
+            accepted = [await asyncio.to_thread(webhook_server.accept_monobank,
+                                                {"reference": f"order-{number}", "status": "success"})
+                        for number in range(3)]
+        finally:
+            release.set()
+            await engine.stop_in_loop()
+        return accepted
+
+    first, second, third = asyncio.run(scenario())
+    assert first == second == ("OK", 200, {})
+    assert third == ("Busy", 503, {"Retry-After": str(webhook_server.RETRY_AFTER_SECONDS)})
+    assert len(events(pool)) == 2
@@ -0,0 +1,68 @@
+import asyncio
+import logging
+import sqlite3
+
+import pytest
+
+from db import DatabasePool
+from query_profiler import QueryProfiler, full_scans
+
+
+@pytest.fixture
+def pool(database):
+    pool = DatabasePool(database, size=1)
+    yield pool
+    pool.close()
+
+
+def test_full_scans_flags_only_table_and_index_scans():
+    plan = ("SEARCH orders USING INDEX idx_orders_user_id (user_id=?)", "SCAN products",
+            "SCAN CONSTANT ROW", "USE TEMP B-TREE FOR ORDER BY")
+    assert full_scans(plan) == ["SCAN products"]
+    assert full_scans(()) == []
+
+
+def test_profiler_reports_plans_and_full_scans(pool):
+    pool.profiler.enable()
+
+    async def scenario():
+        for user_id in range(3):
+            await pool.fetchall("SELECT id FROM orders WHERE user_id = ?", (user_id,))
+        await pool.fetchall("SELECT id FROM orders WHERE customer_city = ?", ("Київ",))
+
+    asyncio.run(scenario())
+    rows = {row.statement: row for row in pool.profiler.report(order_by="count")}
+
+    indexed = rows["SELECT id FROM orders WHERE user_id = ?"]
+    assert indexed.count == 3
+    assert not indexed.full_scan
+    assert any("idx_orders_user_id" in detail for detail in indexed.plan)
+    scan = rows["SELECT id FROM orders WHERE customer_city = ?"]
+    assert scan.count == 1
+    assert scan.full_scan
+    assert "[FULL SCAN]" in pool.profiler.format_report()
+
+    pool.profiler.reset()
+    assert pool.profiler.report() == []
+
+
+def test_slow_query_is_logged_with_plan(database, caplog):
+    profiler = QueryProfiler(enabled=True, slow_query_ms=0)
+    query = "SELECT name FROM products WHERE price_numeric > ?"
+    with sqlite3.connect(database) as conn, caplog.at_level(logging.WARNING, logger="query_profiler"):
+        profiler.record(conn, query, query, (100,), 0.002)
+        profiler.record(conn, "BEGIN", "BEGIN", (), 0.001)
+
+    [row] = [row for row in profiler.report() if row.statement == query]
+    assert row.slow == 1 and row.max_ms == 2.0
+    messages = [record.getMessage() for record in caplog.records]
+    assert any(message.startswith("Медленный запрос 2.0 мс") and "idx_products_price_numeric" in message
+               for message in messages)
+    # Для операторов без плана EXPLAIN не выполняется
+    assert any("BEGIN\n  (план недоступен)" in message for message in messages)
+
+
+def test_disabled_profiler_records_nothing(pool):
+    asyncio.run(pool.fetchall("SELECT id FROM orders"))
+    assert pool.profiler.report() == []
+    assert pool.profiler.format_report() == "Нет данных профилирования (профилирование выключено)"
@@ -0,0 +1,66 @@
+import asyncio
+import datetime
+import sqlite3
+
+import pytest
+
+import db
+import stats
+from db import DatabasePool
+
+
+@pytest.fixture
+def pool(database):
+    pool = DatabasePool(database, size=1)
+    yield pool
+    pool.close()
+
+
+def insert_rows(conn, users, orders):
+    conn.executemany("INSERT INTO users (user_id, username, join_date) VALUES (?, ?, ?)", users)
+    conn.executemany("INSERT INTO orders (id, user_id, product_id, amount, status, created_at) VALUES (?, ?, 1, ?, ?, ?)",
+                     orders)
+
+
+def baseline(conn) -> stats.DailyStats:
+    """Итоги прямыми запросами к users и orders, как до появления daily_stats."""
+    signups = conn.execute("SELECT COUNT(*) FROM users").fetchone()[0]
+    orders, paid, revenue = conn.execute(
+        "SELECT COUNT(*), COALESCE(SUM(status = 'paid'), 0), "
+        "COALESCE(SUM(CASE WHEN status = 'paid' THEN amount ELSE 0 END), 0) FROM orders"
+    ).fetchone()
+    return stats.DailyStats(signups, orders, paid, revenue)
+
+
+def test_backfill_and_triggers_match_direct_counts(pool):
+    with sqlite3.connect(pool.db_path) as conn:
+        # Данные, существовавшие до таблицы daily_stats, в том числе без дат
+        conn.execute("DROP TABLE daily_stats")
+        for name in ("signup", "order", "paid"):
+            conn.execute(f"DROP TRIGGER trg_daily_stats_{name}")
+        insert_rows(conn, [(1, "a", "2024-03-01T10:00:00"), (2, "b", "2024-03-02T23:59:59"), (3, "c", None)],
+                    [("o1", 1, 1000, "paid", "2024-03-01T11:00:00"), ("o2", 2, 2000, "pending", "2024-03-02T09:00:00"),
+                     ("o3", 3, 500, "paid", None)])
+    with sqlite3.connect(pool.db_path) as conn:
+        db.sync_daily_stats(conn)
+        backfilled = baseline(conn)
+
+    assert asyncio.run(stats.totals(pool)) == backfilled == stats.DailyStats(3, 3, 2, 1500)
+
+    today = datetime.date.today()
+    now = datetime.datetime.now().isoformat()
+    with sqlite3.connect(pool.db_path) as conn:
+        insert_rows(conn, [(4, "d", now)], [("o4", 4, 4000, "pending", now)])
+        conn.execute("UPDATE orders SET status = 'paid' WHERE id IN ('o2', 'o4')")
+        # Повторная отметка оплаты не учитывается дважды
+        conn.execute("UPDATE orders SET status = 'paid' WHERE id = 'o4'")
+        current = baseline(conn)
+
+    assert asyncio.run(stats.totals(pool)) == current == stats.DailyStats(4, 4, 4, 7500)
+    # Оплата учитывается днем оплаты, строки без даты - только в итогах за все время
+    assert asyncio.run(stats.totals(pool, today, today)) == stats.DailyStats(1, 1, 2, 6000)
+    assert asyncio.run(stats.totals(pool, datetime.date(2024, 3, 1))) == stats.DailyStats(3, 3, 3, 7000)
+    assert asyncio.run(stats.daily_rows(pool, datetime.date(2024, 3, 1), datetime.date(2024, 3, 2))) == {
+        datetime.date(2024, 3, 1): stats.DailyStats(1, 1, 1, 1000),
+        datetime.date(2024, 3, 2): stats.DailyStats(1, 1, 0, 0),
+    }
@@ -0,0 +1,118 @@
+import asyncio
+import sqlite3
+from types import SimpleNamespace
+
+import pytest
+
+from db import DatabasePool
+from users import LanguageStore, RegistrationBuffer, UserProfileCache
+
+
+@pytest.fixture
+def pool(database):
+    pool = DatabasePool(database, size=1)
+    yield pool
+    pool.close()
+
+
+def query(pool, sql, params=()):
+    with sqlite3.connect(pool.db_path) as conn:
+        return conn.execute(sql, params).fetchall()
+
+
+def tg_user(user_id, username=None, first_name=None):
+    return SimpleNamespace(id=user_id, username=username, first_name=first_name)
+
+
+def test_language_change_does_not_create_user_row(pool):
+    async def scenario():
+        languages = LanguageStore(pool)
+        languages.set(1, "ru")
+        await languages.flush()
+
+    asyncio.run(scenario())
+    assert query(pool, "SELECT user_id FROM users") == []
+    assert query(pool, "SELECT SUM(signups) FROM daily_stats") == [(None,)]
+
+
+def test_language_chosen_before_registration_is_saved_with_it(pool):
+    async def scenario():
+        languages = LanguageStore(pool)
+        registrations = RegistrationBuffer(pool, languages)
+        await registrations.load()
+        registrations.register(tg_user(1, "first", "First"))
+        # Язык сохраняется раньше, чем строка пользователя
+        languages.set(1, "ru")
+        await languages.flush()
+        await registrations.flush()
+        saved = query(pool, "SELECT language FROM users WHERE user_id = 1")
+        languages.set(1, "ua")
+        await languages.flush()
+        return saved, await LanguageStore(pool).load(1)
+
+    assert asyncio.run(scenario()) == ([("ru",)], "ua")
+    assert query(pool, "SELECT user_id, username, language FROM users") == [(1, "first", "ua")]
+    assert query(pool, "SELECT SUM(signups) FROM daily_stats") == [(1,)]
+
+
+def test_bloom_false_positive_is_checked_in_database(pool):
+    async def scenario():
+        registrations = RegistrationBuffer(pool)
+        registrations.register(tg_user(1, "known", "Known"))
+        await registrations.flush()
+        await registrations.load()
+        # Ложное срабатывание фильтра для нового пользователя 2
+        registrations._known.add(2)
+        assert registrations.register(tg_user(1, "known", "Known")) is False
+        assert registrations.register(tg_user(2, "new", "New")) is False
+        return await registrations.flush()
+
+    assert asyncio.run(scenario()) == 1
+    assert query(pool, "SELECT user_id, username FROM users ORDER BY user_id") == [(1, "known"), (2, "new")]
+    assert query(pool, "SELECT SUM(signups) FROM daily_stats") == [(2,)]
+
+
+def test_repeated_start_of_known_users_writes_nothing(pool):
+    async def scenario():
+        registrations = RegistrationBuffer(pool)
+        registrations.register(tg_user(1, "known", "Known"))
+        await registrations.flush()
+        for _ in range(3):
+            registrations.register(tg_user(1, "known", "Known"))
+        return await registrations.flush()
+
+    assert asyncio.run(scenario()) == 0
+    assert query(pool, "SELECT SUM(signups) FROM daily_stats") == [(1,)]
+
+
+class CountingPool:
+    """Обертка пула, считающая изменяющие запросы."""
+
+    def __init__(self, pool):
+        self.pool = pool
+        self.writes = 0
+
+    async def fetchone(self, query, params=()):
+        return await self.pool.fetchone(query, params)
+
+    async def execute(self, query, params=()):
+        self.writes += 1
+        return await self.pool.execute(query, params)
+
+
+def test_profile_observe_writes_only_changes(pool):
+    async def scenario():
+        registrations = RegistrationBuffer(pool)
+        registrations.register(tg_user(1, "known", "Known"))
+        await registrations.flush()
+        counting = CountingPool(pool)
+        profiles = UserProfileCache(counting, ttl=0)
+        # ttl=0: каждый вызов - промах кэша
+        await profiles.observe(tg_user(1, "known", "Known"))
+        await profiles.observe(tg_user(2, "stranger", "Stranger"))
+        unchanged = counting.writes
+        await profiles.observe(tg_user(1, "renamed", "Known"))
+        return unchanged, counting.writes
+
+    assert asyncio.run(scenario()) == (0, 1)
+    assert query(pool, "SELECT user_id, username FROM users") == [(1, "renamed")]
@@ -0,0 +1,388 @@
+import asyncio
+import datetime
+import hashlib
+import logging
+import math
+import threading
+import time
+from collections import OrderedDict
+from typing import NamedTuple
+
+from telegram.error import TelegramError
+
+logger = logging.getLogger(__name__)
+
+USER_CACHE_SIZE = 10000
+USER_CACHE_TTL_SECONDS = 3600
+
+
+class UserProfile(NamedTuple):
+    """Имя и username пользователя Telegram, достаточные для уведомлений."""
+    user_id: int
+    username: str | None
+    first_name: str | None
+
+    @property
+    def display_name(self) -> str:
+        if self.username:
+            return f"{self.first_name} (@{self.username})"
+        return self.first_name or f"ID: {self.user_id}"
+
+
+class UserProfileCache:
+    """
+    LRU-кэш профилей пользователей с TTL поверх таблицы users.
+
+    - observe() обновляет кэш из Update.effective_user, поэтому профиль активного
+      пользователя всегда свежий; таблица пишется, только если данные изменились
+      (при промахе кэша сначала читается сохраненная строка);
+    - get() читает из кэша, при промахе или истечении TTL - из таблицы users;
+    - display_name() обращается к bot.get_chat только для пользователей,
+      которых нет в БД.
+    """
+
+    def __init__(self, pool, capacity: int = USER_CACHE_SIZE, ttl: float = USER_CACHE_TTL_SECONDS):
+        self.pool = pool
+        self.capacity = capacity
+        self.ttl = ttl
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def _lookup(self, user_id: int) -> UserProfile | None:
+        with self._lock:
+            entry = self._entries.get(user_id)
+            if entry is None:
+                return None
+            profile, expires_at = entry
+            if expires_at < time.monotonic():
+                del self._entries[user_id]
+                return None
+            self._entries.move_to_end(user_id)
+            return profile
+
+    def put(self, profile: UserProfile):
+        with self._lock:
+            self._entries[profile.user_id] = (profile, time.monotonic() + self.ttl)
+            self._entries.move_to_end(profile.user_id)
+            while len(self._entries) > self.capacity:
+                self._entries.popitem(last=False)
+
+    async def observe(self, user):
+        """Обновляет профиль по данным telegram.User из входящего апдейта."""
+        profile = UserProfile(user.id, user.username, user.first_name)
+        cached = self._lookup(user.id)
+        self.put(profile)
+        if cached is None:
+            # Промах или истек TTL: сравниваем с БД, чтобы не открывать транзакцию записи зря
+            row = await self.pool.fetchone(
+                "SELECT user_id, username, first_name FROM users WHERE user_id = ?", (user.id,)
+            )
+            # Строки нет - пользователя создаст регистрация
+            if row is None:
+                return
+            cached = UserProfile(row["user_id"], row["username"], row["first_name"])
+        if cached == profile:
+            return
+        # Имя или username изменились
+        await self.pool.execute(
+            """UPDATE users SET username = ?, first_name = ?
+               WHERE user_id = ? AND (username IS NOT ? OR first_name IS NOT ?)""",
+            (profile.username, profile.first_name, profile.user_id, profile.username, profile.first_name)
+        )
+
+    async def get(self, user_id: int) -> UserProfile | None:
+        profile = self._lookup(user_id)
+        if profile is not None:
+            return profile
+        row = await self.pool.fetchone("SELECT user_id, username, first_name FROM users WHERE user_id = ?", (user_id,))
+        if row is None:
+            return None
+        profile = UserProfile(row["user_id"], row["username"], row["first_name"])
+        self.put(profile)
+        return profile
+
+    async def display_name(self, user_id: int, bot=None) -> str:
+        """
+        Строка вида "first_name (@username)" для уведомлений.
+        Для неизвестных пользователей при наличии bot выполняется get_chat.
+        """
+        profile = await self.get(user_id)
+        if profile is None and bot is not None:
+            try:
+                chat = await bot.get_chat(user_id)
+                profile = UserProfile(user_id, chat.username, chat.first_name)
+                self.put(profile)
+            except TelegramError as e:
+                logger.warning(f"Не удалось получить информацию о пользователе {user_id}: {e}")
+        return profile.display_name if profile is not None else f"ID: {user_id}"
+
+
+LANGUAGE_CACHE_SIZE = 100_000
+LANGUAGE_FLUSH_INTERVAL_SECONDS = 1.0
+DEFAULT_LANGUAGE = "ua"
+
+
+class LanguageStore:
+    """
+    Язык интерфейса пользователей: столбец users.language и ограниченный LRU перед ним.
+
+    - get() - O(1) чтение из памяти, без обращения к БД (безопасно из get_text);
+    - load() лениво подгружает язык при промахе; вызывается до обработчиков
+      апдейта, поэтому для активного пользователя get() всегда попадает в кэш;
+    - set() меняет язык в памяти сразу, а в БД изменения пишутся пакетом
+      (один executemany раз в flush_interval) и при остановке.
+    Память ограничена capacity записями независимо от числа пользователей.
+    """
+
+    def __init__(self, pool, capacity: int = LANGUAGE_CACHE_SIZE, default: str = DEFAULT_LANGUAGE,
+                 flush_interval: float = LANGUAGE_FLUSH_INTERVAL_SECONDS):
+        self.pool = pool
+        self.capacity = capacity
+        self.default = default
+        self.flush_interval = flush_interval
+        self._entries = OrderedDict()
+        self._dirty = {}
+        self._lock = threading.Lock()
+        self._flush_task = None
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def _put(self, user_id: int, lang: str):
+        self._entries[user_id] = lang
+        self._entries.move_to_end(user_id)
+        while len(self._entries) > self.capacity:
+            # Вытесненное несохраненное значение остается в _dirty до ближайшей записи
+            self._entries.popitem(last=False)
+
+    def get(self, user_id) -> str:
+        lang = self._entries.get(user_id)
+        if lang is None:
+            return self._dirty.get(user_id, self.default)
+        with self._lock:
+            if user_id in self._entries:
+                self._entries.move_to_end(user_id)
+        return lang
+
+    async def load(self, user_id: int) -> str:
+        """Загружает язык пользователя из БД, если его нет в кэше."""
+        lang = self._entries.get(user_id)
+        if lang is not None:
+            return lang
+        row = await self.pool.fetchone("SELECT language FROM users WHERE user_id = ?", (user_id,))
+        with self._lock:
+            # Пока шел запрос, язык мог быть изменен через set()
+            if user_id not in self._entries:
+                lang = self._dirty.get(user_id) or (row["language"] if row else None) or self.default
+                self._put(user_id, lang)
+            return self._entries[user_id]
+
+    def set(self, user_id: int, lang: str):
+        with self._lock:
+            self._put(user_id, lang)
+            self._dirty[user_id] = lang
+
+    async def flush(self) -> int:
+        """Записывает накопленные изменения одной транзакцией. Возвращает число записей."""
+        with self._lock:
+            batch, self._dirty = self._dirty, {}
+        if not batch:
+            return 0
+        try:
+            # Строки пользователей создает только RegistrationBuffer; язык еще не
+            # записанного пользователя попадет в БД вместе с его регистрацией
+            await self.pool.executemany(
+                "UPDATE users SET language = ? WHERE user_id = ?",
+                [(lang, user_id) for user_id, lang in batch.items()]
+            )
+        except Exception:
+            with self._lock:
+                # Более новые изменения, сделанные во время записи, не перезаписываем
+                for user_id, lang in batch.items():
+                    self._dirty.setdefault(user_id, lang)
+            raise
+        return len(batch)
+
+    async def _run(self):
+        while True:
+            await asyncio.sleep(self.flush_interval)
+            try:
+                await self.flush()
+            except Exception as e:
+                logger.error(f"Не удалось сохранить языки пользователей: {e}")
+
+    def start(self):
+        if self._flush_task is None:
+            self._flush_task = asyncio.get_running_loop().create_task(self._run())
+
+    async def stop(self):
+        if self._flush_task is not None:
+            self._flush_task.cancel()
+            try:
+                await self._flush_task
+            except asyncio.CancelledError:
+                pass
+            self._flush_task = None
+        await self.flush()
+
+
+REGISTRATION_FLUSH_INTERVAL_SECONDS = 1.0
+# Сколько id проверять одним запросом IN (...) (лимит параметров SQLite - 999 в старых версиях)
+EXISTENCE_CHECK_CHUNK = 500
+# Параметры фильтра Блума известных пользователей (~3.6 МБ на миллион пользователей)
+BLOOM_CAPACITY = 1_000_000
+BLOOM_ERROR_RATE = 1e-6
+
+
+class BloomFilter:
+    """Фильтр Блума для целочисленных ключей (двойное хеширование поверх blake2b)."""
+
+    def __init__(self, capacity: int = BLOOM_CAPACITY, error_rate: float = BLOOM_ERROR_RATE):
+        self.size = max(8, int(-capacity * math.log(error_rate) / math.log(2) ** 2))
+        self.hashes = max(1, round(self.size / capacity * math.log(2)))
+        self._bits = bytearray((self.size + 7) // 8)
+
+    def _positions(self, key: int) -> range:
+        digest = hashlib.blake2b(key.to_bytes(8, "little", signed=True), digest_size=16).digest()
+        h1 = int.from_bytes(digest[:8], "little") % self.size
+        h2 = int.from_bytes(digest[8:], "little") % self.size | 1
+        # Позиции h1 + i*h2 берутся по модулю размера при обращении
+        return range(h1, h1 + self.hashes * h2, h2)
+
+    def add(self, key: int):
+        bits, size = self._bits, self.size
+        for position in self._positions(key):
+            position %= size
+            bits[position >> 3] |= 1 << (position & 7)
+
+    def __contains__(self, key: int) -> bool:
+        bits, size = self._bits, self.size
+        for position in self._positions(key):
+            position %= size
+            if not bits[position >> 3] & (1 << (position & 7)):
+                return False
+        return True
+
+
+class RegistrationBuffer:
+    """
+    Отложенная запись новых пользователей (write-behind).
+
+    Повторный /start известного пользователя проверяется по фильтру Блума
+    и не обращается к БД в обработчике. Новые пользователи копятся в памяти
+    и пишутся одним executemany раз в flush_interval, а также при остановке.
+    Фильтр заполняется в фоне при старте; пока он не загружен, повторный
+    /start приводит лишь к лишнему (безвредному) upsert.
+    Фильтр может ложно счесть нового пользователя известным (вероятность
+    ~BLOOM_ERROR_RATE), поэтому пользователи, отсеянные фильтром, при flush
+    проверяются в БД одним запросом на пачку, и отсутствующие записываются
+    вместе с новыми.
+    """
+
+    def __init__(self, pool, languages: LanguageStore | None = None,
+                 flush_interval: float = REGISTRATION_FLUSH_INTERVAL_SECONDS,
+                 capacity: int = BLOOM_CAPACITY, error_rate: float = BLOOM_ERROR_RATE):
+        self.pool = pool
+        # Язык, выбранный до записи строки пользователя, сохраняется вместе с ней
+        self.languages = languages
+        self.flush_interval = flush_interval
+        self._known = BloomFilter(capacity, error_rate)
+        self._pending = {}
+        # Отсеянные фильтром пользователи, наличие которых в БД еще не проверено
+        self._unconfirmed = {}
+        self._lock = threading.Lock()
+        self._flush_task = None
+
+    async def load(self) -> int:
+        """Заполняет фильтр id уже зарегистрированных пользователей."""
+        def _load(conn):
+            count = 0
+            for (user_id,) in conn.execute("SELECT user_id FROM users"):
+                self._known.add(user_id)
+                count += 1
+            return count
+        count = await self.pool.with_connection(_load)
+        logger.info(f"Фильтр зарегистрированных пользователей загружен: {count}")
+        return count
+
+    def register(self, user) -> bool:
+        """Запоминает нового пользователя. Возвращает False, если фильтр считает его известным."""
+        row = (user.id, user.username, user.first_name, datetime.datetime.now().isoformat())
+        with self._lock:
+            if user.id in self._known:
+                self._unconfirmed[user.id] = row
+                return False
+            self._known.add(user.id)
+            self._pending[user.id] = row
+            return True
+
+    @staticmethod
+    def _existing(conn, user_ids: list) -> set:
+        found = set()
+        for start in range(0, len(user_ids), EXISTENCE_CHECK_CHUNK):
+            chunk = user_ids[start:start + EXISTENCE_CHECK_CHUNK]
+            placeholders = ", ".join("?" * len(chunk))
+            found.update(row[0] for row in conn.execute(
+                f"SELECT user_id FROM users WHERE user_id IN ({placeholders})", chunk
+            ))
+        return found
+
+    async def flush(self) -> int:
+        with self._lock:
+            batch, self._pending = self._pending, {}
+            unconfirmed, self._unconfirmed = self._unconfirmed, {}
+        language = self.languages.get if self.languages is not None else lambda user_id: None
+        try:
+            unconfirmed = {user_id: row for user_id, row in unconfirmed.items() if user_id not in batch}
+            if unconfirmed:
+                existing = await self.pool.with_connection(self._existing, list(unconfirmed))
+                missing = {user_id: row for user_id, row in unconfirmed.items() if user_id not in existing}
+                if missing:
+                    logger.warning(f"Ложные срабатывания фильтра пользователей: {len(missing)}, записываем их.")
+                    batch.update(missing)
+            if not batch:
+                return 0
+            await self.pool.executemany(
+                """INSERT INTO users (user_id, username, first_name, join_date, language) VALUES (?, ?, ?, ?, ?)
+                   ON CONFLICT(user_id) DO UPDATE SET username = excluded.username, first_name = excluded.first_name""",
+                [(*row, language(user_id)) for user_id, row in batch.items()]
+            )
+        except Exception:
+            with self._lock:
+                for user_id, row in batch.items():
+                    self._pending.setdefault(user_id, row)
+                for user_id, row in unconfirmed.items():
+                    if user_id not in batch:
+                        self._unconfirmed.setdefault(user_id, row)
+            raise
+        logger.info(f"Зарегистрировано новых пользователей: {len(batch)}")
+        return len(batch)
+
+    async def _run(self):
+        try:
+            await self.load()
+        except Exception as e:
+            logger.error(f"Не удалось загрузить зарегистрированных пользователей: {e}")
+        while True:
+            await asyncio.sleep(self.flush_interval)
+            try:
+                await self.flush()
+            except Exception as e:
+                logger.error(f"Не удалось сохранить новых пользователей: {e}")
+
+    def start(self):
+        if self._flush_task is None:
+            self._flush_task = asyncio.get_running_loop().create_task(self._run())
+
+    async def stop(self):
+        if self._flush_task is not None:
+            self._flush_task.cancel()
+            try:
+                await self._flush_task
+            except asyncio.CancelledError:
+                pass
+            self._flush_task = None
+        await self.flush()
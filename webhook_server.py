@@ -4,10 +4,11 @@ import logging
 import json
 import base64
 import hashlib
-import sqlite3
 import asyncio
-import threading  # <-- Добавлен импорт
-from flask import Flask, request, abort
+import atexit
+import threading
+import time
+from flask import Flask, request, g
 from telegram import Bot
 from telegram.error import TelegramError
 from dotenv import load_dotenv
@@ -24,6 +25,12 @@ except ImportError:
     print("Убедитесь, что файл config.py существует и содержит BOT_TOKEN, ADMIN_IDS, LIQPAY_PRIVATE_KEY.")
     sys.exit(1)
 
+from db import pool
+from outbox import PaymentOutbox
+from notifications import AdminNotifier
+from users import UserProfileCache
+import metrics
+
 logging.basicConfig(
     level=logging.INFO,
     format='%(asctime)s - %(name)s - %(levelname)s - %(message)s'
@@ -32,116 +39,301 @@ logger = logging.getLogger(__name__)
 
 app = Flask(__name__)
 bot = Bot(token=BOT_TOKEN)
-
-# --- НОВАЯ ФУНКЦИЯ ДЛЯ ЗАПУСКА ASYNC ЗАДАЧ В ФОНОВОМ ПОТОКЕ ---
-def run_async_in_thread(target, *args):
+admin_notifier = AdminNotifier(ADMIN_IDS)
+user_profiles = UserProfileCache(pool)
+
+# Параметры движка обработки платежей
+PAYMENT_WORKERS = int(os.getenv("PAYMENT_WORKERS", "4"))
+# Сколько необработанных событий допускается в журнале, прежде чем вебхуки начнут получать 503
+PAYMENT_QUEUE_SIZE = int(os.getenv("PAYMENT_QUEUE_SIZE", "1000"))
+PAYMENT_DRAIN_TIMEOUT_SECONDS = float(os.getenv("PAYMENT_DRAIN_TIMEOUT_SECONDS", "30"))
+# Как часто журнал проверяется на события с наступившим временем повтора, если новых нет
+OUTBOX_POLL_INTERVAL_SECONDS = 5
+# Через сколько секунд провайдеру стоит повторить вебхук, если очередь переполнена
+RETRY_AFTER_SECONDS = 5
+
+# --- ДВИЖОК ФОНОВОЙ ОБРАБОТКИ ПЛАТЕЖЕЙ ---
+class PaymentEngine:
     """
-    Безопасно запускает асинхронную функцию в новом потоке,
-    чтобы не блокировать основной поток Flask.
+    Долгоживущий event loop в отдельном потоке, который разбирает журнал
+    платежных событий (см. outbox.PaymentOutbox) фиксированным числом воркеров.
+
+    Flask-обработчики только записывают событие в журнал через record():
+    вебхук подтверждается после фиксации на диске, поэтому событие не теряется
+    при падении процесса. Неудачная обработка повторяется с экспоненциальной
+    задержкой. Если необработанных событий больше queue_size, record()
+    возвращает False, и вебхук отвечает 503.
+    Один экземпляр Bot и его HTTP-сессия живут все время работы движка.
+
+    Движок работает либо в собственном потоке (start/shutdown, отдельный
+    веб-сервер вебхуков), либо в event loop бота (start_in_loop/stop_in_loop,
+    webhook-режим бота, см. bot_server).
     """
-    try:
-        asyncio.run(target(*args))
-    except Exception as e:
-        logger.error(f"Ошибка в фоновом потоке при выполнении {target.__name__}: {e}")
+
+    def __init__(self, outbox: PaymentOutbox, handler, workers: int = PAYMENT_WORKERS,
+                 queue_size: int = PAYMENT_QUEUE_SIZE):
+        self.outbox = outbox
+        self.handler = handler
+        self.workers = workers
+        self.queue_size = queue_size
+        self.loop = None
+        self._queue = None
+        self._wake = None
+        self._backlog = 0
+        self._thread = None
+        self._ready = threading.Event()
+        self._lock = threading.Lock()
+        self._accepting = False
+
+    @property
+    def pending(self) -> int:
+        """Число событий в журнале, ожидающих обработки или повтора."""
+        return self._backlog
+
+    def _add_backlog(self, delta: int):
+        with self._lock:
+            self._backlog += delta
+
+    def start(self):
+        with self._lock:
+            if self._thread is not None:
+                # Движок уже запущен или запускается из другого потока
+                self._ready.wait()
+                return
+            self._thread = threading.Thread(target=self._run_loop, name="payment-engine", daemon=True)
+            self._thread.start()
+        self._ready.wait()
+        logger.info(f"Движок обработки платежей запущен: воркеров {self.workers}, "
+                    f"лимит журнала {self.queue_size}, ожидают обработки {self._backlog}")
+
+    def _run_loop(self):
+        self.loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(self.loop)
+        try:
+            self.loop.run_until_complete(bot.initialize())
+        except Exception as e:
+            logger.error(f"Не удалось инициализировать Bot, уведомления будут отправляться без initialize(): {e}")
+        admin_notifier.start(bot)
+        self.loop.run_until_complete(self._open())
+        self.loop.call_soon(self._ready.set)
+        self.loop.run_forever()
+        self.loop.close()
+
+    async def _open(self):
+        """Восстанавливает журнал и запускает диспетчер и воркеров в self.loop."""
+        # Небольшой буфер захваченных событий: остальные ждут в журнале
+        self._queue = asyncio.Queue(maxsize=self.workers)
+        self._wake = asyncio.Event()
+        try:
+            await self.outbox.recover()
+            self._backlog = await self.outbox.backlog()
+        except Exception as e:
+            logger.error(f"Не удалось восстановить журнал платежных событий: {e}")
+        self.outbox.on_append = lambda: self.loop.call_soon_threadsafe(self._wake.set)
+        self.outbox.start()
+        self._dispatcher = self.loop.create_task(self._dispatch())
+        self._worker_tasks = [self.loop.create_task(self._worker(i)) for i in range(self.workers)]
+        self._accepting = True
+
+    async def start_in_loop(self):
+        """
+        Запускает движок в текущем event loop без отдельного потока.
+        Bot и уведомления администраторам к этому моменту запущены вызывающим кодом.
+        """
+        with self._lock:
+            if self._thread is not None or self.loop is not None:
+                return
+            self.loop = asyncio.get_running_loop()
+        await self._open()
+        self._ready.set()
+        logger.info(f"Движок обработки платежей запущен в event loop бота: воркеров {self.workers}, "
+                    f"лимит журнала {self.queue_size}, ожидают обработки {self._backlog}")
+
+    async def stop_in_loop(self, timeout: float = PAYMENT_DRAIN_TIMEOUT_SECONDS):
+        """Парный к start_in_loop(): дожидается захваченных событий; Bot и уведомления не закрывает."""
+        with self._lock:
+            if self._thread is not None or not self._accepting:
+                return
+            self._accepting = False
+        logger.info(f"Остановка движка платежей, в журнале: {self.pending}")
+        # Писатель журнала останавливается в потоке: close() ждет завершения записи
+        await asyncio.to_thread(self.outbox.close)
+        try:
+            await asyncio.wait_for(self._stop_workers(), timeout)
+        except Exception as e:
+            logger.error(f"Не удалось дождаться обработки очереди платежей: {e!r}")
+
+    async def _dispatch(self):
+        """Забирает из журнала события, время обработки которых наступило, и раздает их воркерам."""
+        while True:
+            self._wake.clear()
+            try:
+                events = await self.outbox.claim(self.workers)
+                if not events:
+                    due_in = await self.outbox.next_due_in()
+            except Exception as e:
+                logger.error(f"Ошибка чтения журнала платежных событий: {e}")
+                events, due_in = [], None
+            for event in events:
+                await self._queue.put(event)
+            if events:
+                continue
+            timeout = OUTBOX_POLL_INTERVAL_SECONDS if due_in is None else min(due_in, OUTBOX_POLL_INTERVAL_SECONDS)
+            try:
+                await asyncio.wait_for(self._wake.wait(), timeout)
+            except asyncio.TimeoutError:
+                pass
+
+    async def _worker(self, number: int):
+        while True:
+            event = await self._queue.get()
+            if event is None:
+                self._queue.task_done()
+                return
+            started = time.perf_counter()
+            try:
+                try:
+                    # После конца аренды событие может забрать другой процесс
+                    await asyncio.wait_for(self.handler(event), self.outbox.lease_seconds)
+                except Exception as e:
+                    metrics.PAYMENT_EVENT_LATENCY.observe(time.perf_counter() - started, event["provider"], "error")
+                    if await self.outbox.fail(event, e):
+                        self._add_backlog(-1)
+                    # Диспетчер пересчитает время ближайшего повтора
+                    self._wake.set()
+                else:
+                    metrics.PAYMENT_EVENT_LATENCY.observe(time.perf_counter() - started, event["provider"], "ok")
+                    await self.outbox.complete(event["id"])
+                    self._add_backlog(-1)
+            except Exception as e:
+                # Событие останется в состоянии processing и будет обработано снова после конца аренды
+                logger.error(f"Воркер {number} не смог сохранить результат обработки события {event['id']}: {e}")
+            finally:
+                self._queue.task_done()
+
+    def record(self, provider: str, order_id: str, status: str, payload: str) -> bool:
+        """
+        Записывает событие в журнал из любого потока и возвращается после фиксации.
+        Возвращает False, если движок остановлен, журнал переполнен или запись не удалась.
+        """
+        if not self._accepting and self.loop is None:
+            self.start()
+        if not self._accepting or self._backlog >= self.queue_size:
+            return False
+        if not self.outbox.append(provider, order_id, status, payload):
+            return False
+        self._add_backlog(1)
+        return True
+
+    async def _stop_workers(self):
+        self._dispatcher.cancel()
+        await self._queue.join()
+        for _ in self._worker_tasks:
+            self._queue.put_nowait(None)
+        await asyncio.gather(*self._worker_tasks)
+
+    async def _drain(self):
+        await self._stop_workers()
+        await admin_notifier.drain()
+        await bot.shutdown()
+
+    def shutdown(self, timeout: float = PAYMENT_DRAIN_TIMEOUT_SECONDS):
+        """
+        Прекращает прием событий и дожидается обработки уже захваченных.
+        Остальные события остаются в журнале до следующего запуска.
+        """
+        with self._lock:
+            if self._thread is None or not self._accepting:
+                return
+            self._accepting = False
+        logger.info(f"Остановка движка платежей, в журнале: {self.pending}")
+        self.outbox.close()
+        future = asyncio.run_coroutine_threadsafe(self._drain(), self.loop)
+        try:
+            future.result(timeout)
+        except Exception as e:
+            logger.error(f"Не удалось дождаться обработки очереди платежей: {e!r}")
+        self.loop.call_soon_threadsafe(self.loop.stop)
+        self._thread.join(timeout)
+
+
+def busy_response():
+    logger.warning(f"Журнал платежных событий переполнен или недоступен ({engine.pending}). Просим провайдера повторить позже.")
+    return 'Busy', 503, {'Retry-After': str(RETRY_AFTER_SECONDS)}
 
 # --- РАБОТА С БАЗОЙ ДАННЫХ ---
 
 def get_db_connection():
-    """Безопасное подключение к базе данных SQLite."""
-    try:
-        db_path = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'bot_database.db')
-        conn = sqlite3.connect(db_path)
-        conn.row_factory = sqlite3.Row
-        return conn
-    except sqlite3.Error as e:
-        logger.error(f"Ошибка подключения к БД: {e}")
-        return None
+    """Возвращает общий пул долгоживущих соединений SQLite (см. db.DatabasePool)."""
+    return pool
 
-# --- ОСНОВНАЯ ЛОГИКА ОБРАБОТКИ ПЛАТЕЖЕЙ (без изменений) ---
+# --- ОСНОВНАЯ ЛОГИКА ОБРАБОТКИ ПЛАТЕЖЕЙ ---
+# Ошибки БД не перехватываются: событие остается в журнале и обрабатывается повторно.
+# Ошибки отправки уведомлений только логируются, чтобы повтор не дублировал сообщения.
 
 async def process_successful_payment(order_id: str, payment_system: str):
     """
     Обрабатывает УСПЕШНЫЙ платеж: обновляет заказ и рассылает уведомления.
     """
     logger.info(f"Начало обработки УСПЕШНОГО платежа для заказа {order_id} через {payment_system}")
-    conn = get_db_connection()
-    if not conn: return
+    db = get_db_connection()
 
-    try:
-        cursor = conn.cursor()
-        
-        cursor.execute(
-            """SELECT 
-                   o.user_id, o.status, p.name as product_name,
-                   o.customer_name, o.customer_phone, o.customer_city, o.customer_address
-               FROM orders o 
-               JOIN products p ON o.product_id = p.id 
-               WHERE o.id = ?""", (order_id,)
-        )
-        order_info = cursor.fetchone()
+    order_info = await db.fetchone(
+        """SELECT 
+               o.user_id, o.status, p.name as product_name,
+               o.customer_name, o.customer_phone, o.customer_city, o.customer_address
+           FROM orders o 
+           JOIN products p ON o.product_id = p.id 
+           WHERE o.id = ?""", (order_id,)
+    )
 
-        if not order_info:
-            logger.warning(f"Получен вебхук для несуществующего заказа: {order_id}")
-            return
+    if not order_info:
+        logger.warning(f"Получен вебхук для несуществующего заказа: {order_id}")
+        return
 
-        if order_info['status'] == 'paid':
-            logger.info(f"Заказ {order_id} уже был оплачен. Повторная обработка отменена.")
-            return
+    if order_info['status'] == 'paid':
+        logger.info(f"Заказ {order_id} уже был оплачен. Повторная обработка отменена.")
+        return
 
-        cursor.execute("UPDATE orders SET status = 'paid' WHERE id = ? AND status != 'paid'", (order_id,))
-        conn.commit()
-        
-        if cursor.rowcount == 0:
-            logger.warning(f"Не удалось обновить статус 'paid' для заказа {order_id}. Возможно, он уже был обработан (статус: {order_info['status']}).")
-            return
+    result = await db.execute("UPDATE orders SET status = 'paid' WHERE id = ? AND status != 'paid'", (order_id,))
 
-        logger.info(f"Статус заказа {order_id} успешно обновлен на 'paid'")
+    if result.rowcount == 0:
+        logger.warning(f"Не удалось обновить статус 'paid' для заказа {order_id}. Возможно, он уже был обработан (статус: {order_info['status']}).")
+        return
 
-        user_id = order_info['user_id']
-        product_name = order_info['product_name']
-        
-        try:
-            await bot.send_message(
-                chat_id=user_id,
-                text=f"✅ Оплата за товар «{product_name}» прошла успешно! Менеджер скоро с вами свяжется."
-            )
-        except TelegramError as e:
-            logger.error(f"Не удалось отправить уведомление пользователю {user_id}: {e}")
+    logger.info(f"Статус заказа {order_id} успешно обновлен на 'paid'")
 
-        user_info = f"ID: {user_id}"
-        try:
-            user = await bot.get_chat(user_id)
-            user_info = f"{user.first_name} (@{user.username})" if user.username else user.first_name
-        except TelegramError as e:
-            logger.warning(f"Не удалось получить информацию о пользователе {user_id}: {e}")
-        
-        customer_details = (
-            f"<b>Имя:</b> {order_info['customer_name']}\n"
-            f"<b>Телефон:</b> {order_info['customer_phone']}\n"
-            f"<b>Город:</b> {order_info['customer_city']}\n"
-            f"<b>Отделение НП:</b> {order_info['customer_address']}"
-        )
+    user_id = order_info['user_id']
+    product_name = order_info['product_name']
 
-        admin_text = (
-            f"✅ Новая УСПЕШНАЯ ОПЛАТА!\n\n"
-            f"<b>Товар:</b> {product_name}\n"
-            f"<b>Способ оплаты:</b> {payment_system}\n"
-            f"<b>Order ID:</b> {order_id}\n\n"
-            f"👤 <b>Покупатель:</b> {user_info}\n"
-            f"➖➖➖➖➖➖➖➖➖➖\n"
-            f"{customer_details}"
+    try:
+        await bot.send_message(
+            chat_id=user_id,
+            text=f"✅ Оплата за товар «{product_name}» прошла успешно! Менеджер скоро с вами свяжется."
         )
+    except TelegramError as e:
+        logger.error(f"Не удалось отправить уведомление пользователю {user_id}: {e}")
 
-        for admin_id in ADMIN_IDS:
-            try:
-                await bot.send_message(chat_id=admin_id, text=admin_text, parse_mode="HTML")
-            except Exception as e:
-                logger.error(f"Не удалось отправить уведомление админу {admin_id}: {e}")
+    user_info = await user_profiles.display_name(user_id, bot)
 
-    except Exception as e:
-        logger.error(f"Критическая ошибка при обработке успешного платежа для заказа {order_id}: {e}")
-    finally:
-        if conn: conn.close()
+    customer_details = (
+        f"<b>Имя:</b> {order_info['customer_name']}\n"
+        f"<b>Телефон:</b> {order_info['customer_phone']}\n"
+        f"<b>Город:</b> {order_info['customer_city']}\n"
+        f"<b>Отделение НП:</b> {order_info['customer_address']}"
+    )
+
+    admin_text = (
+        f"✅ Новая УСПЕШНАЯ ОПЛАТА!\n\n"
+        f"<b>Товар:</b> {product_name}\n"
+        f"<b>Способ оплаты:</b> {payment_system}\n"
+        f"<b>Order ID:</b> {order_id}\n\n"
+        f"👤 <b>Покупатель:</b> {user_info}\n"
+        f"➖➖➖➖➖➖➖➖➖➖\n"
+        f"{customer_details}"
+    )
+
+    admin_notifier.notify(admin_text, summary=f"Оплачен заказ {order_id}: {product_name} ({payment_system}), {user_info}")
 
 
 async def process_unsuccessful_payment(order_id: str, payment_system: str, status: str):
@@ -149,63 +341,98 @@ async def process_unsuccessful_payment(order_id: str, payment_system: str, statu
     Обрабатывает НЕУСПЕШНЫЙ платеж: логирует, обновляет статус и уведомляет админов.
     """
     logger.warning(f"Обработка НЕУСПЕШНОГО платежа для заказа {order_id} через {payment_system}. Статус: {status}")
-    conn = get_db_connection()
-    if not conn: return
+    db = get_db_connection()
+
+    order_info = await db.fetchone(
+        """SELECT o.user_id, o.status, p.name as product_name 
+           FROM orders o JOIN products p ON o.product_id = p.id 
+           WHERE o.id = ?""", (order_id,)
+    )
+
+    if not order_info or order_info['status'] == 'paid':
+        logger.info(f"Заказ {order_id} не найден или уже оплачен. Действий не требуется.")
+        return
+
+    await db.execute("UPDATE orders SET status = ? WHERE id = ? AND status != 'paid'", (status, order_id))
+    logger.info(f"Статус заказа {order_id} обновлен на '{status}'")
+
+    user_id = order_info['user_id']
+    product_name = order_info['product_name']
+    user_info = await user_profiles.display_name(user_id, bot)
+
+    admin_text = (
+        f"⚠️ Неуспешная попытка оплаты!\n\n"
+        f"<b>Товар:</b> {product_name}\n"
+        f"<b>Платежная система:</b> {payment_system}\n"
+        f"<b>Статус:</b> {status}\n"
+        f"<b>Пользователь:</b> {user_info}\n"
+        f"<b>Order ID:</b> {order_id}"
+    )
+    admin_notifier.notify(admin_text, summary=f"Сбой оплаты {order_id}: {product_name} ({payment_system}, {status})")
+
+
+async def handle_payment_event(event):
+    """Применяет событие из журнала платежей. Исключение означает, что событие нужно повторить."""
+    provider, order_id, status = event['provider'], event['order_id'], event['status']
+    if provider == 'LiqPay':
+        if status.lower() in ['success', 'sandbox']:
+            await process_successful_payment(order_id, provider)
+        else:
+            await process_unsuccessful_payment(order_id, provider, status)
+    elif provider == 'Monobank':
+        if status.lower() == 'success':
+            await process_successful_payment(order_id, provider)
+        elif status in ['created', 'processing']:
+            await get_db_connection().execute(
+                "UPDATE orders SET status = ? WHERE id = ? AND status = 'pending'", (status, order_id)
+            )
+        else:
+            await process_unsuccessful_payment(order_id, provider, status)
+    else:
+        logger.error(f"Неизвестный провайдер в журнале платежей: {provider} (событие {event['id']})")
 
-    try:
-        cursor = conn.cursor()
-        
-        cursor.execute(
-            """SELECT o.user_id, o.status, p.name as product_name 
-               FROM orders o JOIN products p ON o.product_id = p.id 
-               WHERE o.id = ?""", (order_id,)
-        )
-        order_info = cursor.fetchone()
-        
-        if not order_info or order_info['status'] == 'paid':
-            logger.info(f"Заказ {order_id} не найден или уже оплачен. Действий не требуется.")
-            return
 
-        cursor.execute("UPDATE orders SET status = ? WHERE id = ? AND status != 'paid'", (status, order_id))
-        conn.commit()
-        logger.info(f"Статус заказа {order_id} обновлен на '{status}'")
+engine = PaymentEngine(PaymentOutbox(pool), handle_payment_event)
+atexit.register(engine.shutdown)
+# Функция читает глобальный engine, чтобы учитывать его замену (например, в нагрузочном тесте)
+metrics.gauge("payment_backlog_events", "Событий в журнале платежей, ожидающих обработки", lambda: engine.pending)
 
-        user_id = order_info['user_id']
-        product_name = order_info['product_name']
-        user_info = f"ID: {user_id}"
-        try:
-            user = await bot.get_chat(user_id)
-            user_info = f"{user.first_name} (@{user.username})" if user.username else user.first_name
-        except TelegramError as e:
-             logger.warning(f"Не удалось получить информацию о пользователе {user_id} для отчета о сбое: {e}")
-
-        admin_text = (
-            f"⚠️ Неуспешная попытка оплаты!\n\n"
-            f"<b>Товар:</b> {product_name}\n"
-            f"<b>Платежная система:</b> {payment_system}\n"
-            f"<b>Статус:</b> {status}\n"
-            f"<b>Пользователь:</b> {user_info}\n"
-            f"<b>Order ID:</b> {order_id}"
-        )
-        for admin_id in ADMIN_IDS:
-            try:
-                await bot.send_message(chat_id=admin_id, text=admin_text, parse_mode="HTML")
-            except Exception as e:
-                logger.error(f"Не удалось отправить уведомление о сбое админу {admin_id}: {e}")
 
-    except Exception as e:
-        logger.error(f"Критическая ошибка при обработке неуспешного платежа для заказа {order_id}: {e}")
-    finally:
-        if conn: conn.close()
+# --- МЕТРИКИ ---
 
-# --- ЭНДПОИНТЫ (URL) ДЛЯ ПРИЕМА ВЕБХУКОВ ---
+@app.before_request
+def start_request_timer():
+    g.request_started = time.perf_counter()
 
-@app.route('/webhook/liqpay', methods=['POST'])
-def liqpay_webhook():
+@app.after_request
+def record_request_latency(response):
+    started = g.pop('request_started', None)
+    if started is not None and request.endpoint and request.endpoint != 'metrics_endpoint':
+        metrics.WEBHOOK_LATENCY.observe(time.perf_counter() - started, request.endpoint, str(response.status_code))
+    return response
+
+@app.route('/metrics', methods=['GET'])
+def metrics_endpoint():
+    return metrics.registry.render(), 200, {'Content-Type': metrics.CONTENT_TYPE}
+
+
+def share_bot(shared_bot, notifier: AdminNotifier, profiles: UserProfileCache):
+    """
+    Webhook-режим бота (см. bot_server): платежи используют Bot, рассылку
+    администраторам и кеш профилей приложения бота вместо собственных.
+    """
+    global bot, admin_notifier, user_profiles
+    bot, admin_notifier, user_profiles = shared_bot, notifier, profiles
+
+
+# --- ПРИЕМ ВЕБХУКОВ ---
+# Функции не зависят от веб-фреймворка: их вызывают и маршруты Flask, и bot_server.
+# Возвращают (тело, код, заголовки); блокируют поток до записи события на диск.
+
+def accept_liqpay(data: str | None, signature_from_liqpay: str | None) -> tuple:
     try:
-        data = request.form.get('data')
-        signature_from_liqpay = request.form.get('signature')
-        if not data or not signature_from_liqpay: abort(400)
+        if not data or not signature_from_liqpay:
+            return 'Bad Request', 400, {}
 
         expected_signature = base64.b64encode(hashlib.sha1(
             (LIQPAY_PRIVATE_KEY + data + LIQPAY_PRIVATE_KEY).encode('utf-8')
@@ -213,7 +440,7 @@ def liqpay_webhook():
 
         if expected_signature != signature_from_liqpay:
             logger.error("!!! КРИТИЧЕСКИЙ: ПОДДЕЛКА ПОДПИСИ В ВЕБХУКЕ LIQPAY !!!")
-            abort(403)
+            return 'Forbidden', 403, {}
 
         decoded_data = json.loads(base64.b64decode(data).decode('utf-8'))
         logger.info(f"Получен валидный вебхук от LiqPay: {decoded_data}")
@@ -221,62 +448,65 @@ def liqpay_webhook():
         order_id = decoded_data.get('order_id')
         status = decoded_data.get('status')
 
-        if not order_id or not status: abort(400)
+        if not order_id or not status:
+            return 'Bad Request', 400, {}
         
-        # === ИЗМЕНЕНИЕ: ЗАПУСК В ФОНОВОМ ПОТОКЕ ===
-        if status.lower() in ['success', 'sandbox']:
-            thread = threading.Thread(target=run_async_in_thread, args=(process_successful_payment, order_id, "LiqPay"))
-            thread.start()
-        else:
-            thread = threading.Thread(target=run_async_in_thread, args=(process_unsuccessful_payment, order_id, "LiqPay", status))
-            thread.start()
+        # Событие сохраняется в журнал и обрабатывается движком в фоне;
+        # если записать не удалось, просим повторить позже
+        if not engine.record("LiqPay", order_id, status, json.dumps(decoded_data, ensure_ascii=False)):
+            return busy_response()
         
-        # Мгновенно отвечаем OK
-        return 'OK', 200
+        # Отвечаем OK только после записи события на диск
+        return 'OK', 200, {}
         
     except Exception as e:
         logger.error(f"Ошибка в обработчике вебхука LiqPay: {e}")
-        abort(500)
+        return 'Internal Server Error', 500, {}
 
-@app.route('/webhook/monobank', methods=['POST'])
-def monobank_webhook():
+def accept_monobank(data: dict | None) -> tuple:
     try:
-        data = request.json
         logger.info(f"Получен вебхук от Monobank: {data}")
-        if not data: abort(400)
+        if not data or not isinstance(data, dict):
+            return 'Bad Request', 400, {}
             
         order_id = data.get('reference')
         status = data.get('status')
         
         if not order_id or not status:
-            return 'OK', 200 
+            return 'OK', 200, {}
         
-        # === ИЗМЕНЕНИЕ: ЗАПУСК В ФОНОВОМ ПОТОКЕ ===
-        if status.lower() == 'success':
-            thread = threading.Thread(target=run_async_in_thread, args=(process_successful_payment, order_id, "Monobank"))
-            thread.start()
-            
-        elif status in ['created', 'processing']:
+        if status in ['created', 'processing']:
             logger.info(f"Получен промежуточный статус '{status}' для заказа {order_id}. Ожидаем финальный статус.")
-            # Это быстрая операция, ее можно оставить в основном потоке
-            conn = get_db_connection()
-            if conn:
-                conn.execute("UPDATE orders SET status = ? WHERE id = ? AND status = 'pending'", (status, order_id))
-                conn.commit()
-                conn.close()
-        else: 
-            thread = threading.Thread(target=run_async_in_thread, args=(process_unsuccessful_payment, order_id, "Monobank", status))
-            thread.start()
+
+        # Событие сохраняется в журнал и обрабатывается движком в фоне;
+        # если записать не удалось, просим повторить позже
+        if not engine.record("Monobank", order_id, status, json.dumps(data, ensure_ascii=False)):
+            return busy_response()
         
-        # Мгновенно отвечаем OK
-        return 'OK', 200
+        # Отвечаем OK только после записи события на диск
+        return 'OK', 200, {}
     except Exception as e:
         logger.error(f"Ошибка в обработчике вебхука Monobank: {e}")
-        abort(500)
+        return 'Internal Server Error', 500, {}
+
+
+# --- ЭНДПОИНТЫ (URL) ДЛЯ ПРИЕМА ВЕБХУКОВ ---
+
+@app.route('/webhook/liqpay', methods=['POST'])
+def liqpay_webhook():
+    return accept_liqpay(request.form.get('data'), request.form.get('signature'))
+
+@app.route('/webhook/monobank', methods=['POST'])
+def monobank_webhook():
+    return accept_monobank(request.get_json(silent=True))
 
 # --- ЗАПУСК СЕРВЕРА ---
 
 if __name__ == '__main__':
     logger.info("Запуск веб-сервера для вебхуков...")
-    # Для продакшена используйте gunicorn или waitress вместо app.run()
-    app.run(host='0.0.0.0', port=8000, debug=False)
\ No newline at end of file
+    engine.start()
+    try:
+        # Для продакшена используйте gunicorn или waitress вместо app.run()
+        app.run(host='0.0.0.0', port=8000, debug=False)
+    finally:
+        engine.shutdown()
\ No newline at end of file